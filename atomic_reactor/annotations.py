@@ -0,0 +1,157 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+Compact encoding of large build annotations
+"""
+
+from __future__ import unicode_literals
+
+import base64
+import gzip
+import io
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# annotations holding JSON documents, other annotations are never encoded
+JSON_ANNOTATIONS = (
+    'digests',
+    'filesystem',
+    'help_file',
+    'media-types',
+    'parent_images',
+    'plugins-metadata',
+    'repositories',
+    'tar_metadata',
+    'worker-builds',
+)
+
+# JSON text can't start with these, so encoded values are unambiguous
+COMPRESSED_PREFIX = 'gzip+base64:'
+CONFIG_MAP_PREFIX = 'configmap:'
+
+
+def compress_annotation(value):
+    """
+    :param value: str, annotation value
+    :return: str, gzip+base64 encoded value
+    """
+    buf = io.BytesIO()
+    # constant mtime keeps the encoding of a value stable
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+        f.write(value.encode('utf-8'))
+    return COMPRESSED_PREFIX + base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+def encode_annotations(annotations, compress_threshold=None, config_map_threshold=None,
+                       config_map_name=None):
+    """
+    Compress large JSON annotations, optionally moving them to a ConfigMap
+
+    Values longer than compress_threshold are compressed. Values still
+    longer than config_map_threshold are then replaced by a reference
+    to the same key in ConfigMap config_map_name, which the caller has
+    to create with the returned data.
+
+    :param annotations: dict, annotation name -> str value
+    :param compress_threshold: int, min length of values to compress, None not to compress
+    :param config_map_threshold: int, min length of values to move to the ConfigMap,
+                                 None to keep all values in annotations
+    :param config_map_name: str, name of ConfigMap for large values
+    :return: tuple, (dict of encoded annotations, dict of ConfigMap data)
+    """
+    encoded = dict(annotations)
+    config_map_data = {}
+    for key in JSON_ANNOTATIONS:
+        value = encoded.get(key)
+        if value is None:
+            continue
+
+        if compress_threshold is not None and len(value) > compress_threshold:
+            compressed = compress_annotation(value)
+            logger.debug('compressed annotation %s from %d to %d bytes',
+                         key, len(value), len(compressed))
+            value = compressed
+
+        if config_map_threshold is not None and len(value) > config_map_threshold:
+            if not config_map_name:
+                raise ValueError('ConfigMap name needed for annotation {}'.format(key))
+            config_map_data[key] = value
+            value = '{}{}:{}'.format(CONFIG_MAP_PREFIX, config_map_name, key)
+
+        encoded[key] = value
+
+    return encoded, config_map_data
+
+
+class AnnotationDecoder(object):
+    """
+    Decoder of annotations produced by encode_annotations()
+
+    ConfigMaps referenced by annotations are fetched once and the names
+    of all ConfigMaps read are kept in config_maps.
+    """
+
+    def __init__(self, osbs=None):
+        """
+        :param osbs: OSBS instance to read referenced ConfigMaps with
+        """
+        self.osbs = osbs
+        self.config_maps = {}
+
+    def decode(self, value):
+        """
+        :param value: str, annotation value, possibly encoded
+        :return: str, original annotation value
+        """
+        if value.startswith(CONFIG_MAP_PREFIX):
+            name, key = value[len(CONFIG_MAP_PREFIX):].rsplit(':', 1)
+            value = self._get_config_map(name).get_data_by_key(key)
+
+        if value.startswith(COMPRESSED_PREFIX):
+            data = base64.b64decode(value[len(COMPRESSED_PREFIX):])
+            with gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb') as f:
+                value = f.read().decode('utf-8')
+
+        return value
+
+    def decode_annotations(self, annotations):
+        """
+        :param annotations: dict, annotation name -> str value, possibly encoded
+        :return: dict, annotations with original values
+        """
+        decoded = dict(annotations)
+        for key in JSON_ANNOTATIONS:
+            if decoded.get(key) is not None:
+                decoded[key] = self.decode(decoded[key])
+        return decoded
+
+    def load(self, value):
+        """
+        :param value: str, JSON annotation value, possibly encoded
+        :return: decoded JSON document
+        """
+        return json.loads(self.decode(value))
+
+    def _get_config_map(self, name):
+        if name not in self.config_maps:
+            if self.osbs is None:
+                raise ValueError('annotation stored in ConfigMap {} but no OpenShift session'
+                                 .format(name))
+            self.config_maps[name] = self.osbs.get_config_map(name)
+        return self.config_maps[name]
+
+
+def decode_annotations(annotations, osbs=None):
+    """
+    :param annotations: dict, annotation name -> str value, possibly encoded
+    :param osbs: OSBS instance to read referenced ConfigMaps with
+    :return: dict, annotations with original values
+    """
+    return AnnotationDecoder(osbs).decode_annotations(annotations)
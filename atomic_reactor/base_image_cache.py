@@ -0,0 +1,114 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+Node-local index of parent images pulled by digest
+"""
+
+from __future__ import unicode_literals
+
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from atomic_reactor.constants import DEFAULT_BASE_IMAGE_CACHE_ENTRIES
+
+
+logger = logging.getLogger(__name__)
+
+
+class BaseImageCache(object):
+    """
+    Index of parent images kept on the docker daemon between builds
+
+    Parent images are referenced by digest (registry/repo@sha256:...), so
+    an image already present on the node can be reused without asking the
+    registry for its layers. The index records when each image was last
+    used by a build; when it grows over its limit, least recently used
+    images are returned from record() so the caller can remove them.
+
+    The index is shared by all builds running on the node and is updated
+    under a file lock.
+    """
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, path, max_entries=DEFAULT_BASE_IMAGE_CACHE_ENTRIES):
+        """
+        :param path: str, directory to keep the index in
+        :param max_entries: int, max number of images kept on the node
+        """
+        self.path = path
+        self.max_entries = max_entries
+
+    def record(self, image, keep=()):
+        """
+        Mark image as used just now
+
+        :param image: str, image reference including digest
+        :param keep: iterable of str, image references which must not be evicted
+        :return: list of str, evicted image references
+        """
+        keep = set(keep)
+        keep.add(image)
+        with self._index() as index:
+            index[image] = time.time()
+            evicted = []
+            for _, name in sorted((used, name) for name, used in index.items()
+                                  if name not in keep):
+                if len(index) <= self.max_entries:
+                    break
+                logger.debug('evicting %s from base image cache', name)
+                del index[name]
+                evicted.append(name)
+
+        return evicted
+
+    def get_images(self):
+        """
+        :return: list of str, image references in the index, most recently used first
+        """
+        with self._index() as index:
+            return sorted(index, key=index.get, reverse=True)
+
+    @contextmanager
+    def _index(self):
+        try:
+            os.makedirs(self.path)
+        except OSError:
+            # may have been created by another build in the meantime
+            if not os.path.isdir(self.path):
+                raise
+
+        index_path = os.path.join(self.path, self.INDEX_FILE)
+        with open(os.path.join(self.path, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = {}
+                if os.path.exists(index_path):
+                    try:
+                        with open(index_path) as f:
+                            index = json.load(f)
+                    except ValueError:
+                        logger.warning('ignoring corrupted base image cache index %s',
+                                       index_path)
+
+                yield index
+
+                fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix='.' + self.INDEX_FILE)
+                try:
+                    with os.fdopen(fd, 'w') as f:
+                        json.dump(index, f)
+                    os.rename(tmp_path, index_path)
+                except Exception:
+                    os.unlink(tmp_path)
+                    raise
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
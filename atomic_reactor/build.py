@@ -128,8 +128,11 @@ class InsideBuilder(LastLogger, BuilderStateMachine):
     This is expected to run within container
     """
 
-    def __init__(self, source, image, **kwargs):
+    def __init__(self, source, image, workflow=None, **kwargs):
         """
+        :param source: Source instance
+        :param image: str, name of the image to build
+        :param workflow: DockerBuildWorkflow instance, whose Dockerfile parsers are shared
         """
         LastLogger.__init__(self)
         BuilderStateMachine.__init__(self)
@@ -153,6 +156,7 @@ class InsideBuilder(LastLogger, BuilderStateMachine):
         self.image_id = None
         self.built_image_info = None
         self.image = ImageName.parse(image)
+        self.workflow = workflow
 
         # get info about base image from dockerfile
         build_file_path, build_file_dir = self.source.get_build_file_path()
@@ -175,7 +179,7 @@ class InsideBuilder(LastLogger, BuilderStateMachine):
 
     def set_df_path(self, path):
         self._df_path = path
-        dfp = df_parser(path)
+        dfp = df_parser(path, workflow=self.workflow)
         base = dfp.baseimage
         if base is None:
             raise RuntimeError("no base image specified in Dockerfile")
@@ -0,0 +1,205 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+Docker build context archives
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import logging
+import os
+import stat
+import tarfile
+import tempfile
+import time
+
+from docker.utils import exclude_paths, tar
+
+from atomic_reactor.constants import (DEFAULT_BUILD_CONTEXT_CACHE_ENTRIES,
+                                      DEFAULT_DOWNLOAD_BLOCK_SIZE)
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_dockerignore(path):
+    """
+    Read exclude patterns from .dockerignore in build context,
+    the same way docker-py does
+
+    :param path: str, path to build context directory
+    :return: list of str, exclude patterns, or None if there is no .dockerignore
+    """
+    dockerignore = os.path.join(path, '.dockerignore')
+    if not os.path.exists(dockerignore):
+        return None
+
+    with open(dockerignore, 'r') as f:
+        return [line.strip() for line in f.read().splitlines()
+                if line.strip() and not line.strip().startswith('#')]
+
+
+class BuildContext(object):
+    """
+    Tar archive of docker build context
+
+    The archive is created once and can be streamed to the docker daemon
+    any number of times. With cache_dir, archives are stored under a hash
+    of the context contents, so identical contexts are only archived once,
+    also when cloned again by another build. Cached archives don't keep
+    modification times and owners of files, so that they only depend on
+    the hashed contents.
+
+    usage:
+
+        with BuildContext(path, cache_dir=cache_dir) as context:
+            with open(context.archive, 'rb') as f:
+                ...
+    """
+
+    def __init__(self, path, cache_dir=None, max_cached=DEFAULT_BUILD_CONTEXT_CACHE_ENTRIES):
+        """
+        :param path: str, path to build context directory
+        :param cache_dir: str, directory to keep context archives in
+        :param max_cached: int, max number of archives kept in cache_dir
+        """
+        self.path = path
+        self.cache_dir = cache_dir
+        self.max_cached = max_cached
+        # path to the archive, available while in context
+        self.archive = None
+        # content hash of build context
+        self.digest = None
+        # size of the archive in bytes
+        self.size = None
+        # seconds spent creating the archive, 0 if taken from cache
+        self.tar_time = None
+        self.cached = False
+
+    def __enter__(self):
+        exclude = read_dockerignore(self.path)
+        if self.cache_dir:
+            self.digest = self.compute_digest(exclude)
+            self.archive = os.path.join(self.cache_dir, self.digest + '.tar')
+            if os.path.exists(self.archive):
+                # mark as recently used
+                os.utime(self.archive, None)
+                self.cached = True
+                self.tar_time = 0
+            else:
+                if not os.path.isdir(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                self._create_archive(exclude, self.archive)
+                self._prune_cache()
+        else:
+            fd, self.archive = tempfile.mkstemp(prefix='build-context-', suffix='.tar')
+            os.close(fd)
+            self._create_archive(exclude, self.archive)
+
+        self.size = os.path.getsize(self.archive)
+        logger.info("build context: %.1f MiB, archived in %.2fs%s",
+                    self.size / 1024.0 / 1024, self.tar_time,
+                    ' (cached)' if self.cached else '')
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self.cache_dir and self.archive:
+            os.unlink(self.archive)
+        self.archive = None
+
+    def compute_digest(self, exclude=None):
+        """
+        Compute hash of names, modes and contents of files in build context,
+        and of targets of symlinks
+
+        :param exclude: list of str, .dockerignore patterns
+        :return: str, hex digest
+        """
+        digest = hashlib.sha256()
+        for name in sorted(exclude_paths(self.path, exclude or [])):
+            full_path = os.path.join(self.path, name)
+            st = os.lstat(full_path)
+            digest.update('{}\0{:o}\0'.format(name, st.st_mode).encode('utf-8'))
+            if stat.S_ISLNK(st.st_mode):
+                digest.update(os.readlink(full_path).encode('utf-8'))
+            elif stat.S_ISREG(st.st_mode):
+                with open(full_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(DEFAULT_DOWNLOAD_BLOCK_SIZE), b''):
+                        digest.update(chunk)
+            digest.update(b'\0')
+
+        return digest.hexdigest()
+
+    def get_info(self):
+        """
+        :return: dict, size of the archive in bytes, seconds spent creating
+                 it and whether it was taken from cache
+        """
+        return {
+            'size': self.size,
+            'tar_time': self.tar_time,
+            'cached': self.cached,
+        }
+
+    def _create_archive(self, exclude, archive):
+        start = time.time()
+        # write to a temporary file first, so that concurrent builds
+        # never see an incomplete archive
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(archive),
+                                        prefix='.' + os.path.basename(archive))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if self.cache_dir:
+                    self._write_normalized_tar(exclude, f)
+                else:
+                    tar(self.path, exclude=exclude, fileobj=f)
+            os.rename(tmp_path, archive)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        self.tar_time = time.time() - start
+
+    def _write_normalized_tar(self, exclude, fileobj):
+        # like docker.utils.tar, but without anything compute_digest
+        # doesn't cover: modification times, owners and hard links
+        with tarfile.open(mode='w', fileobj=fileobj) as archive:
+            for name in sorted(exclude_paths(self.path, exclude or [])):
+                full_path = os.path.join(self.path, name)
+                # hard links are recorded per inode, store contents instead
+                archive.inodes = {}
+                info = archive.gettarinfo(full_path, arcname=name)
+                if info is None:
+                    # sockets
+                    continue
+                info.mtime = 0
+                info.uid = info.gid = 0
+                info.uname = info.gname = ''
+                if info.isfile():
+                    with open(full_path, 'rb') as f:
+                        archive.addfile(info, f)
+                else:
+                    archive.addfile(info)
+
+    def _prune_cache(self):
+        archives = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.tar') or name.startswith('.'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                archives.append((os.stat(path).st_mtime, path))
+            except OSError:
+                continue
+
+        archives.sort(reverse=True)
+        for _, path in archives[self.max_cached:]:
+            logger.debug("removing %s from build context cache", path)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
@@ -67,6 +67,20 @@ TOOLS_USED = (
 )
 
 DEFAULT_DOWNLOAD_BLOCK_SIZE = 10 * 1024 * 1024  # 10Mb
+# number of files downloaded in parallel
+DEFAULT_DOWNLOAD_WORKERS = 8
+# max number of simultaneous connections to a single host while downloading
+DEFAULT_DOWNLOAD_CONNECTIONS_PER_HOST = 4
+# how many times a download interrupted by network errors is restarted
+DEFAULT_DOWNLOAD_RETRIES = 3
+# size limit of node-local cache of downloaded files
+DEFAULT_DOWNLOAD_CACHE_MAX_SIZE = 10 * 1024 * 1024 * 1024  # 10Gb
+# max number of build context archives kept in cache
+DEFAULT_BUILD_CONTEXT_CACHE_ENTRIES = 10
+# max number of parent images pulled at the same time
+DEFAULT_PARENT_PULL_WORKERS = 4
+# max number of parent images kept on the node between builds
+DEFAULT_BASE_IMAGE_CACHE_ENTRIES = 20
 
 TAG_NAME_REGEX = r'^[\w][\w.-]{0,127}$'
 
@@ -115,6 +129,14 @@ DOCKER_MAX_RETRIES = 3
 DOCKER_BACKOFF_FACTOR = 5
 # docker retries statuses
 DOCKER_CLIENT_STATUS_RETRY = (408, 500, 502, 503, 504)
+# seconds for which image metadata are reused without asking docker again
+DOCKER_IMAGE_INFO_TTL = 60
+# max number of containers, volumes and images removed at the same time
+DEFAULT_CLEANUP_WORKERS = 4
+# seconds to wait for removal of containers, volumes and images at the end of build
+DEFAULT_CLEANUP_TIMEOUT = 300
+# seconds to wait for removals still pending after all exit plugins ran
+FINAL_CLEANUP_TIMEOUT = 30
 # max retries for http requests
 HTTP_MAX_RETRIES = 3
 # how many seconds should wait before another try of http request
@@ -131,6 +153,8 @@ GIT_BACKOFF_FACTOR = 5
 LOCKEDPULPREPOSITORY_RETRIES = 10
 # how many seconds to wait before 1st retry; doubles each retry
 LOCKEDPULPREPOSITORY_BACKOFF = 5
+# max number of Pulp repositories operated on at the same time
+DEFAULT_PULP_WORKERS = 4
 
 # Media types
 MEDIA_TYPE_DOCKER_V1 = "application/json"
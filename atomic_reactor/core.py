@@ -22,21 +22,30 @@ I've tried to be as much consistent (man pages were source) with docker as possi
 
 
 """
+import calendar
 import os
+import re
 import shutil
 import logging
 import tempfile
 import json
 import requests
+import threading
 import time
+import copy
 import docker
 import atomic_reactor.util
 from docker.errors import APIError
 from functools import wraps
-
-from atomic_reactor.constants import CONTAINER_SHARE_PATH, CONTAINER_SHARE_SOURCE_SUBDIR,\
-        BUILD_JSON, DOCKER_SOCKET_PATH, DOCKER_MAX_RETRIES, DOCKER_BACKOFF_FACTOR,\
-        DOCKER_CLIENT_STATUS_RETRY
+from six import string_types
+from multiprocessing.pool import ThreadPool
+
+from atomic_reactor.constants import (CONTAINER_SHARE_PATH, CONTAINER_SHARE_SOURCE_SUBDIR,
+                                      BUILD_JSON, DOCKER_SOCKET_PATH, DOCKER_MAX_RETRIES,
+                                      DOCKER_BACKOFF_FACTOR, DOCKER_CLIENT_STATUS_RETRY,
+                                      DOCKER_IMAGE_INFO_TTL, DEFAULT_CLEANUP_WORKERS,
+                                      DEFAULT_CLEANUP_TIMEOUT)
+from atomic_reactor.build_context import BuildContext
 from atomic_reactor.source import get_source_instance_for
 from atomic_reactor.util import (
     ImageName, clone_git_repo, figure_out_build_file, Dockercfg)
@@ -263,6 +272,175 @@ class WrappedDocker(object):
             return orig_attr
 
 
+class CleanupQueue(object):
+    """
+    Containers, volumes and images to remove in the background
+
+    Removals start as soon as they are queued and run concurrently, so they
+    don't add to the duration of the build. Volumes of a container are
+    removed after the container itself. Failures are logged and reported,
+    never raised.
+    """
+
+    KINDS = ('containers', 'volumes', 'images')
+
+    def __init__(self, tasker, workers=DEFAULT_CLEANUP_WORKERS):
+        """
+        :param tasker: DockerTasker instance
+        :param workers: int, max number of removals running at the same time
+        """
+        self.tasker = tasker
+        self.workers = workers
+        self._pool = None
+        # list of (kind, name, AsyncResult), in order of queueing
+        self._queued = []
+        self._lock = threading.Lock()
+
+    def remove_container(self, container_id, force=False, remove_volumes=True):
+        """
+        queue container for removal
+
+        :param container_id: str
+        :param force: bool, remove forcefully?
+        :param remove_volumes: bool, remove also volumes mounted in the container
+        """
+        self._submit('containers', container_id, self._remove_container,
+                     container_id, force, remove_volumes)
+
+    def remove_volume(self, volume_name):
+        """
+        queue volume for removal
+
+        :param volume_name: str
+        """
+        self._submit('volumes', volume_name, self.tasker.remove_volume, volume_name)
+
+    def remove_image(self, image_id, force=False):
+        """
+        queue image for removal
+
+        :param image_id: str or ImageName
+        :param force: bool, remove even if used by a container?
+        """
+        if isinstance(image_id, ImageName):
+            image_id = image_id.to_str()
+        self._submit('images', image_id, self.tasker.remove_image, image_id, force=force)
+
+    def get_report(self):
+        """
+        report state of queued removals without waiting for them
+
+        :return: dict, for each kind of object a dict with lists of names
+                 of 'removed' and 'pending' objects and a dict of 'failed'
+                 names mapped to error messages
+        """
+        with self._lock:
+            queued = list(self._queued)
+
+        report = {kind: {'removed': [], 'failed': {}, 'pending': []} for kind in self.KINDS}
+        for kind, name, result in queued:
+            if not result.ready():
+                report[kind]['pending'].append(name)
+                continue
+
+            error = result.get()
+            if error is None:
+                report[kind]['removed'].append(name)
+            else:
+                report[kind]['failed'][name] = error
+
+        return report
+
+    def flush(self, timeout=DEFAULT_CLEANUP_TIMEOUT):
+        """
+        wait for queued removals to finish
+
+        Removals which don't finish in time are left running in the
+        background and reported as pending.
+
+        :param timeout: float, max number of seconds to wait
+        :return: dict, see get_report
+        """
+        deadline = time.time() + timeout
+        while True:
+            with self._lock:
+                queued = list(self._queued)
+            # removing containers queues removal of their volumes
+            for _, _, result in queued:
+                result.wait(max(deadline - time.time(), 0))
+            with self._lock:
+                if len(self._queued) == len(queued):
+                    break
+            if time.time() >= deadline:
+                break
+
+        report = self.get_report()
+        for kind in self.KINDS:
+            if report[kind]['failed']:
+                logger.warning("%d %s failed to be removed: %s", len(report[kind]['failed']),
+                               kind, sorted(report[kind]['failed']))
+            if report[kind]['pending']:
+                logger.warning("%d %s not removed within %ss: %s", len(report[kind]['pending']),
+                               kind, timeout, report[kind]['pending'])
+        return report
+
+    def _submit(self, kind, name, func, *args, **kwargs):
+        def remove():
+            try:
+                func(*args, **kwargs)
+            except APIError as ex:
+                if ex.response is not None and ex.response.status_code == requests.codes.not_found:
+                    logger.debug("%s %s already removed", kind, name)
+                    return None
+                status = ex.response.status_code if ex.response is not None else None
+                logger.warning("failed to remove %s %s (%s: %s), ignoring", kind, name,
+                               status, ex.explanation)
+                return repr(ex)
+            except Exception as ex:
+                logger.warning("failed to remove %s %s: %r, ignoring", kind, name, ex)
+                return repr(ex)
+            return None
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+            logger.debug("queueing removal of %s %s", kind, name)
+            self._queued.append((kind, name, self._pool.apply_async(remove)))
+
+    def _remove_container(self, container_id, force, remove_volumes):
+        volumes = []
+        if remove_volumes:
+            volumes = self.tasker.get_volumes_for_container(container_id)
+        try:
+            self.tasker.remove_container(container_id, force=force)
+        finally:
+            for volume_name in volumes:
+                self.remove_volume(volume_name)
+
+
+def _created_timestamp(created):
+    """
+    convert image creation time reported by `docker inspect`, an RFC 3339
+    string, to seconds since epoch, as reported by `docker images`
+
+    :param created: str, e.g. '2018-01-29T14:04:36.123456789Z'
+    :return: int, or created itself if it can't be converted
+    """
+    if not isinstance(created, string_types):
+        return created
+
+    match = re.match(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.\d+)?'
+                     r'(?:Z|([+-])(\d\d):(\d\d))$', created)
+    if not match:
+        return created
+
+    timestamp = calendar.timegm(time.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S'))
+    if match.group(2):
+        offset = int(match.group(3)) * 3600 + int(match.group(4)) * 60
+        timestamp -= offset if match.group(2) == '+' else -offset
+    return timestamp
+
+
 class DockerTasker(LastLogger):
     def __init__(self, base_url=None, retry_times=DOCKER_MAX_RETRIES,
                  timeout=120, **kwargs):
@@ -287,6 +465,53 @@ class DockerTasker(LastLogger):
 
         self.d = WrappedDocker(**client_kwargs)
 
+        # short-lived memo of image metadata, keyed by image name or id;
+        # any operation which changes images on the daemon invalidates it
+        self.image_info_ttl = DOCKER_IMAGE_INFO_TTL
+        self._image_info = {}
+        self._image_info_lock = threading.Lock()
+
+        self.cleanup_queue = CleanupQueue(self)
+
+    def _inspect_image_memoized(self, image_id):
+        """
+        inspect image, reusing recent metadata of the same image
+
+        :param image_id: str, id or name of the image
+        :return: dict
+        """
+        now = time.time()
+        with self._image_info_lock:
+            entry = self._image_info.get(image_id)
+            if entry and now - entry[0] < self.image_info_ttl:
+                logger.debug("using memoized metadata of image '%s'", image_id)
+                return copy.deepcopy(entry[1])
+
+        image_metadata = self.d.inspect_image(image_id)
+        if image_metadata is not None:
+            with self._image_info_lock:
+                self._image_info[image_id] = (now, image_metadata)
+        return copy.deepcopy(image_metadata)
+
+    def invalidate_image_info(self):
+        """
+        forget memoized image metadata, e.g. when images were changed
+        by something else than this tasker
+        """
+        with self._image_info_lock:
+            self._image_info.clear()
+
+    def _invalidate_image_info_after(self, logs_gen):
+        """
+        invalidate memoized image metadata once the operation streaming
+        logs_gen finishes, e.g. after the built image is tagged
+        """
+        try:
+            for item in logs_gen:
+                yield item
+        finally:
+            self.invalidate_image_info()
+
     def retry_generator(self, function, *args, **kwargs):
         retry_times = int(kwargs.pop('retry_times', self.retry_times))
         retry_delay = DOCKER_BACKOFF_FACTOR
@@ -323,7 +548,8 @@ class DockerTasker(LastLogger):
 
             return cmd_result
 
-    def build_image_from_path(self, path, image, use_cache=False, remove_im=True):
+    def build_image_from_path(self, path, image, use_cache=False, remove_im=True,
+                              context_cache_dir=None, context_info=None):
         """
         build image from provided path and tag it
 
@@ -335,13 +561,28 @@ class DockerTasker(LastLogger):
         :param stream: bool, True returns generator, False returns str
         :param use_cache: bool, True if you want to use cache
         :param remove_im: bool, remove intermediate containers produced during docker build
+        :param context_cache_dir: str, directory to cache build context archives in
+        :param context_info: dict, updated with BuildContext.get_info() of the build context
         :return: generator
         """
         logger.info("building image '%s' from path '%s'", image, path)
-        response = self.d.build(path=path, tag=image.to_str(),
-                                nocache=not use_cache, decode=True,
-                                rm=remove_im, forcerm=True, pull=False)  # returns generator
-        return response
+        with BuildContext(path, cache_dir=context_cache_dir) as context:
+            if context_info is not None:
+                context_info.update(context.get_info())
+            # the context is uploaded before the build starts, so the archive
+            # is not needed anymore once build() returns
+            with open(context.archive, 'rb') as context_file:
+                def build():
+                    # rewind the archive for retries
+                    context_file.seek(0)
+                    return self.d.wrapped.build(fileobj=context_file, custom_context=True,
+                                                tag=image.to_str(), nocache=not use_cache,
+                                                decode=True, rm=remove_im, forcerm=True,
+                                                pull=False)  # returns generator
+
+                response = retry(build, retry=self.retry_times)
+        self.invalidate_image_info()
+        return self._invalidate_image_info_after(response)
 
     def build_image_from_git(self, url, image, git_path=None, git_commit=None,
                              copy_dockerfile_to=None,
@@ -436,6 +677,7 @@ class DockerTasker(LastLogger):
             tag = image.tag
             image = image.to_str(tag=False)
         response = self.d.commit(container_id, repository=image, tag=tag, message=message)
+        self.invalidate_image_info()
         logger.debug("response = '%s'", response)
         try:
             return response['Id']
@@ -443,34 +685,56 @@ class DockerTasker(LastLogger):
             logger.error("ID missing from commit response")
             raise RuntimeError("ID missing from commit response")
 
+    def _get_image_info(self, image_id):
+        """
+        inspect image, return None if it doesn't exist
+
+        The metadata are converted to the format of `docker images`, which
+        the info lookups have always returned.
+
+        :param image_id: str, id or name of the image
+        :return: dict or None
+        """
+        try:
+            inspect_data = self._inspect_image_memoized(image_id)
+        except docker.errors.NotFound:
+            return None
+        if inspect_data is None:
+            return None
+
+        return {
+            'Id': inspect_data.get('Id'),
+            'ParentId': inspect_data.get('Parent') or '',
+            'RepoTags': inspect_data.get('RepoTags') or [],
+            'RepoDigests': inspect_data.get('RepoDigests') or [],
+            'Created': _created_timestamp(inspect_data.get('Created')),
+            'Size': inspect_data.get('Size'),
+            'VirtualSize': inspect_data.get('VirtualSize'),
+            'Labels': (inspect_data.get('Config') or {}).get('Labels'),
+        }
+
     def get_image_info_by_image_id(self, image_id):
         """
-        using `docker images`, provide information about an image
+        using `docker inspect`, provide information about an image
 
         :param image_id: str, hash of image to get info
-        :return: str or None
+        :return: dict or None
         """
         logger.info("getting info about provided image specified by image_id '%s'", image_id)
         logger.debug("image_id = '%s'", image_id)
-        # returns list of
-        # {u'Created': 1414577076,
-        #  u'Id': u'3ab9a7ed8a169ab89b09fb3e12a14a390d3c662703b65b4541c0c7bde0ee97eb',
-        #  u'ParentId': u'a79ad4dac406fcf85b9c7315fe08de5b620c1f7a12f45c8185c843f4b4a49c4e',
-        #  u'RepoTags': [u'buildroot-fedora:latest'],
-        #  u'Size': 0,
-        #  u'VirtualSize': 856564160}
-        images = self.d.images()
-        try:
-            image_dict = [i for i in images if i['Id'] == image_id][0]
-        except IndexError:
+        image_dict = self._get_image_info(image_id)
+        # inspect also accepts names and id prefixes, only look for exact id
+        if image_dict is None or image_dict.get('Id') != image_id:
             logger.info("image not found")
             return None
-        else:
-            return image_dict
+        return image_dict
 
     def get_image_info_by_image_name(self, image, exact_tag=True):
         """
-        using `docker images`, provide information about an image
+        provide information about an image
+
+        Exact lookups use `docker inspect`, only lookups of all tags list
+        images with `docker images`.
 
         :param image: ImageName, name of image
         :param exact_tag: bool, if false then return info for all images of the
@@ -480,6 +744,19 @@ class DockerTasker(LastLogger):
         logger.info("getting info about provided image specified by name '%s'", image)
         logger.debug("image_name = '%s'", image)
 
+        if exact_tag:
+            # tag is specified, we are looking for the exact image
+            name = image.to_str(explicit_tag=True)
+            found_image = self._get_image_info(name)
+            # docker falls back to other registries when inspecting by name,
+            # make sure the image is really known under this name
+            if found_image and (name in found_image['RepoTags'] or
+                                name in (found_image.get('RepoDigests') or [])):
+                logger.debug("image '%s' found", image)
+                return [found_image]
+            logger.debug("0 matching images found")
+            return []
+
         # returns list of
         # {u'Created': 1414577076,
         #  u'Id': u'3ab9a7ed8a169ab89b09fb3e12a14a390d3c662703b65b4541c0c7bde0ee97eb',
@@ -488,14 +765,6 @@ class DockerTasker(LastLogger):
         #  u'Size': 0,
         #  u'VirtualSize': 856564160}
         images = self.d.images(name=image.to_str(tag=False))
-        if exact_tag:
-            # tag is specified, we are looking for the exact image
-            for found_image in images:
-                if image.to_str(explicit_tag=True) in found_image['RepoTags']:
-                    logger.debug("image '%s' found", image)
-                    return [found_image]
-            images = []  # image not found
-
         logger.debug("%d matching images found", len(images))
         return images
 
@@ -520,6 +789,8 @@ class DockerTasker(LastLogger):
             command_result = self.retry_generator(self.d.pull,
                                                   image.to_str(tag=False),
                                                   tag=tag, decode=True, stream=True)
+        finally:
+            self.invalidate_image_info()
 
         self.last_logs = command_result.logs
         return image.to_str()
@@ -539,6 +810,7 @@ class DockerTasker(LastLogger):
             image = ImageName.parse(image)
 
         if image != target_image:
+            self.invalidate_image_info()
             response = self.d.tag(
                 image.to_str(),
                 target_image.to_str(tag=False),
@@ -633,7 +905,7 @@ class DockerTasker(LastLogger):
         logger.debug("image_id = '%s'", image_id)
         if isinstance(image_id, ImageName):
             image_id = image_id.to_str()
-        image_metadata = self.d.inspect_image(image_id)
+        image_metadata = self._inspect_image_memoized(image_id)
         return image_metadata
 
     def remove_image(self, image_id, force=False, noprune=False):
@@ -649,7 +921,10 @@ class DockerTasker(LastLogger):
         logger.debug("image_id = '%s'", image_id)
         if isinstance(image_id, ImageName):
             image_id = image_id.to_str()
-        self.d.remove_image(image_id, force=force, noprune=noprune)  # returns None
+        try:
+            self.d.remove_image(image_id, force=force, noprune=noprune)  # returns None
+        finally:
+            self.invalidate_image_info()
 
     def remove_container(self, container_id, force=False):
         """
@@ -704,8 +979,10 @@ class DockerTasker(LastLogger):
         """
         logger.info("checking whether image '%s' exists", image_id)
         logger.debug("image_id = '%s'", image_id)
+        if isinstance(image_id, ImageName):
+            image_id = image_id.to_str()
         try:
-            response = self.d.inspect_image(image_id)
+            response = self._inspect_image_memoized(image_id)
         except APIError as ex:
             logger.warning(repr(ex))
             response = False
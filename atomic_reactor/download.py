@@ -0,0 +1,363 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+Parallel download of files over HTTP(S)
+"""
+
+from __future__ import unicode_literals
+
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+from requests.exceptions import ChunkedEncodingError, ConnectionError, Timeout
+
+from atomic_reactor import util
+from atomic_reactor.constants import (DEFAULT_DOWNLOAD_BLOCK_SIZE, DEFAULT_DOWNLOAD_WORKERS,
+                                      DEFAULT_DOWNLOAD_CONNECTIONS_PER_HOST,
+                                      DEFAULT_DOWNLOAD_RETRIES, HTTP_BACKOFF_FACTOR,
+                                      DEFAULT_DOWNLOAD_CACHE_MAX_SIZE)
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+
+logger = logging.getLogger(__name__)
+
+# url: str, URL of the file
+# dest: str, path to store the file at
+# checksums: dict, expected checksums of the file, keyed by hashlib algorithm name
+# retries: int, how many times to restart interrupted download, None for the default
+FileDownload = namedtuple('FileDownload', 'url dest checksums retries')
+FileDownload.__new__.__defaults__ = (None,)
+
+DOWNLOADED_FILE_MODE = 0o644
+
+# errors after which it makes sense to restart the download
+RETRIABLE_ERRORS = (ConnectionError, ChunkedEncodingError, Timeout)
+
+# checksum algorithms usable as cache keys, in order of preference
+CACHE_KEY_ALGORITHMS = ('sha256', 'sha1', 'md5')
+
+
+class DownloadCache(object):
+    """
+    Node-local content-addressed store of downloaded files
+
+    Files are stored under the checksum declared for them, which is
+    verified before the file is added to the cache. When the total size of
+    the cache exceeds its limit, least recently used files are removed.
+    Files are provided from the cache by reflinking or hard linking, so a
+    cache hit costs neither network traffic nor a copy of the data. Files
+    are added to the cache by reflinking or copying them. As a provided
+    file may share its inode with the cache entry, the checksum of the
+    entry is verified on every hit, and modified entries are removed.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_DOWNLOAD_CACHE_MAX_SIZE):
+        """
+        :param path: str, directory to store the cached files in
+        :param max_size: int, max total size of cached files in bytes
+        """
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def fetch(self, checksums, dest):
+        """
+        Provide cached file with given checksums at dest
+
+        :param checksums: dict, checksums of the file, keyed by hashlib algorithm name
+        :param dest: str, path to put the file at
+        :return: bool, whether the file was found in the cache
+        """
+        entry = self._entry_path(checksums)
+        found = False
+        if entry:
+            try:
+                # mark the entry as recently used
+                os.utime(entry, None)
+            except OSError as exc:
+                if exc.errno != errno.ENOENT:
+                    raise
+            else:
+                if os.path.exists(dest):
+                    os.unlink(dest)
+                try:
+                    if self._verify_entry(entry, checksums):
+                        method = util.clone_file(entry, dest)
+                        logger.debug('%s provided from cache (%s)', dest, method)
+                        found = True
+                    else:
+                        logger.warning('%s was modified, removing it from download cache',
+                                       entry)
+                        os.unlink(entry)
+                except (IOError, OSError) as exc:
+                    # evicted in the meantime
+                    if exc.errno != errno.ENOENT:
+                        raise
+                    if os.path.exists(dest):
+                        os.unlink(dest)
+
+        with self._stats_lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return found
+
+    def store(self, checksums, path):
+        """
+        Add file with verified checksums to the cache
+
+        :param checksums: dict, checksums of the file, keyed by hashlib algorithm name
+        :param path: str, path to the file
+        """
+        entry = self._entry_path(checksums)
+        if not entry or os.path.exists(entry):
+            return
+
+        entry_dir = os.path.dirname(entry)
+        _makedirs(entry_dir)
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, prefix='.' + os.path.basename(entry),
+                                        suffix='.tmp')
+        os.close(fd)
+        try:
+            # never share the inode with the build's copy, which may be modified
+            util.clone_file(path, tmp_path, hardlink=False)
+            os.rename(tmp_path, entry)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def evict(self):
+        """Remove least recently used files until the cache fits its size limit"""
+        _makedirs(self.path)
+        with open(os.path.join(self.path, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                entries = []
+                total_size = 0
+                for algo in CACHE_KEY_ALGORITHMS:
+                    for dirpath, _, filenames in os.walk(os.path.join(self.path, algo)):
+                        for filename in filenames:
+                            if filename.startswith('.'):
+                                # temporary file of an entry being stored
+                                continue
+                            entry = os.path.join(dirpath, filename)
+                            try:
+                                stat = os.stat(entry)
+                            except OSError:
+                                continue
+                            entries.append((stat.st_mtime, stat.st_size, entry))
+                            total_size += stat.st_size
+
+                entries.sort()
+                for _, size, entry in entries:
+                    if total_size <= self.max_size:
+                        break
+                    logger.debug('removing %s from download cache', entry)
+                    os.unlink(entry)
+                    total_size -= size
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_stats(self):
+        """
+        :return: dict, number of cache hits and misses, and the hit ratio
+        """
+        with self._stats_lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / requests if requests else 0.0,
+            }
+
+    def _entry_key(self, checksums):
+        for algo in CACHE_KEY_ALGORITHMS:
+            digest = (checksums or {}).get(algo)
+            if digest:
+                return algo, digest.lower()
+
+        return None, None
+
+    def _entry_path(self, checksums):
+        algo, digest = self._entry_key(checksums)
+        if not algo:
+            return None
+
+        return os.path.join(self.path, algo, digest[:2], digest)
+
+    def _verify_entry(self, entry, checksums):
+        algo, digest = self._entry_key(checksums)
+        checksum = hashlib.new(algo)
+        with open(entry, 'rb') as f:
+            for chunk in iter(lambda: f.read(DEFAULT_DOWNLOAD_BLOCK_SIZE), b''):
+                checksum.update(chunk)
+
+        return checksum.hexdigest() == digest
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError:
+        # may have been created by another worker in the meantime
+        if not os.path.isdir(path):
+            raise
+
+
+class ParallelDownloader(object):
+    """
+    Download files in parallel using a bounded pool of worker threads
+
+    Connections are reused across downloads from the same host, and the
+    number of simultaneous connections to any single host is limited.
+    Checksums are computed while the file is being downloaded. Data are
+    written to a temporary file in the destination directory which is
+    renamed to the final name only once the download is complete and its
+    checksums verified.
+    """
+
+    def __init__(self, workers=DEFAULT_DOWNLOAD_WORKERS,
+                 connections_per_host=DEFAULT_DOWNLOAD_CONNECTIONS_PER_HOST,
+                 retries=DEFAULT_DOWNLOAD_RETRIES,
+                 block_size=DEFAULT_DOWNLOAD_BLOCK_SIZE,
+                 cache=None):
+        """
+        :param workers: int, max number of files downloaded at the same time
+        :param connections_per_host: int, max number of simultaneous connections
+                                     to a single host
+        :param retries: int, default number of times an interrupted download is restarted
+        :param block_size: int, size of chunks read from the network
+        :param cache: DownloadCache, cache to look files up in before downloading them
+        """
+        self.workers = workers
+        self.connections_per_host = connections_per_host
+        self.retries = retries
+        self.block_size = block_size
+        self.cache = cache
+        self.session = util.get_retrying_requests_session(pool_maxsize=connections_per_host)
+
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+
+    def download_all(self, downloads):
+        """
+        Download files, stop at the first failure
+
+        :param downloads: list<FileDownload>, files to download
+        """
+        downloads = list(downloads)
+        logger.debug('%d files to download', len(downloads))
+        if not downloads:
+            return
+
+        pool = ThreadPool(min(self.workers, len(downloads)))
+        try:
+            pool.map(self._download_indexed,
+                     [(index, len(downloads), download)
+                      for index, download in enumerate(downloads)])
+        finally:
+            pool.terminate()
+            pool.join()
+
+        if self.cache:
+            self.cache.evict()
+
+    def download(self, download):
+        """
+        Download single file, restarting the download on network errors
+
+        Files with known checksums are provided from the cache, if available.
+
+        :param download: FileDownload, file to download
+        """
+        dest_dir = os.path.dirname(download.dest)
+        if dest_dir:
+            _makedirs(dest_dir)
+
+        if self.cache and download.checksums:
+            if self.cache.fetch(download.checksums, download.dest):
+                return
+
+        retries = self.retries if download.retries is None else download.retries
+        if util.http_retries_disabled():
+            retries = 0
+
+        for attempt in range(retries + 1):
+            try:
+                with self._host_slot(download.url):
+                    self._fetch(download)
+                break
+            except RETRIABLE_ERRORS as exc:
+                if attempt == retries:
+                    raise
+
+                delay = HTTP_BACKOFF_FACTOR * 2 ** attempt
+                logger.warning('downloading %s failed (%s), retrying in %ss',
+                               download.url, exc, delay)
+                time.sleep(delay)
+
+        if self.cache and download.checksums:
+            self.cache.store(download.checksums, download.dest)
+
+    def _download_indexed(self, args):
+        index, count, download = args
+        logger.debug('%d/%d downloading %s', index + 1, count, download.url)
+        self.download(download)
+
+    def _fetch(self, download):
+        dest_dir = os.path.dirname(download.dest)
+        checksums = {algo: hashlib.new(algo) for algo in download.checksums or {}}
+        response = self.session.get(download.url, stream=True)
+        try:
+            response.raise_for_status()
+
+            fd, tmp_path = tempfile.mkstemp(dir=dest_dir or None,
+                                            prefix='.' + os.path.basename(download.dest))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=self.block_size):
+                        f.write(chunk)
+                        for checksum in checksums.values():
+                            checksum.update(chunk)
+
+                for algo, checksum in checksums.items():
+                    if checksum.hexdigest() != download.checksums[algo]:
+                        raise ValueError(
+                            'Computed {} checksum, {}, does not match expected checksum, {}'
+                            .format(algo, checksum.hexdigest(), download.checksums[algo]))
+
+                # mkstemp creates files readable only by the owner
+                os.chmod(tmp_path, DOWNLOADED_FILE_MODE)
+                os.rename(tmp_path, download.dest)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        finally:
+            response.close()
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self._host_slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.connections_per_host)
+            return self._host_slots[host]
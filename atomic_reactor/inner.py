@@ -17,6 +17,7 @@ import threading
 import os
 import time
 
+from atomic_reactor.core import CleanupQueue
 from atomic_reactor.build import InsideBuilder
 from atomic_reactor.plugin import (
     AutoRebuildCanceledException,
@@ -31,7 +32,7 @@ from atomic_reactor.plugin import (
 )
 from atomic_reactor.source import get_source_instance_for
 from atomic_reactor.constants import INSPECT_ROOTFS, INSPECT_ROOTFS_LAYERS
-from atomic_reactor.constants import CONTAINER_DEFAULT_BUILD_METHOD
+from atomic_reactor.constants import CONTAINER_DEFAULT_BUILD_METHOD, FINAL_CLEANUP_TIMEOUT
 from atomic_reactor.util import ImageName
 from atomic_reactor.build import BuildResult
 from atomic_reactor import get_logging_encoding
@@ -388,9 +389,15 @@ class DockerBuildWorkflow(object):
         # "path/to/file" -> "content"
         self.files = {}
 
+        # Dockerfile parsers shared by plugins, see util.df_parser
+        self.df_parsers = {}
+        # (base image config, parent ENV) last derived by util.df_parser
+        self.df_parent_env = None
+
         self.openshift_build_selflink = openshift_build_selflink
 
-        # List of RPMs that go into the final result, as per rpm_util.parse_rpm_output
+        # List of RPMs that go into the final result, rpm_util.RPMComponent records
+        # or dicts as per rpm_util.parse_rpm_output
         self.image_components = None
 
         if client_version:
@@ -416,7 +423,7 @@ class DockerBuildWorkflow(object):
 
         :return: BuildResult
         """
-        self.builder = InsideBuilder(self.source, self.image)
+        self.builder = InsideBuilder(self.source, self.image, workflow=self)
         try:
             self.fs_watcher.start()
             signal.signal(signal.SIGTERM, self.throw_canceled_build_exception)
@@ -501,6 +508,12 @@ class DockerBuildWorkflow(object):
             finally:
                 self.source.remove_tmpdir()
                 self.fs_watcher.finish()
+                # containers and images queued for removal by plugins;
+                # removals run in daemon threads and would be dropped on exit,
+                # wait shortly for those remove_built_image didn't wait for
+                cleanup_queue = getattr(self.builder.tasker, 'cleanup_queue', None)
+                if isinstance(cleanup_queue, CleanupQueue):
+                    cleanup_queue.flush(timeout=FINAL_CLEANUP_TIMEOUT)
 
             signal.signal(signal.SIGTERM, signal.SIG_DFL)
 
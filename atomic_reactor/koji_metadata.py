@@ -0,0 +1,260 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+Koji content generator metadata shared by the koji plugins
+"""
+
+from __future__ import unicode_literals
+
+import copy
+import logging
+import os
+import subprocess
+
+from osbs.exceptions import OsbsException
+
+from atomic_reactor import __version__ as atomic_reactor_version
+from atomic_reactor.constants import PROG
+from atomic_reactor.rpm_util import parse_rpm_output, rpm_components_to_dicts, rpm_qf_args
+from atomic_reactor.util import (Output, get_checksums, get_docker_architecture,
+                                 get_version_of_tools)
+
+
+logger = logging.getLogger(__name__)
+
+# RPM tags of buildroot components
+BUILDROOT_RPM_TAGS = [
+    'NAME',
+    'VERSION',
+    'RELEASE',
+    'ARCH',
+    'EPOCH',
+    'SIGMD5',
+    'SIGPGP:pgpsig',
+    'SIGGPG:pgpsig',
+]
+
+
+class KojiMetadataBuilder(object):
+    """
+    Parts of Koji content generator metadata describing this build
+
+    The buildroot section and checksums of output files are computed on
+    first use and kept. Checksums already computed when the image was
+    exported are reused.
+
+    Methods return copies, callers are free to modify them.
+    """
+
+    def __init__(self, workflow, tasker, osbs, build_id):
+        """
+        :param workflow: DockerBuildWorkflow instance
+        :param tasker: DockerTasker instance
+        :param osbs: OSBS instance, used to find the builder image ID
+        :param build_id: str, name of the OpenShift build
+        """
+        self.workflow = workflow
+        self.tasker = tasker
+        self.osbs = osbs
+        self.build_id = build_id
+
+        self._buildroot = None
+        # path -> (size, md5sum)
+        self._checksums = {}
+
+    def get_rpms(self):
+        """
+        Build a list of installed RPMs in the format required for the
+        metadata.
+        """
+
+        cmd = "/bin/rpm " + rpm_qf_args(BUILDROOT_RPM_TAGS)
+        stderr = None
+        try:
+            # py3
+            (status, output) = subprocess.getstatusoutput(cmd)
+        except AttributeError:
+            # py2
+            with open('/dev/null', 'r+') as devnull:
+                p = subprocess.Popen(cmd,
+                                     shell=True,
+                                     stdin=devnull,
+                                     stdout=subprocess.PIPE,
+                                     stderr=devnull)
+
+                (stdout, stderr) = p.communicate()
+                status = p.wait()
+                output = stdout.decode()
+
+        if status != 0:
+            logger.debug("%s: stderr output: %s", cmd, stderr)
+            raise RuntimeError("%s: exit code %s" % (cmd, status))
+
+        return parse_rpm_output(output.splitlines(), BUILDROOT_RPM_TAGS)
+
+    def get_builder_image_id(self):
+        """
+        Find out the docker ID of the buildroot image we are in.
+        """
+
+        try:
+            buildroot_tag = os.environ["OPENSHIFT_CUSTOM_BUILD_BASE_IMAGE"]
+        except KeyError:
+            return ''
+
+        try:
+            pod = self.osbs.get_pod_for_build(self.build_id)
+            all_images = pod.get_container_image_ids()
+        except OsbsException as ex:
+            logger.error("unable to find image id: %r", ex)
+            return buildroot_tag
+
+        try:
+            return all_images[buildroot_tag]
+        except KeyError:
+            logger.error("Unable to determine buildroot image ID for %s",
+                         buildroot_tag)
+            return buildroot_tag
+
+    def get_buildroot(self):
+        """
+        Build the buildroot entry of the metadata.
+
+        :return: dict, partial metadata
+        """
+
+        if self._buildroot is None:
+            docker_info = self.tasker.get_info()
+            host_arch, docker_version = get_docker_architecture(self.tasker)
+
+            self._buildroot = {
+                'id': 1,
+                'host': {
+                    'os': docker_info['OperatingSystem'],
+                    'arch': host_arch,
+                },
+                'content_generator': {
+                    'name': PROG,
+                    'version': atomic_reactor_version,
+                },
+                'container': {
+                    'type': 'docker',
+                    'arch': os.uname()[4],
+                },
+                'tools': [
+                    {
+                        'name': tool['name'],
+                        'version': tool['version'],
+                    }
+                    for tool in get_version_of_tools()] + [
+                    {
+                        'name': 'docker',
+                        'version': docker_version,
+                    },
+                ],
+                'components': self.get_rpms(),
+                'extra': {
+                    'osbs': {
+                        'build_id': self.build_id,
+                        'builder_image_id': self.get_builder_image_id(),
+                    }
+                },
+            }
+
+        return copy.deepcopy(self._buildroot)
+
+    def get_md5sum(self, path):
+        """
+        :param path: str, path to file
+        :return: str, md5 checksum of the file, computed once per file and size
+        """
+        size = os.path.getsize(path)
+        cached = self._checksums.get(path)
+        if cached and cached[0] == size:
+            return cached[1]
+
+        for image in self.workflow.exported_image_sequence:
+            if image.get('path') == path and image.get('size') == size and \
+                    image.get('md5sum'):
+                md5sum = image['md5sum']
+                break
+        else:
+            md5sum = get_checksums(path, ['md5'])['md5sum']
+
+        self._checksums[path] = (size, md5sum)
+        return md5sum
+
+    def get_output_metadata(self, path, filename, metadata_only=False):
+        """
+        Describe a file by its metadata.
+
+        :return: dict
+        """
+
+        metadata = {'filename': filename,
+                    'filesize': os.path.getsize(path),
+                    'checksum': self.get_md5sum(path),
+                    'checksum_type': 'md5'}
+
+        if metadata_only:
+            metadata['metadata_only'] = True
+
+        return metadata
+
+    def get_image_components(self):
+        """
+        Re-package the output of the rpmqa plugin into the format required
+        for the metadata.
+        """
+
+        output = self.workflow.image_components
+        if output is None:
+            logger.error("all_rpm_packages plugin did not run!")
+            output = []
+
+        return rpm_components_to_dicts(output)
+
+    def get_image_config(self):
+        """
+        Image config read from the registry using v2 schema 2 digest,
+        without the container_config section
+
+        :return: dict, empty if not known
+        """
+
+        registries = self.workflow.push_conf.docker_registries
+        if registries:
+            config = copy.deepcopy(registries[0].config)
+        else:
+            config = {}
+
+        if config and 'container_config' in config:
+            del config['container_config']
+
+        return config
+
+
+def add_buildroot_id(output, buildroot_id):
+    """
+    :param output: Output instance
+    :param buildroot_id: buildroot ID to set in its metadata
+    :return: Output instance
+    """
+    logfile, metadata = output
+    metadata.update({'buildroot_id': buildroot_id})
+    return Output(file=logfile, metadata=metadata)
+
+
+def add_log_type(output, arch='noarch'):
+    """
+    :param output: Output instance
+    :param arch: str, architecture to set in its metadata
+    :return: Output instance
+    """
+    logfile, metadata = output
+    metadata.update({'type': 'log', 'arch': arch})
+    return Output(file=logfile, metadata=metadata)
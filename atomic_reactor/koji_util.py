@@ -57,21 +57,50 @@ class KojiSessionWrapper(object):
         session_attr = getattr(self._wrapped_session, name)
         if callable(session_attr):
             def call_with_catch(*a, **kw):
-                retry_delay = HTTP_BACKOFF_FACTOR
-                last_exc = None
-                for retry in range(HTTP_MAX_RETRIES):
-                    try:
-                        return session_attr(*a, **kw)
-                    except ConnectionError as exc:
-                        time.sleep(retry_delay * (2 ** retry))
-                        last_exc = exc
-                        continue
-                raise last_exc
+                return _call_with_retries(session_attr, *a, **kw)
             return call_with_catch
         else:
             return session_attr
 
 
+def _call_with_retries(func, *a, **kw):
+    retry_delay = HTTP_BACKOFF_FACTOR
+    last_exc = None
+    for retry in range(HTTP_MAX_RETRIES):
+        try:
+            return func(*a, **kw)
+        except ConnectionError as exc:
+            time.sleep(retry_delay * (2 ** retry))
+            last_exc = exc
+            continue
+    raise last_exc
+
+
+def koji_multicall(session, calls):
+    """
+    Make several Koji calls in a single request to the hub.
+
+    :param session: KojiSessionWrapper or koji.ClientSession
+    :param calls: list of (method name, args, kwargs) tuples
+    :return: list, results of the calls, in the same order as calls
+    """
+    if not calls:
+        return []
+
+    def multicall(client):
+        client.multicall = True
+        for method, args, kwargs in calls:
+            getattr(client, method)(*args, **kwargs)
+        # in strict mode, the first fault is raised instead of returned
+        return [result[0] for result in client.multiCall(strict=True)]
+
+    if isinstance(session, KojiSessionWrapper):
+        # The queue of calls is consumed even by a failed multiCall, so
+        # retries have to queue the calls again
+        return _call_with_retries(multicall, session._wrapped_session)
+    return multicall(session)
+
+
 def koji_login(session,
                proxyuser=None,
                ssl_certs_dir=None,
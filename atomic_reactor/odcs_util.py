@@ -7,13 +7,20 @@ of the BSD license. See the LICENSE file for details.
 """
 
 from atomic_reactor.util import get_retrying_requests_session
+from contextlib import contextmanager
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
 from textwrap import dedent
 
+import fcntl
 import json
 import logging
+import os
 import time
 
 
+ODCS_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
 logger = logging.getLogger(__name__)
 
 
@@ -125,38 +132,204 @@ class ODCSClient(object):
         :return: dict, updated status of compose.
         :raise RuntimeError: if state_name becomes 'failed'
         """
-        logger.debug("Getting compose information for information for compose_id={}"
-                     .format(compose_id))
-        url = '{}composes/{}'.format(self.url, compose_id)
+        return self.wait_for_composes([compose_id],
+                                      burst_retry=burst_retry,
+                                      burst_length=burst_length,
+                                      slow_retry=slow_retry,
+                                      timeout=timeout)[0]
+
+    def wait_for_composes(self, compose_ids,
+                          burst_retry=1,
+                          burst_length=30,
+                          slow_retry=10,
+                          timeout=1800):
+        """Wait for multiple compose requests to finalize
+
+        All composes still pending are polled together on each retry, their
+        status requests are sent concurrently. Waiting ends as soon as the
+        slowest compose is finalized.
+
+        :param compose_ids: list<int>, compose IDs to wait for
+        :param burst_retry: int, seconds to wait between retries prior to exceeding
+                            the burst length
+        :param burst_length: int, seconds to switch to slower retry period
+        :param slow_retry: int, seconds to wait between retries after exceeding
+                           the burst length
+        :param timeout: int, when to give up waiting for compose requests
+
+        :return: list<dict>, updated status of composes, in the order of compose_ids
+        :raise RuntimeError: if state_name of any compose becomes 'failed'
+        """
+        logger.debug("Getting compose information for compose_ids={}".format(compose_ids))
+        finished = {}
+        pending = []
+        for compose_id in compose_ids:
+            if compose_id not in pending:
+                pending.append(compose_id)
+
         start_time = time.time()
-        while True:
-            response = self.session.get(url)
-            response.raise_for_status()
-            response_json = response.json()
-
-            if response_json['state_name'] == 'failed':
-                state_reason = response_json.get('state_reason', 'Unknown')
-                logger.error(dedent("""\
-                   Compose %s failed: %s
-                   Details: %s
-                   """), compose_id, state_reason, json.dumps(response_json, indent=4))
-                raise RuntimeError('Failed request for compose_id={}: {}'
-                                   .format(compose_id, state_reason))
-
-            if response_json['state_name'] not in ['wait', 'generating']:
-                logger.debug("Retrieved compose information for compose_id={}: {}"
-                             .format(compose_id, json.dumps(response_json, indent=4)))
-                return response_json
-
-            elapsed = time.time() - start_time
-            if elapsed > timeout:
-                raise RuntimeError("Retrieving %s timed out after %s seconds" %
-                                   (url, timeout))
-            else:
-                logger.debug("Retrying request compose_id={}, elapsed_time={}"
-                             .format(compose_id, elapsed))
-
-                if elapsed > burst_length:
-                    time.sleep(slow_retry)
+        pool = ThreadPool(len(pending)) if len(pending) > 1 else None
+        try:
+            while True:
+                if pool:
+                    statuses = pool.map(self._get_compose, pending)
+                else:
+                    statuses = [self._get_compose(compose_id) for compose_id in pending]
+
+                for compose_id, response_json in zip(pending, statuses):
+                    if self._is_compose_finalized(compose_id, response_json):
+                        finished[compose_id] = response_json
+
+                pending = [compose_id for compose_id in pending if compose_id not in finished]
+                if not pending:
+                    return [finished[compose_id] for compose_id in compose_ids]
+
+                elapsed = time.time() - start_time
+                if elapsed > timeout:
+                    raise RuntimeError("Waiting for compose_ids={} timed out after {} seconds"
+                                       .format(pending, timeout))
                 else:
-                    time.sleep(burst_retry)
+                    logger.debug("Retrying request compose_ids={}, elapsed_time={}"
+                                 .format(pending, elapsed))
+
+                    if elapsed > burst_length:
+                        time.sleep(slow_retry)
+                    else:
+                        time.sleep(burst_retry)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    def _get_compose(self, compose_id):
+        response = self.session.get('{}composes/{}'.format(self.url, compose_id))
+        response.raise_for_status()
+        return response.json()
+
+    def _is_compose_finalized(self, compose_id, response_json):
+        if response_json['state_name'] == 'failed':
+            state_reason = response_json.get('state_reason', 'Unknown')
+            logger.error(dedent("""\
+               Compose %s failed: %s
+               Details: %s
+               """), compose_id, state_reason, json.dumps(response_json, indent=4))
+            raise RuntimeError('Failed request for compose_id={}: {}'
+                               .format(compose_id, state_reason))
+
+        if response_json['state_name'] not in ['wait', 'generating']:
+            logger.debug("Retrieved compose information for compose_id={}: {}"
+                         .format(compose_id, json.dumps(response_json, indent=4)))
+            return True
+
+        return False
+
+
+def normalize_compose_request(request):
+    """Normalize compose request so equivalent requests compare equal
+
+    Values which are unordered from ODCS point of view (packages, sigkeys,
+    arches, ...) are sorted, white-space separated sources are sorted too,
+    and parameters which are not set are dropped.
+
+    :param request: dict, keyword arguments for ODCSClient.start_compose
+    :return: str, canonical representation of request
+    """
+    normalized = {}
+    for key, value in request.items():
+        if value is None:
+            continue
+        if key == 'packages' and not value:
+            continue
+        if key == 'source' and request.get('source_type') in ('module', 'pulp'):
+            value = ' '.join(sorted(value.split()))
+        elif isinstance(value, (list, tuple)):
+            value = sorted(value)
+        normalized[key] = value
+
+    return json.dumps(normalized, sort_keys=True)
+
+
+class ODCSComposeIndex(object):
+    """Local index of composes requested from ODCS
+
+    Maps normalized compose requests to the ID of the compose created for
+    them and the time that compose expires. The index is stored as a JSON
+    file, which is locked while it's being read or updated so that it can
+    be shared by builds running on the same node.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: str, path to JSON file holding the index
+        """
+        self.path = path
+
+    def lookup(self, request):
+        """Find a live compose created for an equivalent request
+
+        :param request: dict, keyword arguments for ODCSClient.start_compose
+        :return: int, compose ID, or None if no live compose is known
+        """
+        key = normalize_compose_request(request)
+        with self._locked_index() as index:
+            entry = index.get(key)
+
+        if entry is None:
+            return None
+
+        logger.debug("Found compose %s in index for request %s", entry['id'], key)
+        return entry['id']
+
+    def record(self, request, compose_info):
+        """Store compose created for request
+
+        :param request: dict, keyword arguments for ODCSClient.start_compose
+        :param compose_info: dict, status of compose as returned by ODCS
+        """
+        key = normalize_compose_request(request)
+        with self._locked_index(update=True) as index:
+            index[key] = {
+                'id': compose_info['id'],
+                'time_to_expire': compose_info['time_to_expire'],
+            }
+
+    @contextmanager
+    def _locked_index(self, update=False):
+        """Provide index contents while holding an exclusive lock
+
+        Entries of expired composes are dropped when the index is loaded.
+
+        :param update: bool, whether to write the index back to disk
+        """
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = self._load()
+                yield index
+                if update:
+                    tmp_path = self.path + '.tmp'
+                    with open(tmp_path, 'w') as f:
+                        json.dump(index, f, indent=2, sort_keys=True)
+                    os.rename(tmp_path, self.path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                index = json.load(f)
+        except (IOError, OSError):
+            return {}
+        except ValueError:
+            logger.warning("Ignoring corrupted compose index %s", self.path)
+            return {}
+
+        now = datetime.utcnow()
+        return {
+            key: entry for key, entry in index.items()
+            if datetime.strptime(entry['time_to_expire'], ODCS_DATETIME_FORMAT) > now
+        }
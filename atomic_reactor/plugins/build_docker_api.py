@@ -13,6 +13,14 @@ from atomic_reactor.util import wait_for_command
 from atomic_reactor.build import BuildResult
 
 
+def get_build_context_info(workflow):
+    """
+    :return: dict, size of the build context archive, seconds spent
+             creating it and whether it was cached, or None
+    """
+    return workflow.plugin_workspace.get(DockerApiPlugin.key, {}).get('build_context') or None
+
+
 class DockerApiPlugin(BuildStepPlugin):
     """
     buildstep plugin
@@ -21,6 +29,18 @@ class DockerApiPlugin(BuildStepPlugin):
 
     key = 'docker_api'
 
+    def __init__(self, tasker, workflow, context_cache_dir=None):
+        """
+        constructor
+
+        :param tasker: DockerTasker instance
+        :param workflow: DockerBuildWorkflow instance
+        :param context_cache_dir: str, directory to cache build context archives in,
+                                  so that identical contexts are archived only once
+        """
+        super(DockerApiPlugin, self).__init__(tasker, workflow)
+        self.context_cache_dir = context_cache_dir
+
     def run(self):
         """
         build image inside current environment;
@@ -38,8 +58,13 @@ class DockerApiPlugin(BuildStepPlugin):
         """
         builder = self.workflow.builder
 
+        context_info = {}
+        workspace = self.workflow.plugin_workspace.setdefault(self.key, {})
+        workspace['build_context'] = context_info
         logs_gen = self.tasker.build_image_from_path(builder.df_dir,
-                                                     builder.image)
+                                                     builder.image,
+                                                     context_cache_dir=self.context_cache_dir,
+                                                     context_info=context_info)
 
         self.log.debug('build is submitted, waiting for it to finish')
         try:
@@ -7,7 +7,7 @@ of the BSD license. See the LICENSE file for details.
 """
 from __future__ import unicode_literals, division
 
-from collections import namedtuple
+from collections import deque, namedtuple
 from copy import deepcopy
 from multiprocessing.pool import ThreadPool
 
@@ -16,6 +16,7 @@ import os
 from operator import attrgetter
 import random
 from string import ascii_letters
+import threading
 import time
 import logging
 from datetime import timedelta
@@ -23,6 +24,7 @@ import datetime as dt
 import copy
 import platform
 
+from atomic_reactor.annotations import AnnotationDecoder
 from atomic_reactor.build import BuildResult
 from atomic_reactor.plugin import BuildStepPlugin
 from atomic_reactor.plugins.pre_reactor_config import (get_config,
@@ -38,6 +40,7 @@ from atomic_reactor.plugins.pre_reactor_config import (get_config,
                                                        get_build_image_override,
                                                        get_goarch_to_platform_mapping)
 from atomic_reactor.plugins.pre_check_and_set_rebuild import is_rebuild
+from atomic_reactor.plugins.exit_remove_worker_metadata import defer_removal
 from atomic_reactor.util import (df_parser, get_build_json, get_manifest_list, get_platforms,
                                  ImageName)
 from atomic_reactor.constants import (PLUGIN_ADD_FILESYSTEM_KEY, PLUGIN_BUILD_ORCHESTRATE_KEY)
@@ -55,6 +58,12 @@ WORKSPACE_KEY_OVERRIDE_KWARGS = 'override_kwargs'
 FIND_CLUSTER_RETRY_DELAY = 15.0
 FAILURE_RETRY_DELAY = 10.0
 MAX_CLUSTER_FAILS = 20
+CLUSTER_LOAD_TTL = 30.0
+# max number of clusters listed at the same time, for all platforms
+CLUSTER_LIST_WORKERS = 8
+WORKER_LOG_BATCH_SIZE = 500
+WORKER_LOG_FLUSH_INTERVAL = 0.5
+WORKER_LOG_RECONNECTS = 3
 
 
 def get_worker_build_info(workflow, platform):
@@ -126,23 +135,331 @@ class ClusterRetryContext(object):
             self.retry_at = (dt.datetime.now() + timedelta(seconds=seconds))
 
 
+class RetryWaitCanceledException(Exception):
+    """ Waiting for a cluster was interrupted because the build is being cancelled """
+
+
+class ClusterRetryCoordinator(object):
+    """
+    Wait for clusters to come out of retry-wait, shared by all platform threads
+
+    Each waiting thread sleeps on a condition variable until the earliest
+    retry time of its clusters, so it wakes up as soon as it can retry.
+    Waiting threads are woken up early when retry times change or when
+    the build is cancelled.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._canceled = False
+
+    def wait_for_any_cluster(self, contexts):
+        """
+        Wait until any of the clusters are out of retry-wait
+
+        :param contexts: Dict[str, ClusterRetryContext]
+        :raises: AllClustersFailedException if no more retry attempts allowed
+        :raises: RetryWaitCanceledException if cancel() was called
+        """
+        with self._condition:
+            while True:
+                if self._canceled:
+                    raise RetryWaitCanceledException()
+
+                try:
+                    earliest_retry_at = min(ctx.retry_at for ctx in contexts.values()
+                                            if not ctx.failed)
+                except ValueError:  # can't take min() of empty sequence
+                    raise AllClustersFailedException(
+                        "Could not find appropriate cluster for worker build."
+                    )
+
+                time_until_next = (earliest_retry_at - dt.datetime.now()).total_seconds()
+                if time_until_next <= 0:
+                    return
+
+                self._condition.wait(time_until_next)
+
+    def notify(self):
+        """
+        Wake up waiting threads to re-check retry times
+        """
+        with self._condition:
+            self._condition.notify_all()
+
+    def cancel(self):
+        """
+        Make all current and future waits raise RetryWaitCanceledException
+        """
+        with self._condition:
+            self._canceled = True
+            self._condition.notify_all()
+
+
 def wait_for_any_cluster(contexts):
     """
     Wait until any of the clusters are out of retry-wait
 
-    :param contexts: List[ClusterRetryContext]
+    :param contexts: Dict[str, ClusterRetryContext]
     :raises: AllClustersFailedException if no more retry attempts allowed
     """
-    try:
-        earliest_retry_at = min(ctx.retry_at for ctx in contexts.values()
-                                if not ctx.failed)
-    except ValueError:  # can't take min() of empty sequence
-        raise AllClustersFailedException(
-            "Could not find appropriate cluster for worker build."
-        )
+    ClusterRetryCoordinator().wait_for_any_cluster(contexts)
+
+
+class ClusterLoadCache(object):
+    """
+    Number of active builds on worker clusters, shared by all platforms
+
+    The number of builds is fetched from each cluster at most once per ttl
+    seconds. While a cluster is being listed, other callers wait for that
+    listing instead of listing the cluster again. Builds placed on a cluster
+    since its builds were listed are added to the count, so that platforms
+    scheduled at the same time are spread over clusters instead of all
+    choosing the one which looked idle.
+    """
+
+    def __init__(self, ttl=CLUSTER_LOAD_TTL):
+        """
+        :param ttl: float, seconds to keep the number of builds for
+        """
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # cluster name -> (number of builds, time when listed)
+        self._builds = {}
+        # cluster name -> list of times when builds were placed
+        self._placed = {}
+        # cluster name -> _ClusterListing in progress
+        self._listings = {}
+
+    def get_builds(self, cluster, fetch):
+        """
+        Get number of active builds on cluster, including builds placed there
+
+        :param cluster: ClusterConfig instance
+        :param fetch: callable returning current number of builds on the cluster
+        :return: int
+        """
+        with self._lock:
+            cached = self._builds.get(cluster.name)
+            if cached is not None and time.time() - cached[1] < self.ttl:
+                return self._count(cluster)
+
+            listing = self._listings.get(cluster.name)
+            owner = listing is None
+            if owner:
+                listing = _ClusterListing()
+                self._listings[cluster.name] = listing
+
+        if not owner:
+            listing.done.wait()
+            if listing.error is not None:
+                raise listing.error
+            with self._lock:
+                return self._count(cluster)
+
+        listed_at = time.time()
+        try:
+            builds = fetch()
+        except Exception as ex:
+            listing.error = ex
+            raise
+        else:
+            with self._lock:
+                self._builds[cluster.name] = (builds, listed_at)
+                # builds placed before listing are already counted
+                self._placed[cluster.name] = [placed_at for placed_at
+                                              in self._placed.get(cluster.name, [])
+                                              if placed_at >= listed_at]
+                return self._count(cluster)
+        finally:
+            with self._lock:
+                del self._listings[cluster.name]
+            listing.done.set()
+
+    def _count(self, cluster):
+        builds, _ = self._builds.get(cluster.name, (0, None))
+        return builds + len(self._placed.get(cluster.name, []))
+
+    def place_build(self, cluster_infos):
+        """
+        Choose the least loaded cluster and count a build on it
+
+        :param cluster_infos: list of ClusterInfo
+        :return: ClusterInfo, chosen cluster with up to date load
+        """
+        with self._lock:
+            loaded = []
+            for cluster_info in cluster_infos:
+                cluster = cluster_info.cluster
+                load = self._count(cluster) / cluster.max_concurrent_builds
+                loaded.append(cluster_info._replace(load=load))
+
+            chosen = min(loaded, key=lambda c: (c.load, c.cluster.priority))
+            self._placed.setdefault(chosen.cluster.name, []).append(time.time())
+            return chosen
+
+    def forget_build(self, cluster):
+        """
+        Stop counting the build last placed on cluster, it wasn't started
+        """
+        with self._lock:
+            placed = self._placed.get(cluster.name)
+            if placed:
+                placed.pop()
+
+
+class _ClusterListing(object):
+    """
+    Listing of builds on a cluster in progress, see ClusterLoadCache
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class WorkerLogMultiplexer(object):
+    """
+    Write logs of all worker builds to the orchestrator log from a single thread
 
-    time_until_next = earliest_retry_at - dt.datetime.now()
-    time.sleep(max(timedelta(seconds=0), time_until_next).seconds)
+    Platform threads only put lines read from worker log streams into
+    per-platform queues; a writer thread drains them in batches and logs
+    each line as its own record, so every line keeps its platform in the
+    log format.
+
+    Queues are unbounded by default, no line is lost. With max_buffered,
+    the oldest lines of a full queue are dropped, so a slow log handler
+    never holds up reading worker logs. With max_lines_per_second, lines
+    over that rate are dropped for each platform. Dropped lines are
+    counted and reported in the log.
+
+    usage:
+
+        multiplexer = WorkerLogMultiplexer()
+        multiplexer.start()
+        try:
+            multiplexer.put('x86_64', line)
+            ...
+        finally:
+            multiplexer.stop()
+    """
+
+    def __init__(self, max_buffered=None,
+                 batch_size=WORKER_LOG_BATCH_SIZE,
+                 flush_interval=WORKER_LOG_FLUSH_INTERVAL,
+                 max_lines_per_second=None):
+        """
+        :param max_buffered: int, max number of lines queued for each platform,
+                             None for no limit
+        :param batch_size: int, max number of lines taken from a queue at once
+        :param flush_interval: float, max seconds lines wait in queue
+        :param max_lines_per_second: int, max number of lines logged per second
+                                     for each platform, None for no limit
+        """
+        self.max_buffered = max_buffered
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_lines_per_second = max_lines_per_second
+        self._condition = threading.Condition()
+        self._logs = {}  # platform -> LoggerAdapter
+        self._queues = {}  # platform -> deque of lines
+        self._dropped = {}  # platform -> number of lines dropped since last write
+        self._rate = {}  # platform -> (second, number of lines in it)
+        self._stopping = False
+        self._thread = None
+
+    def add(self, plat, log):
+        """
+        Register log to write lines of platform to
+
+        :param plat: str
+        :param log: logging.Logger or LoggerAdapter
+        """
+        with self._condition:
+            self._logs[plat] = log
+            self._queues.setdefault(plat, deque(maxlen=self.max_buffered))
+            self._dropped.setdefault(plat, 0)
+
+    def put(self, plat, line):
+        """
+        Queue line of worker build log
+
+        :param plat: str, platform registered with add()
+        :param line: str or bytes
+        """
+        with self._condition:
+            if self.max_lines_per_second:
+                second = int(time.time())
+                rate_second, lines = self._rate.get(plat, (second, 0))
+                if rate_second != second:
+                    lines = 0
+                if lines >= self.max_lines_per_second:
+                    self._dropped[plat] += 1
+                    return
+                self._rate[plat] = (second, lines + 1)
+
+            queue = self._queues[plat]
+            if len(queue) == queue.maxlen:
+                self._dropped[plat] += 1
+            queue.append(line)
+            if len(queue) >= self.batch_size:
+                self._condition.notify()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='worker-logs')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Write all queued lines and stop the writer thread
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+        self._flush()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._stopping and \
+                        all(len(queue) < self.batch_size for queue in self._queues.values()):
+                    self._condition.wait(self.flush_interval)
+                stopping = self._stopping
+
+            self._write_batch()
+            if stopping:
+                return
+
+    def _flush(self):
+        while self._write_batch():
+            pass
+
+    def _write_batch(self):
+        """
+        Take up to batch_size lines of each platform and log them
+
+        :return: bool, whether any lines were written
+        """
+        batches = []
+        with self._condition:
+            for plat, queue in self._queues.items():
+                lines = [queue.popleft() for _ in range(min(len(queue), self.batch_size))]
+                dropped, self._dropped[plat] = self._dropped[plat], 0
+                if lines or dropped:
+                    batches.append((self._logs[plat], lines, dropped))
+
+        for log, lines, dropped in batches:
+            if dropped:
+                log.warning('%d lines of worker build log dropped', dropped)
+            for line in lines:
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8', 'replace')
+                log.info(line)
+
+        return bool(batches)
 
 
 class WorkerBuildInfo(object):
@@ -155,6 +472,9 @@ class WorkerBuildInfo(object):
         self.log = logging.LoggerAdapter(logger, {'arch': self.platform})
 
         self.monitor_exception = None
+        self._build_annotations = None
+        # ConfigMaps holding annotations of the worker build
+        self.annotation_config_maps = set()
 
     @property
     def name(self):
@@ -162,14 +482,52 @@ class WorkerBuildInfo(object):
 
     def wait_to_finish(self):
         self.build = self.osbs.wait_for_build_to_finish(self.name)
+        self._build_annotations = None
         return self.build
 
-    def watch_logs(self):
-        for line in self.osbs.get_build_logs(self.name, follow=True):
-            self.log.info(line)
+    def get_build_annotations(self):
+        """
+        :return: dict, annotations of the worker build with encoded values decoded
+        """
+        if self._build_annotations is None:
+            decoder = AnnotationDecoder(self.osbs)
+            self._build_annotations = decoder.decode_annotations(
+                self.build.get_annotations() or {})
+            self.annotation_config_maps.update(decoder.config_maps)
+        return self._build_annotations
+
+    def watch_logs(self, multiplexer=None, reconnects=WORKER_LOG_RECONNECTS):
+        """
+        Follow worker build logs until the build finishes
+
+        :param multiplexer: WorkerLogMultiplexer, queue lines there instead of logging them
+        :param reconnects: int, how many times to reconnect when log stream fails
+        """
+        if multiplexer:
+            multiplexer.add(self.platform, self.log)
+
+        # lines already seen, skipped after reconnecting
+        offset = 0
+        while True:
+            try:
+                for index, line in enumerate(self.osbs.get_build_logs(self.name, follow=True)):
+                    if index < offset:
+                        continue
+                    offset += 1
+                    if multiplexer:
+                        multiplexer.put(self.platform, line)
+                    else:
+                        self.log.info(line)
+                return
+            except OsbsException:
+                if reconnects <= 0:
+                    raise
+                reconnects -= 1
+                self.log.warning('worker build log stream failed after %d lines, reconnecting',
+                                 offset)
 
     def get_annotations(self):
-        build_annotations = self.build.get_annotations() or {}
+        build_annotations = self.get_build_annotations()
         annotations = {
             'build': {
                 'cluster-url': self.osbs.os_conf.get_openshift_base_uri(),
@@ -199,7 +557,7 @@ class WorkerBuildInfo(object):
         if not self.build:
             return fail_reason
 
-        build_annotations = self.build.get_annotations() or {}
+        build_annotations = self.get_build_annotations()
         metadata = json.loads(build_annotations.get('plugins-metadata', '{}'))
         if self.monitor_exception:
             fail_reason['general'] = repr(self.monitor_exception)
@@ -262,7 +620,8 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
                  failure_retry_delay=FAILURE_RETRY_DELAY,
                  max_cluster_fails=MAX_CLUSTER_FAILS,
                  url=None, verify_ssl=True, use_auth=True,
-                 goarch=None):
+                 goarch=None, cluster_load_ttl=CLUSTER_LOAD_TTL,
+                 worker_log_rate_limit=None, worker_log_max_buffered=None):
         """
         constructor
 
@@ -280,6 +639,12 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
         :param max_cluster_fails: the maximum number of times a cluster can fail before being
                                   ignored
         :param goarch: dict, keys are platform, values are go language platform names
+        :param cluster_load_ttl: float, seconds to reuse number of builds listed on a cluster
+        :param worker_log_rate_limit: int, max number of worker log lines per second logged
+                                      for each platform, None for no limit
+        :param worker_log_max_buffered: int, max number of worker log lines waiting to be
+                                        logged for each platform, the oldest lines are
+                                        dropped over that; None for no limit
         """
         super(OrchestrateBuildPlugin, self).__init__(tasker, workflow)
         self.platforms = get_platforms(self.workflow)
@@ -295,6 +660,13 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
         self.find_cluster_retry_delay = find_cluster_retry_delay
         self.failure_retry_delay = failure_retry_delay
         self.max_cluster_fails = max_cluster_fails
+        self.cluster_loads = ClusterLoadCache(cluster_load_ttl)
+        # listing builds on clusters, shared by all platforms
+        self._cluster_pool = None
+        self._cluster_pool_lock = threading.Lock()
+        self.retry_coordinator = ClusterRetryCoordinator()
+        self.log_multiplexer = WorkerLogMultiplexer(max_buffered=worker_log_max_buffered,
+                                                    max_lines_per_second=worker_log_rate_limit)
         self.koji_upload_dir = self.get_koji_upload_dir()
         self.fs_task_id = self.get_fs_task_id()
         self.release = self.get_release()
@@ -435,7 +807,8 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
 
         osbs = self._get_openshift_session(kwargs)
 
-        current_builds = self.get_current_builds(osbs)
+        current_builds = self.cluster_loads.get_builds(
+            cluster, lambda: self.get_current_builds(osbs))
 
         load = current_builds / cluster.max_concurrent_builds
         self.log.debug('enabled cluster %s for platform %s has load %s and active builds %s/%s',
@@ -445,28 +818,52 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
     def get_clusters(self, platform, retry_contexts, all_clusters):
         ''' return clusters sorted by load. '''
 
+        def get_cluster_info(cluster):
+            try:
+                return self.get_cluster_info(cluster, platform)
+            except OsbsException as ex:
+                return ex
+
         possible_cluster_info = {}
         candidates = set(copy.copy(all_clusters))
         while candidates and not possible_cluster_info:
-            wait_for_any_cluster(retry_contexts)
-
-            for cluster in sorted(candidates, key=attrgetter('priority')):
-                ctx = retry_contexts[cluster.name]
-                if ctx.in_retry_wait:
-                    continue
-                if ctx.failed:
-                    continue
-                try:
-                    cluster_info = self.get_cluster_info(cluster, platform)
-                    possible_cluster_info[cluster] = cluster_info
-                except OsbsException:
-                    ctx.try_again_later(self.find_cluster_retry_delay)
+            self.retry_coordinator.wait_for_any_cluster(retry_contexts)
+
+            ready = [cluster for cluster in sorted(candidates, key=attrgetter('priority'))
+                     if not retry_contexts[cluster.name].in_retry_wait and
+                     not retry_contexts[cluster.name].failed]
+
+            # list builds on all clusters at once
+            if len(ready) > 1:
+                results = self._get_cluster_pool().map(get_cluster_info, ready)
+            else:
+                results = [get_cluster_info(cluster) for cluster in ready]
+
+            for cluster, result in zip(ready, results):
+                if isinstance(result, OsbsException):
+                    retry_contexts[cluster.name].try_again_later(self.find_cluster_retry_delay)
+                else:
+                    possible_cluster_info[cluster] = result
             candidates -= set([c for c in candidates if retry_contexts[c.name].failed])
+            self.retry_coordinator.notify()
 
         ret = sorted(possible_cluster_info.values(), key=lambda c: c.cluster.priority)
         ret = sorted(ret, key=lambda c: c.load)
         return ret
 
+    def _get_cluster_pool(self):
+        with self._cluster_pool_lock:
+            if self._cluster_pool is None:
+                self._cluster_pool = ThreadPool(CLUSTER_LIST_WORKERS)
+            return self._cluster_pool
+
+    def _close_cluster_pool(self):
+        with self._cluster_pool_lock:
+            pool, self._cluster_pool = self._cluster_pool, None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
     def get_release(self):
         labels = Labels(df_parser(self.workflow.builder.df_path, workflow=self.workflow).labels)
         _, release = labels.get_name_and_value(Labels.LABEL_TYPE_RELEASE)
@@ -531,7 +928,8 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
         for build_info in self.worker_builds:
             if not build_info.build:
                 continue
-            repositories = build_info.build.get_repositories() or {}
+            repositories = build_info.get_build_annotations().get('repositories')
+            repositories = json.loads(repositories) if repositories else {}
             unique.update(repositories.get('unique', []))
             primary.update(repositories.get('primary', []))
 
@@ -622,7 +1020,7 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
             try:
                 self.log.info('%s - created build %s on cluster %s.', cluster_info.platform,
                               build_info.name, cluster_info.cluster.name)
-                build_info.watch_logs()
+                build_info.watch_logs(self.log_multiplexer)
                 build_info.wait_to_finish()
             except Exception as e:
                 build_info.monitor_exception = e
@@ -664,7 +1062,11 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
                 self.worker_builds.append(build_info)
                 return
 
-            for cluster_info in possible_cluster_info:
+            while possible_cluster_info:
+                # choose under lock, counting builds just placed by other platforms
+                cluster_info = self.cluster_loads.place_build(possible_cluster_info)
+                possible_cluster_info = [c for c in possible_cluster_info
+                                         if c.cluster is not cluster_info.cluster]
                 ctx = retry_contexts[cluster_info.cluster.name]
                 try:
                     self.log.info('Attempting to start build for platform %s on cluster %s',
@@ -672,7 +1074,9 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
                     self.do_worker_build(cluster_info)
                     return
                 except OsbsException:
+                    self.cluster_loads.forget_build(cluster_info.cluster)
                     ctx.try_again_later(self.failure_retry_delay)
+                    self.retry_coordinator.notify()
                     # this will put the cluster in retry-wait when get_clusters runs
 
     @property
@@ -854,6 +1258,7 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
             raise RuntimeError("No enabled platform to build on")
         self.set_build_image()
 
+        self.log_multiplexer.start()
         thread_pool = ThreadPool(len(self.platforms))
         result = thread_pool.map_async(self.select_and_start_cluster, self.platforms)
 
@@ -862,6 +1267,8 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
         # Always clean up worker builds on any error to avoid
         # runaway worker builds (includes orchestrator build cancellation)
         except Exception:
+            # terminate() can't stop threads waiting to retry a cluster
+            self.retry_coordinator.cancel()
             thread_pool.terminate()
             self.log.info('build cancelled, cancelling worker builds')
             if self.worker_builds:
@@ -873,6 +1280,9 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
         else:
             thread_pool.close()
             thread_pool.join()
+        finally:
+            self._close_cluster_pool()
+            self.log_multiplexer.stop()
 
         annotations = {'worker-builds': {
             build_info.platform: build_info.get_annotations()
@@ -889,6 +1299,10 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
             if not build_info.build or not build_info.build.is_succeeded()
         }
 
+        for build_info in self.worker_builds:
+            for config_map in build_info.annotation_config_maps:
+                defer_removal(self.workflow, config_map, build_info.osbs)
+
         workspace = self.workflow.plugin_workspace.setdefault(self.key, {})
         workspace[WORKSPACE_KEY_UPLOAD_DIR] = self.koji_upload_dir
         workspace[WORKSPACE_KEY_BUILD_INFO] = {build_info.platform: build_info
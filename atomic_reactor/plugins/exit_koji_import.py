@@ -13,10 +13,12 @@ import os
 import time
 
 from atomic_reactor import start_time as atomic_reactor_start_time
+from atomic_reactor.koji_metadata import add_buildroot_id, add_log_type
 from atomic_reactor.plugin import ExitPlugin
 from atomic_reactor.source import GitSource
 from atomic_reactor.plugins.build_orchestrate_build import (get_worker_build_info,
                                                             get_koji_upload_dir)
+from atomic_reactor.plugins.post_fetch_worker_metadata import get_worker_metadata_index
 from atomic_reactor.plugins.pre_add_filesystem import AddFilesystemPlugin
 from atomic_reactor.plugins.pre_check_and_set_rebuild import is_rebuild
 from atomic_reactor.util import OSBSLogs, get_parent_image_koji_data
@@ -39,10 +41,10 @@ except ImportError:
 
 from atomic_reactor.constants import (
     PLUGIN_KOJI_IMPORT_PLUGIN_KEY, PLUGIN_PULP_PULL_KEY, PLUGIN_PULP_SYNC_KEY,
-    PLUGIN_FETCH_WORKER_METADATA_KEY, PLUGIN_GROUP_MANIFESTS_KEY, PLUGIN_RESOLVE_COMPOSES_KEY,
+    PLUGIN_GROUP_MANIFESTS_KEY, PLUGIN_RESOLVE_COMPOSES_KEY,
     PLUGIN_VERIFY_MEDIA_KEY
 )
-from atomic_reactor.util import (Output, get_build_json,
+from atomic_reactor.util import (get_build_json,
                                  df_parser, ImageName, get_primary_images,
                                  get_manifest_media_type,
                                  get_digests_map_from_annotations)
@@ -124,10 +126,11 @@ class KojiImportPlugin(ExitPlugin):
         self.osbs = get_openshift_session(self.workflow, self.openshift_fallback)
         self.build_id = None
 
-    def get_output(self, worker_metadatas):
+    def get_output(self, worker_metadata):
         """
         Build the output entry of the metadata.
 
+        :param worker_metadata: WorkerMetadataIndex instance
         :return: list, containing dicts of partial metadata
         """
         outputs = []
@@ -138,52 +141,52 @@ class KojiImportPlugin(ExitPlugin):
         except (KeyError, IndexError):
             crane_registry = None
 
-        for platform in worker_metadatas:
-            for instance in worker_metadatas[platform]['output']:
-                instance['buildroot_id'] = '{}-{}'.format(platform, instance['buildroot_id'])
-
-                if instance['type'] == 'docker-image':
-                    # update image ID with pulp_pull results;
-                    # necessary when using Pulp < 2.14. Only do this
-                    # when building for a single architecture -- if
-                    # building for many, we know Pulp has schema 2
-                    # support.
-                    if len(worker_metadatas) == 1 and has_pulp_pull:
-                        if self.workflow.builder.image_id is not None:
-                            instance['extra']['docker']['id'] = self.workflow.builder.image_id
-
-                    # update repositories to point to Crane
-                    if crane_registry:
-                        pulp_pullspecs = []
-                        docker = instance['extra']['docker']
-                        for pullspec in docker['repositories']:
-                            image = ImageName.parse(pullspec)
-                            image.registry = crane_registry.registry
-                            pulp_pullspecs.append(image.to_str())
-
-                        docker['repositories'] = pulp_pullspecs
-
-                outputs.append(instance)
+        for platform, instance in worker_metadata.get_outputs():
+            instance['buildroot_id'] = '{}-{}'.format(platform, instance['buildroot_id'])
+
+            if instance['type'] == 'docker-image':
+                # update image ID with pulp_pull results;
+                # necessary when using Pulp < 2.14. Only do this
+                # when building for a single architecture -- if
+                # building for many, we know Pulp has schema 2
+                # support.
+                if len(worker_metadata) == 1 and has_pulp_pull:
+                    if self.workflow.builder.image_id is not None:
+                        instance['extra']['docker']['id'] = self.workflow.builder.image_id
+
+                # update repositories to point to Crane
+                if crane_registry:
+                    pulp_pullspecs = []
+                    docker = instance['extra']['docker']
+                    for pullspec in docker['repositories']:
+                        image = ImageName.parse(pullspec)
+                        image.registry = crane_registry.registry
+                        pulp_pullspecs.append(image.to_str())
+
+                    docker['repositories'] = pulp_pullspecs
+
+            outputs.append(instance)
 
         return outputs
 
-    def get_buildroot(self, worker_metadatas):
+    def get_buildroot(self, worker_metadata):
         """
         Build the buildroot entry of the metadata.
 
+        :param worker_metadata: WorkerMetadataIndex instance
         :return: list, containing dicts of partial metadata
         """
         buildroots = []
-        for platform in sorted(worker_metadatas.keys()):
-            for instance in worker_metadatas[platform]['buildroots']:
+        for platform in worker_metadata.platforms:
+            for instance in worker_metadata.get_buildroots(platform):
                 instance['id'] = '{}-{}'.format(platform, instance['id'])
                 buildroots.append(instance)
 
         return buildroots
 
-    def set_help(self, extra, worker_metadatas):
+    def set_help(self, extra, worker_metadata):
         all_annotations = [get_worker_build_info(self.workflow, platform).build.get_annotations()
-                           for platform in worker_metadatas]
+                           for platform in worker_metadata.platforms]
         help_known = ['help_file' in annotations for annotations in all_annotations]
         # Only set the 'help' key when any 'help_file' annotation is set
         if any(help_known):
@@ -198,9 +201,9 @@ class KojiImportPlugin(ExitPlugin):
                 # They are all None
                 extra['image']['help'] = None
 
-    def set_media_types(self, extra, worker_metadatas):
+    def set_media_types(self, extra, worker_metadata):
         media_types = []
-        for platform in worker_metadatas:
+        for platform in worker_metadata.platforms:
             annotations = get_worker_build_info(self.workflow, platform).build.get_annotations()
             if annotations.get('media-types'):
                 media_types = json.loads(annotations['media-types'])
@@ -215,35 +218,31 @@ class KojiImportPlugin(ExitPlugin):
         if media_types:
             extra['image']['media_types'] = sorted(list(set(media_types)))
 
-    def remove_unavailable_manifest_digests(self, worker_metadatas):
+    def remove_unavailable_manifest_digests(self, worker_metadata):
         try:
             available = get_manifests_in_pulp_repository(self.workflow)
         except KeyError:
             # pulp_sync didn't run
             return
 
-        for platform, metadata in worker_metadatas.items():
-            for output in metadata['output']:
-                if output['type'] != 'docker-image':
+        for platform, output in worker_metadata.get_outputs('docker-image'):
+            unavailable = []
+            repositories = output['extra']['docker']['repositories']
+            for pullspec in repositories:
+                # Ignore by-tag pullspecs
+                if '@' not in pullspec:
                     continue
 
-                unavailable = []
-                repositories = output['extra']['docker']['repositories']
-                for pullspec in repositories:
-                    # Ignore by-tag pullspecs
-                    if '@' not in pullspec:
-                        continue
+                _, digest = pullspec.split('@', 1)
+                if digest not in available:
+                    self.log.info("%s: %s not available, removing", platform, pullspec)
+                    unavailable.append(pullspec)
 
-                    _, digest = pullspec.split('@', 1)
-                    if digest not in available:
-                        self.log.info("%s: %s not available, removing", platform, pullspec)
-                        unavailable.append(pullspec)
+            # Update the list in-place
+            for pullspec in unavailable:
+                repositories.remove(pullspec)
 
-                # Update the list in-place
-                for pullspec in unavailable:
-                    repositories.remove(pullspec)
-
-    def set_group_manifest_info(self, extra, worker_metadatas):
+    def set_group_manifest_info(self, extra, worker_metadata):
         version_release = None
         primary_images = get_primary_images(self.workflow)
         for image in primary_images:
@@ -282,33 +281,31 @@ class KojiImportPlugin(ExitPlugin):
             extra['image']['index'] = index
         # group_manifests returns None if didn't run, {} if group=False
         else:
-            for platform in worker_metadatas:
-                if platform == "x86_64":
-                    for instance in worker_metadatas[platform]['output']:
-                        if instance['type'] == 'docker-image':
-                            # koji_upload, running in the worker, doesn't have the full tags
-                            # so set them here
-                            instance['extra']['docker']['tags'] = tags
-                            repositories = []
-                            for pullspec in instance['extra']['docker']['repositories']:
-                                if '@' not in pullspec:
-                                    image = ImageName.parse(pullspec)
-                                    image.tag = version_release
-                                    pullspec = image.to_str()
-
-                                repositories.append(pullspec)
-
-                            instance['extra']['docker']['repositories'] = repositories
-                            self.log.debug("reset tags to so that docker is %s",
-                                           instance['extra']['docker'])
-                            annotations = get_worker_build_info(self.workflow, platform).\
-                                build.get_annotations()
-                            digests = {}
-                            if 'digests' in annotations:
-                                digests = get_digests_map_from_annotations(annotations['digests'])
-                                instance['extra']['docker']['digests'] = digests
-
-    def get_build(self, metadata, worker_metadatas):
+            for platform, instance in worker_metadata.get_outputs('docker-image',
+                                                                  platform='x86_64'):
+                # koji_upload, running in the worker, doesn't have the full tags
+                # so set them here
+                instance['extra']['docker']['tags'] = tags
+                repositories = []
+                for pullspec in instance['extra']['docker']['repositories']:
+                    if '@' not in pullspec:
+                        image = ImageName.parse(pullspec)
+                        image.tag = version_release
+                        pullspec = image.to_str()
+
+                    repositories.append(pullspec)
+
+                instance['extra']['docker']['repositories'] = repositories
+                self.log.debug("reset tags to so that docker is %s",
+                               instance['extra']['docker'])
+                annotations = get_worker_build_info(self.workflow, platform).\
+                    build.get_annotations()
+                digests = {}
+                if 'digests' in annotations:
+                    digests = get_digests_map_from_annotations(annotations['digests'])
+                    instance['extra']['docker']['digests'] = digests
+
+    def get_build(self, metadata, worker_metadata):
         start_time = int(atomic_reactor_start_time)
 
         labels = Labels(df_parser(self.workflow.builder.df_path, workflow=self.workflow).labels)
@@ -372,10 +369,10 @@ class KojiImportPlugin(ExitPlugin):
                 'signing_intent_overridden': resolve_comp_result['signing_intent_overridden'],
             }
 
-        self.set_help(extra, worker_metadatas)
-        self.set_media_types(extra, worker_metadatas)
-        self.remove_unavailable_manifest_digests(worker_metadatas)
-        self.set_group_manifest_info(extra, worker_metadatas)
+        self.set_help(extra, worker_metadata)
+        self.set_media_types(extra, worker_metadata)
+        self.remove_unavailable_manifest_digests(worker_metadata)
+        self.set_group_manifest_info(extra, worker_metadata)
 
         build = {
             'name': component,
@@ -391,16 +388,6 @@ class KojiImportPlugin(ExitPlugin):
         return build
 
     def combine_metadata_fragments(self):
-        def add_buildroot_id(output, buildroot_id):
-            logfile, metadata = output
-            metadata.update({'buildroot_id': buildroot_id})
-            return Output(file=logfile, metadata=metadata)
-
-        def add_log_type(output):
-            logfile, metadata = output
-            metadata.update({'type': 'log', 'arch': 'noarch'})
-            return Output(file=logfile, metadata=metadata)
-
         try:
             metadata = get_build_json()["metadata"]
             self.build_id = metadata["name"]
@@ -410,11 +397,11 @@ class KojiImportPlugin(ExitPlugin):
 
         metadata_version = 0
 
-        worker_metadatas = self.workflow.postbuild_results.get(PLUGIN_FETCH_WORKER_METADATA_KEY)
-        build = self.get_build(metadata, worker_metadatas)
-        buildroot = self.get_buildroot(worker_metadatas)
+        worker_metadata = get_worker_metadata_index(self.workflow)
+        build = self.get_build(metadata, worker_metadata)
+        buildroot = self.get_buildroot(worker_metadata)
         buildroot_id = buildroot[0]['id']
-        output = self.get_output(worker_metadatas)
+        output = self.get_output(worker_metadata)
         osbs_logs = OSBSLogs(self.log)
         output_files = [add_log_type(add_buildroot_id(md, buildroot_id))
                         for md in osbs_logs.get_log_files(self.osbs, self.build_id)]
@@ -12,16 +12,14 @@ import json
 import os
 import random
 from string import ascii_letters
-import subprocess
 from tempfile import NamedTemporaryFile
 import time
-import copy
 
-from atomic_reactor import __version__ as atomic_reactor_version
 from atomic_reactor import start_time as atomic_reactor_start_time
+from atomic_reactor.koji_metadata import (KojiMetadataBuilder, add_buildroot_id,
+                                          add_log_type)
 from atomic_reactor.plugin import ExitPlugin
 from atomic_reactor.source import GitSource
-from atomic_reactor.plugins.post_rpmqa import PostBuildRPMqaPlugin
 from atomic_reactor.plugins.pre_add_filesystem import AddFilesystemPlugin
 from atomic_reactor.plugins.pre_check_and_set_rebuild import is_rebuild
 from atomic_reactor.plugins.pre_add_help import AddHelpPlugin
@@ -43,18 +41,15 @@ except ImportError:
     def get_manifests_in_pulp_repository(_):
         raise KeyError
 
-from atomic_reactor.constants import (PROG, PLUGIN_KOJI_PROMOTE_PLUGIN_KEY,
+from atomic_reactor.constants import (PLUGIN_KOJI_PROMOTE_PLUGIN_KEY,
                                       PLUGIN_KOJI_TAG_BUILD_KEY,
                                       PLUGIN_PULP_PULL_KEY,
                                       PLUGIN_RESOLVE_COMPOSES_KEY)
-from atomic_reactor.util import (Output, get_version_of_tools, get_checksums,
-                                 get_build_json,
-                                 get_docker_architecture, df_parser,
+from atomic_reactor.util import (Output, get_build_json, df_parser,
                                  are_plugins_in_order,
                                  get_image_upload_filename,
                                  get_manifest_media_type)
 from atomic_reactor.koji_util import (tag_koji_build, KojiUploadLogger, get_koji_task_owner)
-from atomic_reactor.rpm_util import parse_rpm_output, rpm_qf_args
 from osbs.exceptions import OsbsException
 from osbs.utils import Labels
 
@@ -138,46 +133,7 @@ class KojiPromotePlugin(ExitPlugin):
         self.osbs = get_openshift_session(self.workflow, self.openshift_fallback)
         self.build_id = None
         self.pullspec_image = None
-
-    def get_rpms(self):
-        """
-        Build a list of installed RPMs in the format required for the
-        metadata.
-        """
-
-        tags = [
-            'NAME',
-            'VERSION',
-            'RELEASE',
-            'ARCH',
-            'EPOCH',
-            'SIGMD5',
-            'SIGPGP:pgpsig',
-            'SIGGPG:pgpsig',
-        ]
-
-        cmd = "/bin/rpm " + rpm_qf_args(tags)
-        try:
-            # py3
-            (status, output) = subprocess.getstatusoutput(cmd)
-        except AttributeError:
-            # py2
-            with open('/dev/null', 'r+') as devnull:
-                p = subprocess.Popen(cmd,
-                                     shell=True,
-                                     stdin=devnull,
-                                     stdout=subprocess.PIPE,
-                                     stderr=devnull)
-
-                (stdout, stderr) = p.communicate()
-                status = p.wait()
-                output = stdout.decode()
-
-        if status != 0:
-            self.log.debug("%s: stderr output: %s", cmd, stderr)
-            raise RuntimeError("%s: exit code %s" % (cmd, status))
-
-        return parse_rpm_output(output.splitlines(), tags)
+        self.metadata_builder = None
 
     def get_output_metadata(self, path, filename):
         """
@@ -186,86 +142,8 @@ class KojiPromotePlugin(ExitPlugin):
         :return: dict
         """
 
-        checksums = get_checksums(path, ['md5'])
-        metadata = {'filename': filename,
-                    'filesize': os.path.getsize(path),
-                    'checksum': checksums['md5sum'],
-                    'checksum_type': 'md5'}
-
-        if self.metadata_only:
-            metadata['metadata_only'] = True
-
-        return metadata
-
-    def get_builder_image_id(self):
-        """
-        Find out the docker ID of the buildroot image we are in.
-        """
-
-        try:
-            buildroot_tag = os.environ["OPENSHIFT_CUSTOM_BUILD_BASE_IMAGE"]
-        except KeyError:
-            return ''
-
-        try:
-            pod = self.osbs.get_pod_for_build(self.build_id)
-            all_images = pod.get_container_image_ids()
-        except OsbsException as ex:
-            self.log.error("unable to find image id: %r", ex)
-            return buildroot_tag
-
-        try:
-            return all_images[buildroot_tag]
-        except KeyError:
-            self.log.error("Unable to determine buildroot image ID for %s",
-                           buildroot_tag)
-            return buildroot_tag
-
-    def get_buildroot(self, build_id):
-        """
-        Build the buildroot entry of the metadata.
-
-        :return: dict, partial metadata
-        """
-
-        docker_info = self.tasker.get_info()
-        host_arch, docker_version = get_docker_architecture(self.tasker)
-
-        buildroot = {
-            'id': 1,
-            'host': {
-                'os': docker_info['OperatingSystem'],
-                'arch': host_arch,
-            },
-            'content_generator': {
-                'name': PROG,
-                'version': atomic_reactor_version,
-            },
-            'container': {
-                'type': 'docker',
-                'arch': os.uname()[4],
-            },
-            'tools': [
-                {
-                    'name': tool['name'],
-                    'version': tool['version'],
-                }
-                for tool in get_version_of_tools()] + [
-                {
-                    'name': 'docker',
-                    'version': docker_version,
-                },
-            ],
-            'components': self.get_rpms(),
-            'extra': {
-                'osbs': {
-                    'build_id': build_id,
-                    'builder_image_id': self.get_builder_image_id(),
-                }
-            },
-        }
-
-        return buildroot
+        return self.metadata_builder.get_output_metadata(path, filename,
+                                                         metadata_only=self.metadata_only)
 
     def get_logs(self):
         """
@@ -306,20 +184,6 @@ class KojiPromotePlugin(ExitPlugin):
                                                                "build.log")))
         return output
 
-    def get_image_components(self):
-        """
-        Re-package the output of the rpmqa plugin into the format required
-        for the metadata.
-        """
-
-        output = self.workflow.image_components
-        if output is None:
-            self.log.error("%s plugin did not run!",
-                           PostBuildRPMqaPlugin.key)
-            output = []
-
-        return output
-
     def get_image_output(self, arch):
         """
         Create the output for the image
@@ -429,33 +293,14 @@ class KojiPromotePlugin(ExitPlugin):
         :return: list, Output instances
         """
 
-        def add_buildroot_id(output):
-            logfile, metadata = output
-            metadata.update({'buildroot_id': buildroot_id})
-            return Output(file=logfile, metadata=metadata)
-
-        def add_log_type(output):
-            logfile, metadata = output
-            metadata.update({'type': 'log', 'arch': 'noarch'})
-            return Output(file=logfile, metadata=metadata)
-
-        output_files = [add_log_type(add_buildroot_id(metadata))
+        output_files = [add_log_type(add_buildroot_id(metadata, buildroot_id))
                         for metadata in self.get_logs()]
 
         # Parent of squashed built image is base image
         image_id = self.workflow.builder.image_id
         parent_id = self.workflow.builder.base_image_inspect['Id']
 
-        # Read config from the registry using v2 schema 2 digest
-        registries = self.workflow.push_conf.docker_registries
-        if registries:
-            config = copy.deepcopy(registries[0].config)
-        else:
-            config = {}
-
-        # We don't need container_config section
-        if config and 'container_config' in config:
-            del config['container_config']
+        config = self.metadata_builder.get_image_config()
 
         digests = self.get_digests()
         repositories = self.get_repositories(digests)
@@ -465,7 +310,7 @@ class KojiPromotePlugin(ExitPlugin):
         metadata.update({
             'arch': arch,
             'type': 'docker-image',
-            'components': self.get_image_components(),
+            'components': self.metadata_builder.get_image_components(),
             'extra': {
                 'image': {
                     'arch': arch,
@@ -489,7 +334,7 @@ class KojiPromotePlugin(ExitPlugin):
             del metadata['extra']['docker']['config']
 
         # Add the 'docker save' image to the output
-        image = add_buildroot_id(output)
+        image = add_buildroot_id(output, buildroot_id)
         output_files.append(image)
 
         return output_files
@@ -622,8 +467,10 @@ class KojiPromotePlugin(ExitPlugin):
 
         metadata_version = 0
 
+        self.metadata_builder = KojiMetadataBuilder(self.workflow, self.tasker,
+                                                    self.osbs, self.build_id)
         build = self.get_build(metadata)
-        buildroot = self.get_buildroot(build_id=self.build_id)
+        buildroot = self.metadata_builder.get_buildroot()
         output_files = self.get_output(buildroot['id'])
 
         koji_metadata = {
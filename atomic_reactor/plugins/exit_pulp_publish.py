@@ -119,10 +119,13 @@ class PulpPublishPlugin(ExitPlugin):
                 if not repo_prefix:
                     repo_prefix = ''
                 pulp_repos = set(['%s%s' % (repo_prefix, image.pulp_repo) for image in image_names])
-                for repo_id in pulp_repos:
+
+                def remove_image(repo_id):
                     self.log.info("removing %s from repo %s", v1_image_id, repo_id)
                     self.pulp_handler.remove_image(repo_id, v1_image_id)
 
+                self.pulp_handler.executor.map(remove_image, sorted(pulp_repos))
+
     def run(self):
         if self.workflow.build_process_failed:
             self.delete_v1_layers()
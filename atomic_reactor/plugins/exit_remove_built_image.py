@@ -8,61 +8,86 @@ of the BSD license. See the LICENSE file for details.
 
 Remove built image (this only makes sense if you store the image in some registry first)
 """
-from atomic_reactor.plugin import ExitPlugin
+import time
 
-from docker.errors import APIError
+from atomic_reactor.constants import DEFAULT_CLEANUP_TIMEOUT
+from atomic_reactor.plugin import ExitPlugin
 
 __all__ = ('GarbageCollectionPlugin', )
 
 
-def defer_removal(workflow, image):
+def defer_removal(workflow, image, force=True):
+    """
+    Have the image removed when the build finishes
+
+    :param workflow: DockerBuildWorkflow instance
+    :param image: str or ImageName, image to remove
+    :param force: bool, remove the image even if it is used by a container;
+                  when False, an image which is in use is kept
+    """
     key = GarbageCollectionPlugin.key
     workflow.plugin_workspace.setdefault(key, {})
     workspace = workflow.plugin_workspace[key]
-    workspace.setdefault('images_to_remove', set())
-    workspace['images_to_remove'].add(image)
+    images_key = 'images_to_remove' if force else 'images_to_remove_unforced'
+    workspace.setdefault(images_key, set())
+    workspace[images_key].add(image)
 
 
 class GarbageCollectionPlugin(ExitPlugin):
     key = "remove_built_image"
 
-    def __init__(self, tasker, workflow, remove_pulled_base_image=True):
+    def __init__(self, tasker, workflow, remove_pulled_base_image=True,
+                 timeout=DEFAULT_CLEANUP_TIMEOUT):
         """
         constructor
 
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
         :param remove_pulled_base_image: bool, remove also base image? default=True
+        :param timeout: float, max number of seconds to wait for images, containers
+                        and volumes to be removed
         """
         # call parent constructor
         super(GarbageCollectionPlugin, self).__init__(tasker, workflow)
         self.remove_base_image = remove_pulled_base_image
+        self.timeout = timeout
 
     def run(self):
+        """
+        Remove images in the background, together with containers and
+        volumes queued by other plugins, and wait for all of it to finish
+
+        :return: dict, report of removed, failed and pending objects
+        """
+        cleanup_queue = self.tasker.cleanup_queue
+        deadline = time.time() + self.timeout
+        workspace = self.workflow.plugin_workspace.get(self.key, {})
+
         image = self.workflow.builder.image_id
         if image:
-            self.remove_image(image, force=True)
+            cleanup_queue.remove_image(image, force=True)
+
+        images_to_remove = workspace.get('images_to_remove', [])
+        for image in images_to_remove:
+            cleanup_queue.remove_image(image, force=True)
+
+        # parent images can't be removed while the built image exists
+        cleanup_queue.flush(timeout=self.timeout)
 
         if self.remove_base_image and self.workflow.pulled_base_images:
             # FIXME: we may need to add force here, let's try it like this for now
             # FIXME: when ID of pulled img matches an ID of an image already present, don't remove
             for base_image_tag in self.workflow.pulled_base_images:
-                self.remove_image(base_image_tag, force=False)
+                cleanup_queue.remove_image(base_image_tag, force=False)
 
-        workspace = self.workflow.plugin_workspace.get(self.key, {})
-        images_to_remove = workspace.get('images_to_remove', [])
-        for image in images_to_remove:
-            self.remove_image(image, force=True)
-
-    def remove_image(self, image, force=False):
-        try:
-            self.tasker.remove_image(image, force=force)
-        except APIError as ex:
-            if ex.is_client_error():
-                self.log.warning("failed to remove image %s (%s: %s), ignoring",
-                                 image, ex.response.status_code, ex.response.reason)
-            else:
-                raise
-        except Exception as ex:
-            self.log.warning("exception while removing image %s: %r, ignoring",
-                             image, ex)
+        # e.g. parent images evicted from the node-local cache,
+        # which may still be used by other builds
+        for image in workspace.get('images_to_remove_unforced', []):
+            cleanup_queue.remove_image(image, force=False)
+
+        report = cleanup_queue.flush(timeout=max(deadline - time.time(), 0))
+        for kind, results in sorted(report.items()):
+            self.log.info("%s: %d removed, %d failed, %d pending", kind,
+                          len(results['removed']), len(results['failed']),
+                          len(results['pending']))
+        return report
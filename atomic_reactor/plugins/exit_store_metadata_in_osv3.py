@@ -10,10 +10,13 @@ from __future__ import unicode_literals
 import json
 import os
 
-from osbs.exceptions import OsbsResponseException
+from osbs.exceptions import OsbsException, OsbsResponseException
 from osbs.utils import graceful_chain_get
 
+from atomic_reactor.annotations import encode_annotations
+from atomic_reactor.plugins.build_docker_api import get_build_context_info
 from atomic_reactor.plugins.pre_add_help import AddHelpPlugin
+from atomic_reactor.plugins.post_compare_components import get_component_comparison_report
 from atomic_reactor.plugins.pre_reactor_config import get_openshift_session
 from atomic_reactor.constants import (PLUGIN_KOJI_IMPORT_PLUGIN_KEY,
                                       PLUGIN_KOJI_PROMOTE_PLUGIN_KEY,
@@ -25,6 +28,7 @@ from atomic_reactor.constants import (PLUGIN_KOJI_IMPORT_PLUGIN_KEY,
                                       PLUGIN_PULP_PULL_KEY,
                                       PLUGIN_VERIFY_MEDIA_KEY,
                                       MEDIA_TYPE_DOCKER_V1)
+from atomic_reactor.core import CleanupQueue
 from atomic_reactor.plugin import ExitPlugin
 from atomic_reactor.util import get_build_json
 
@@ -33,7 +37,8 @@ class StoreMetadataInOSv3Plugin(ExitPlugin):
     key = "store_metadata_in_osv3"
     is_allowed_to_fail = False
 
-    def __init__(self, tasker, workflow, url=None, verify_ssl=True, use_auth=True):
+    def __init__(self, tasker, workflow, url=None, verify_ssl=True, use_auth=True,
+                 compress_threshold=None, config_map_threshold=None):
         """
         constructor
 
@@ -41,6 +46,10 @@ class StoreMetadataInOSv3Plugin(ExitPlugin):
         :param workflow: DockerBuildWorkflow instance
         :param url: str, URL to OSv3 instance
         :param use_auth: bool, initiate authentication with openshift?
+        :param compress_threshold: int, compress JSON annotations longer than this,
+                                   None not to compress
+        :param config_map_threshold: int, store JSON annotations still longer than this
+                                     in a ConfigMap, None to keep them in annotations
         """
         # call parent constructor
         super(StoreMetadataInOSv3Plugin, self).__init__(tasker, workflow)
@@ -49,6 +58,8 @@ class StoreMetadataInOSv3Plugin(ExitPlugin):
             'insecure': not verify_ssl,
             'auth': {'enable': use_auth}
         }
+        self.compress_threshold = compress_threshold
+        self.config_map_threshold = config_map_threshold
 
     def get_result(self, result):
         if isinstance(result, Exception):
@@ -148,12 +159,29 @@ class StoreMetadataInOSv3Plugin(ExitPlugin):
         return pullspecs
 
     def get_plugin_metadata(self):
-        return {
+        metadata = {
             "errors": self.workflow.plugins_errors,
             "timestamps": self.workflow.plugins_timestamps,
             "durations": self.workflow.plugins_durations,
         }
 
+        # state of containers, volumes and images being removed in the background
+        cleanup_queue = getattr(self.tasker, 'cleanup_queue', None)
+        if isinstance(cleanup_queue, CleanupQueue):
+            metadata["cleanup"] = cleanup_queue.get_report()
+
+        # size of the build context and time spent archiving it
+        build_context_info = get_build_context_info(self.workflow)
+        if build_context_info is not None:
+            metadata["build_context"] = build_context_info
+
+        # differences between component lists of worker builds
+        comparison_report = get_component_comparison_report(self.workflow)
+        if comparison_report is not None:
+            metadata["component_comparison"] = comparison_report
+
+        return metadata
+
     def get_filesystem_metadata(self):
         data = {}
         try:
@@ -296,6 +324,19 @@ class StoreMetadataInOSv3Plugin(ExitPlugin):
         # metadata which orchestrate_build adjusted.
         if PLUGIN_GROUP_MANIFESTS_KEY in self.workflow.postbuild_results:
             annotations['repositories'] = json.dumps(self.get_repositories())
+
+        config_map_name = '{}-annotations'.format(build_id)
+        annotations, config_map_data = encode_annotations(
+            annotations, compress_threshold=self.compress_threshold,
+            config_map_threshold=self.config_map_threshold,
+            config_map_name=config_map_name)
+        if config_map_data:
+            try:
+                osbs.create_config_map(config_map_name, config_map_data)
+            except OsbsException:
+                self.log.debug("annotations ConfigMap: %r", config_map_data)
+                raise
+
         try:
             osbs.update_annotations_on_build(build_id, annotations)
         except OsbsResponseException:
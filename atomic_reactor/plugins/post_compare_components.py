@@ -6,36 +6,138 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 from atomic_reactor.plugin import PostBuildPlugin
+from atomic_reactor.plugins.post_fetch_worker_metadata import get_worker_metadata_index
 from atomic_reactor.plugins.pre_reactor_config import get_package_comparison_exceptions
-from atomic_reactor.constants import (PLUGIN_COMPARE_COMPONENTS_KEY,
-                                      PLUGIN_FETCH_WORKER_METADATA_KEY)
+from atomic_reactor.constants import PLUGIN_COMPARE_COMPONENTS_KEY
 
 
 SUPPORTED_TYPES = ("rpm",)
 
+# fields which must be the same on all platforms, by component type
+COMPARED_FIELDS = {
+    "rpm": ("version", "release", "signature"),
+}
+
+# max number of mismatching components to log, the rest is only in the report
+MAX_LOGGED_MISMATCHES = 20
+
+
+def get_component_comparison_report(workflow):
+    """
+    :return: dict, report of the last component comparison, or None
+    """
+    return workflow.plugin_workspace.get(PLUGIN_COMPARE_COMPONENTS_KEY, {}).get('report')
+
+
+class ComponentComparison(object):
+    """
+    Comparison of component lists from several platforms
+
+    All components are indexed by (type, name) in a single pass, then
+    each component is checked once across all platforms it appears on.
+    """
+
+    def __init__(self, exceptions=()):
+        """
+        :param exceptions: iterable of str, names of packages not to compare
+        """
+        self.exceptions = set(exceptions)
+
+    def compare(self, components_by_platform):
+        """
+        :param components_by_platform: dict, platform -> list of component dicts
+        :return: dict, report with keys:
+            platforms: list of str, compared platforms
+            compared: int, number of distinct components compared
+            ignored: list of str, names of components in package_comparison_exceptions
+            missing: dict, platform -> list of component names not present there
+                     although present on another platform
+            mismatches: list of dicts with keys type, name, fields (list of
+                        differing fields) and platforms (platform -> list of
+                        values of the compared fields)
+            unsupported: list of dicts with keys type and name
+        """
+        platforms = sorted(components_by_platform)
+        ignored = set()
+        unsupported = set()
+        # (type, name) -> platform -> list of components
+        index = {}
+        for platform in platforms:
+            for component in components_by_platform[platform]:
+                name = component['name']
+                if name in self.exceptions:
+                    ignored.add(name)
+                    continue
+
+                if component['type'] not in SUPPORTED_TYPES:
+                    unsupported.add((component['type'], name))
+                    continue
+
+                identifier = (component['type'], name)
+                index.setdefault(identifier, {}).setdefault(platform, []).append(component)
+
+        missing = {}
+        mismatches = []
+        for identifier in sorted(index):
+            by_platform = index[identifier]
+            if len(by_platform) < len(platforms):
+                for platform in platforms:
+                    if platform not in by_platform:
+                        missing.setdefault(platform, []).append(identifier[1])
+
+            mismatch = self._compare_component(identifier, by_platform)
+            if mismatch:
+                mismatches.append(mismatch)
+
+        return {
+            'platforms': platforms,
+            'compared': len(index),
+            'ignored': sorted(ignored),
+            'missing': missing,
+            'mismatches': mismatches,
+            'unsupported': [{'type': t, 'name': name} for t, name in sorted(unsupported)],
+        }
+
+    def _compare_component(self, identifier, by_platform):
+        fields = COMPARED_FIELDS[identifier[0]]
+        values = {}
+        for platform, components in by_platform.items():
+            for component in components:
+                values.setdefault(platform, []).append(
+                    dict((field, component.get(field)) for field in fields))
+
+        all_values = [value for platform_values in values.values()
+                      for value in platform_values]
+        if len(all_values) < 2:
+            return None
+
+        differing = [field for field in fields
+                     if len(set(value[field] for value in all_values)) > 1]
+        if not differing:
+            return None
+
+        return {
+            'type': identifier[0],
+            'name': identifier[1],
+            'fields': differing,
+            'platforms': values,
+        }
+
 
 class CompareComponentsPlugin(PostBuildPlugin):
     """
     Compare components from each worker build and verify the same version was
     on each worker.
+
+    Components missing on some platforms are assumed to be arch dependencies
+    and don't fail the build. The comparison report is kept in plugin workspace
+    and stored in build metadata, see get_component_comparison_report().
     """
 
     key = PLUGIN_COMPARE_COMPONENTS_KEY
     is_allowed_to_fail = False
 
-    def rpm_compare(self, a, b):
-        """
-        Compare rpm component version 'a' with 'b'.
-        'name' is implied equal as it is the key() lookup
-        """
-        if a['version'] == b['version'] and \
-           a['release'] == b['release'] and \
-           a['signature'] == b['signature']:
-            return
-
-        raise ValueError("%s != %s" % (a, b))
-
-    def get_component_list_from_workers(self, worker_metadatas):
+    def get_component_list_from_workers(self, worker_metadata):
         """
         Find the component lists from each worker build.
 
@@ -48,72 +150,58 @@ class CompareComponentsPlugin(PostBuildPlugin):
 
         Reference plugin post_koji_upload for details on how this is created.
 
-        :return: list of component lists
+        :param worker_metadata: WorkerMetadataIndex instance
+        :return: dict, platform -> component list
         """
-        comp_list = []
-        for platform in sorted(worker_metadatas.keys()):
-            for instance in worker_metadatas[platform]['output']:
-                if instance['type'] == 'docker-image':
-                    if 'components' not in instance or not instance['components']:
-                        self.log.warn("Missing 'components' key in 'output' metadata instance: %s",
-                                      instance)
-                        continue
-
-                    comp_list.append(instance['components'])
+        comp_lists = {}
+        for platform in worker_metadata.platforms:
+            components, skipped = worker_metadata.get_components(platform)
+            for instance in skipped:
+                self.log.warn("Missing 'components' key in 'output' metadata instance: %s",
+                              instance)
+            if components:
+                comp_lists[platform] = components
 
-        return comp_list
+        return comp_lists
 
     def run(self):
         """
         Run the plugin.
         """
 
-        worker_metadatas = self.workflow.postbuild_results.get(PLUGIN_FETCH_WORKER_METADATA_KEY)
-        comp_list = self.get_component_list_from_workers(worker_metadatas)
+        worker_metadata = get_worker_metadata_index(self.workflow)
+        comp_lists = self.get_component_list_from_workers(worker_metadata)
 
-        if not comp_list:
+        if not comp_lists:
             raise ValueError("No components to compare")
 
         package_comparison_exceptions = get_package_comparison_exceptions(self.workflow)
 
-        # master compare list
-        master_comp = {}
+        report = ComponentComparison(package_comparison_exceptions).compare(comp_lists)
+        workspace = self.workflow.plugin_workspace.setdefault(self.key, {})
+        workspace['report'] = report
 
-        # The basic strategy is to start with empty lists and add new component
-        # versions as we find them.  Upon next iteration, we should notice
-        # duplicates and be able to compare them.  If the match fails, we raise
-        # an exception.  If the component name does not exist, assume it was an
-        # arch dependency, add it to list and continue.  By the time we get to
-        # the last arch, we should have every possible component in the master
-        # list to compare with.
+        if report['ignored']:
+            self.log.info("Ignoring comparison of packages: %s", ', '.join(report['ignored']))
 
-        # Keep everything separated by component type
-        failed = False
-        for components in comp_list:
-            for component in components:
-                t = component['type']
-                name = component['name']
+        for platform, names in sorted(report['missing'].items()):
+            self.log.debug("%d components not present on %s: %s",
+                           len(names), platform, ', '.join(names))
 
-                if name in package_comparison_exceptions:
-                    self.log.info("Ignoring comparison of package %s", name)
-                    continue
-
-                if t not in SUPPORTED_TYPES:
-                    raise ValueError("Type %s not supported")
-
-                identifier = (t, name)
-                if identifier not in master_comp:
-                    master_comp[identifier] = component
-                    continue
+        for mismatch in report['mismatches'][:MAX_LOGGED_MISMATCHES]:
+            self.log.warn("Comparison mismatch for component %s (%s): %s",
+                          mismatch['name'], ', '.join(mismatch['fields']),
+                          mismatch['platforms'])
+        if len(report['mismatches']) > MAX_LOGGED_MISMATCHES:
+            self.log.warn("%d more mismatching components not logged",
+                          len(report['mismatches']) - MAX_LOGGED_MISMATCHES)
 
-                try:
-                    mc = master_comp[identifier]
+        if report['unsupported']:
+            raise ValueError("Type %s not supported" %
+                             ', '.join(sorted(set(u['type'] for u in report['unsupported']))))
 
-                    if t == 'rpm':
-                        self.rpm_compare(mc, component)
-                except ValueError as ex:
-                    self.log.warn("Comparison mismatch for component %s: %s", name, ex)
-                    failed = True
+        if report['mismatches']:
+            raise ValueError("Failed component comparison: %d of %d components differ" %
+                             (len(report['mismatches']), report['compared']))
 
-        if failed:
-            raise ValueError("Failed component comparison")
+        return report
@@ -5,22 +5,180 @@ All rights reserved.
 This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
+from multiprocessing.pool import ThreadPool
+import sys
+
+from six import reraise
+
 from atomic_reactor.plugin import PostBuildPlugin
 from atomic_reactor.plugins.build_orchestrate_build import get_worker_build_info
 from atomic_reactor.constants import PLUGIN_FETCH_WORKER_METADATA_KEY
 from atomic_reactor.plugins.exit_remove_worker_metadata import defer_removal
 
 
+def get_worker_metadata_index(workflow):
+    """
+    Index of the worker metadata fetched by this plugin
+
+    The index is built on first use and kept in plugin workspace.
+
+    :param workflow: DockerBuildWorkflow instance
+    :return: WorkerMetadataIndex instance, None if metadata was not fetched
+    """
+    worker_metadatas = workflow.postbuild_results.get(PLUGIN_FETCH_WORKER_METADATA_KEY)
+    if worker_metadatas is None:
+        return None
+
+    workspace = workflow.plugin_workspace.setdefault(PLUGIN_FETCH_WORKER_METADATA_KEY, {})
+    index = workspace.get('index')
+    if index is None or index.worker_metadatas is not worker_metadatas:
+        index = WorkerMetadataIndex(worker_metadatas)
+        workspace['index'] = index
+    return index
+
+
+class WorkerMetadataIndex(object):
+    """
+    Worker metadata indexed for lookups by platform and by output
+
+    Outputs are indexed by type, arch and filename, and components of
+    docker-image outputs are collected per platform, in a single pass over
+    the metadata.
+
+    The index refers to the fetched metadata documents, it doesn't copy
+    them.
+    """
+
+    def __init__(self, worker_metadatas):
+        """
+        :param worker_metadatas: dict, platform -> koji metadata fragment
+        """
+        self.worker_metadatas = worker_metadatas
+        self.platforms = sorted(worker_metadatas)
+
+        # (type, arch, filename) -> list of (position, platform, output)
+        self._outputs = {}
+        # platform -> list of components
+        self._components = {}
+        # platform -> list of docker-image outputs without components
+        self._no_components = {}
+
+        position = 0
+        for platform in self.platforms:
+            for output in worker_metadatas[platform].get('output', []):
+                key = (output.get('type'), output.get('arch'), output.get('filename'))
+                self._outputs.setdefault(key, []).append((position, platform, output))
+                position += 1
+
+                if output.get('type') != 'docker-image':
+                    continue
+                if output.get('components'):
+                    self._components.setdefault(platform, []).extend(output['components'])
+                else:
+                    self._no_components.setdefault(platform, []).append(output)
+
+    def __len__(self):
+        return len(self.platforms)
+
+    def get_metadata(self, platform):
+        """
+        :param platform: str, platform name
+        :return: dict, koji metadata fragment of the platform
+        """
+        return self.worker_metadatas[platform]
+
+    def get_outputs(self, output_type=None, arch=None, filename=None, platform=None):
+        """
+        Outputs of worker builds, in platform order, then in the order of
+        the metadata of each platform
+
+        :param output_type: str, type of outputs to return, None for all
+        :param arch: str, arch of outputs to return, None for all
+        :param filename: str, filename of outputs to return, None for all
+        :param platform: str, platform whose outputs to return, None for all
+        :return: list of (platform, output dict) tuples
+        """
+        outputs = []
+        for (o_type, o_arch, o_filename), entries in self._outputs.items():
+            if output_type is not None and o_type != output_type:
+                continue
+            if arch is not None and o_arch != arch:
+                continue
+            if filename is not None and o_filename != filename:
+                continue
+            outputs.extend(entry for entry in entries
+                           if platform is None or entry[1] == platform)
+
+        outputs.sort(key=lambda entry: entry[0])
+        return [(o_platform, output) for _, o_platform, output in outputs]
+
+    def get_buildroots(self, platform):
+        """
+        :param platform: str, platform name
+        :return: list of buildroot dicts of the platform
+        """
+        return self.worker_metadatas[platform].get('buildroots', [])
+
+    def get_components(self, platform):
+        """
+        :param platform: str, platform name
+        :return: tuple, (list of components of docker-image outputs of the
+                 platform, list of docker-image outputs of the platform
+                 which have no components)
+        """
+        return self._components.get(platform, []), self._no_components.get(platform, [])
+
+
 class FetchWorkerMetadataPlugin(PostBuildPlugin):
     """
     Fetch worker metadata from each platform and return a dict of
     each platform's metadata.
 
+    ConfigMaps of all platforms are read concurrently. Other plugins
+    should look up the metadata through get_worker_metadata_index().
     """
 
     key = PLUGIN_FETCH_WORKER_METADATA_KEY
     is_allowed_to_fail = False
 
+    def fetch_metadata(self, platform, build_annotations, config_maps):
+        """
+        Read worker metadata of one platform
+
+        :param config_maps: list, names of ConfigMaps read are appended to it,
+                            also when reading fails later on
+        :return: dict, metadata, None when the annotations don't reference
+                 worker metadata
+        """
+        # retrieve all the workspace data
+        build_info = get_worker_build_info(self.workflow, platform)
+        osbs = build_info.osbs
+
+        kind = "configmap/"
+        cmlen = len(kind)
+        cm_key_tmp = build_annotations['metadata_fragment']
+        cm_frag_key = build_annotations['metadata_fragment_key']
+
+        if not cm_key_tmp or not cm_frag_key or cm_key_tmp[:cmlen] != kind:
+            self.log.warning("Bad ConfigMap annotations for platform %s", platform)
+            return None
+
+        # use the key to get the configmap data and then use the
+        # fragment_key to get the build metadata inside the configmap data
+        cm_key = cm_key_tmp[cmlen:]
+        cm_data = osbs.get_config_map(cm_key)
+        config_maps.append(cm_key)
+        return cm_data.get_data_by_key(cm_frag_key)
+
+    def _fetch_metadata(self, args):
+        platform, build_annotations = args
+        config_maps = []
+        try:
+            metadata = self.fetch_metadata(platform, build_annotations, config_maps)
+        except Exception:
+            return None, config_maps, sys.exc_info()
+        return metadata, config_maps, None
+
     def run(self):
         """
         Run the plugin.
@@ -32,31 +190,35 @@ class FetchWorkerMetadataPlugin(PostBuildPlugin):
         build_result = self.workflow.build_result
 
         annotations = build_result.annotations
-        worker_builds = annotations['worker-builds']
-
-        for platform, build_annotations in worker_builds.items():
-            # retrieve all the workspace data
-            build_info = get_worker_build_info(self.workflow, platform)
-            osbs = build_info.osbs
-
-            kind = "configmap/"
-            cmlen = len(kind)
-            cm_key_tmp = build_annotations['metadata_fragment']
-            cm_frag_key = build_annotations['metadata_fragment_key']
-
-            if not cm_key_tmp or not cm_frag_key or cm_key_tmp[:cmlen] != kind:
-                self.log.warning("Bad ConfigMap annotations for platform %s", platform)
-                continue
-
-            # use the key to get the configmap data and then use the
-            # fragment_key to get the build metadata inside the configmap data
-            # save the worker_build metadata
-            cm_key = cm_key_tmp[cmlen:]
-            cm_data = osbs.get_config_map(cm_key)
-            metadata = cm_data.get_data_by_key(cm_frag_key)
-
-            metadatas[platform] = metadata
-
-            defer_removal(self.workflow, cm_key, osbs)
+        worker_builds = sorted(annotations['worker-builds'].items())
+
+        if len(worker_builds) > 1:
+            pool = ThreadPool(len(worker_builds))
+            try:
+                results = pool.map(self._fetch_metadata, worker_builds)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            results = [self._fetch_metadata(args) for args in worker_builds]
+
+        # ConfigMaps are removed even when reading some platform failed
+        failure = None
+        for (platform, _), (metadata, config_maps, exc_info) in zip(worker_builds, results):
+            if config_maps:
+                osbs = get_worker_build_info(self.workflow, platform).osbs
+                for config_map in config_maps:
+                    defer_removal(self.workflow, config_map, osbs)
+
+            if exc_info is not None:
+                self.log.error("Failed to fetch worker metadata for platform %s: %r",
+                               platform, exc_info[1])
+                failure = failure or exc_info
+            elif metadata is not None:
+                # save the worker_build metadata
+                metadatas[platform] = metadata
+
+        if failure is not None:
+            reraise(*failure)
 
         return metadatas
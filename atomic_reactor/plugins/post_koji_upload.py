@@ -8,29 +8,21 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
-from collections import namedtuple
 import os
-import subprocess
 from tempfile import NamedTemporaryFile
-import copy
 
-from atomic_reactor import __version__ as atomic_reactor_version
+from atomic_reactor.koji_metadata import (KojiMetadataBuilder, add_buildroot_id,
+                                          add_log_type)
 from atomic_reactor.plugin import PostBuildPlugin
-from atomic_reactor.plugins.post_rpmqa import PostBuildRPMqaPlugin
 from atomic_reactor.plugins.pre_reactor_config import (get_openshift_session,
                                                        get_prefer_schema1_digest,
                                                        get_koji_session)
-from atomic_reactor.constants import PROG, PLUGIN_KOJI_UPLOAD_PLUGIN_KEY
-from atomic_reactor.util import (get_version_of_tools, get_checksums,
-                                 get_build_json, get_docker_architecture,
+from atomic_reactor.constants import PLUGIN_KOJI_UPLOAD_PLUGIN_KEY
+from atomic_reactor.util import (Output, get_build_json,
                                  get_image_upload_filename,
                                  get_manifest_media_type)
-from atomic_reactor.rpm_util import parse_rpm_output, rpm_qf_args
 from osbs.exceptions import OsbsException
 
-# An output file and its metadata
-Output = namedtuple('Output', ['file', 'metadata'])
-
 
 class KojiUploadLogger(object):
     def __init__(self, logger, notable_percent=10):
@@ -134,131 +126,7 @@ class KojiUploadPlugin(PostBuildPlugin):
         self.build_id = None
         self.pullspec_image = None
         self.platform = platform
-
-    def get_rpms(self):
-        """
-        Build a list of installed RPMs in the format required for the
-        metadata.
-        """
-
-        tags = [
-            'NAME',
-            'VERSION',
-            'RELEASE',
-            'ARCH',
-            'EPOCH',
-            'SIGMD5',
-            'SIGPGP:pgpsig',
-            'SIGGPG:pgpsig',
-        ]
-
-        cmd = "/bin/rpm " + rpm_qf_args(tags)
-        try:
-            # py3
-            (status, output) = subprocess.getstatusoutput(cmd)
-        except AttributeError:
-            # py2
-            with open('/dev/null', 'r+') as devnull:
-                p = subprocess.Popen(cmd,
-                                     shell=True,
-                                     stdin=devnull,
-                                     stdout=subprocess.PIPE,
-                                     stderr=devnull)
-
-                (stdout, stderr) = p.communicate()
-                status = p.wait()
-                output = stdout.decode()
-
-        if status != 0:
-            self.log.debug("%s: stderr output: %s", cmd, stderr)
-            raise RuntimeError("%s: exit code %s" % (cmd, status))
-
-        return parse_rpm_output(output.splitlines(), tags)
-
-    def get_output_metadata(self, path, filename):
-        """
-        Describe a file by its metadata.
-
-        :return: dict
-        """
-
-        checksums = get_checksums(path, ['md5'])
-        metadata = {'filename': filename,
-                    'filesize': os.path.getsize(path),
-                    'checksum': checksums['md5sum'],
-                    'checksum_type': 'md5'}
-
-        return metadata
-
-    def get_builder_image_id(self):
-        """
-        Find out the docker ID of the buildroot image we are in.
-        """
-
-        try:
-            buildroot_tag = os.environ["OPENSHIFT_CUSTOM_BUILD_BASE_IMAGE"]
-        except KeyError:
-            return ''
-
-        try:
-            pod = self.osbs.get_pod_for_build(self.build_id)
-            all_images = pod.get_container_image_ids()
-        except OsbsException as ex:
-            self.log.error("unable to find image id: %r", ex)
-            return buildroot_tag
-
-        try:
-            return all_images[buildroot_tag]
-        except KeyError:
-            self.log.error("Unable to determine buildroot image ID for %s",
-                           buildroot_tag)
-            return buildroot_tag
-
-    def get_buildroot(self, build_id):
-        """
-        Build the buildroot entry of the metadata.
-
-        :return: dict, partial metadata
-        """
-
-        docker_info = self.tasker.get_info()
-        host_arch, docker_version = get_docker_architecture(self.tasker)
-
-        buildroot = {
-            'id': 1,
-            'host': {
-                'os': docker_info['OperatingSystem'],
-                'arch': host_arch,
-            },
-            'content_generator': {
-                'name': PROG,
-                'version': atomic_reactor_version,
-            },
-            'container': {
-                'type': 'docker',
-                'arch': os.uname()[4],
-            },
-            'tools': [
-                {
-                    'name': tool['name'],
-                    'version': tool['version'],
-                }
-                for tool in get_version_of_tools()] + [
-                {
-                    'name': 'docker',
-                    'version': docker_version,
-                },
-            ],
-            'components': self.get_rpms(),
-            'extra': {
-                'osbs': {
-                    'build_id': build_id,
-                    'builder_image_id': self.get_builder_image_id(),
-                }
-            },
-        }
-
-        return buildroot
+        self.metadata_builder = None
 
     def get_logs(self):
         """
@@ -274,22 +142,8 @@ class KojiUploadPlugin(PostBuildPlugin):
         build_logs.flush()
         filename = "{platform}-build.log".format(platform=self.platform)
         return [Output(file=build_logs,
-                       metadata=self.get_output_metadata(build_logs.name,
-                                                         filename))]
-
-    def get_image_components(self):
-        """
-        Re-package the output of the rpmqa plugin into the format required
-        for the metadata.
-        """
-
-        output = self.workflow.image_components
-        if output is None:
-            self.log.error("%s plugin did not run!",
-                           PostBuildRPMqaPlugin.key)
-            output = []
-
-        return output
+                       metadata=self.metadata_builder.get_output_metadata(build_logs.name,
+                                                                          filename))]
 
     def get_image_output(self):
         """
@@ -306,7 +160,7 @@ class KojiUploadPlugin(PostBuildPlugin):
         image_name = get_image_upload_filename(self.workflow.exported_image_sequence[-1],
                                                self.workflow.builder.image_id,
                                                self.platform)
-        metadata = self.get_output_metadata(saved_image, image_name)
+        metadata = self.metadata_builder.get_output_metadata(saved_image, image_name)
         output = Output(file=open(saved_image), metadata=metadata)
 
         return metadata, output
@@ -380,34 +234,15 @@ class KojiUploadPlugin(PostBuildPlugin):
         :return: list, Output instances
         """
 
-        def add_buildroot_id(output):
-            logfile, metadata = output
-            metadata.update({'buildroot_id': buildroot_id})
-            return Output(file=logfile, metadata=metadata)
-
-        def add_log_type(output, arch):
-            logfile, metadata = output
-            metadata.update({'type': 'log', 'arch': arch})
-            return Output(file=logfile, metadata=metadata)
-
         arch = os.uname()[4]
-        output_files = [add_log_type(add_buildroot_id(metadata), arch)
+        output_files = [add_log_type(add_buildroot_id(metadata, buildroot_id), arch)
                         for metadata in self.get_logs()]
 
         # Parent of squashed built image is base image
         image_id = self.workflow.builder.image_id
         parent_id = self.workflow.builder.base_image_inspect['Id']
 
-        # Read config from the registry using v2 schema 2 digest
-        registries = self.workflow.push_conf.docker_registries
-        if registries:
-            config = copy.deepcopy(registries[0].config)
-        else:
-            config = {}
-
-        # We don't need container_config section
-        if config and 'container_config' in config:
-            del config['container_config']
+        config = self.metadata_builder.get_image_config()
 
         repositories, typed_digests = self.get_repositories_and_digests()
         tags = set(image.tag for image in self.workflow.tag_conf.images)
@@ -416,7 +251,7 @@ class KojiUploadPlugin(PostBuildPlugin):
         metadata.update({
             'arch': arch,
             'type': 'docker-image',
-            'components': self.get_image_components(),
+            'components': self.metadata_builder.get_image_components(),
             'extra': {
                 'image': {
                     'arch': arch,
@@ -439,7 +274,7 @@ class KojiUploadPlugin(PostBuildPlugin):
             del metadata['extra']['docker']['digests']
 
         # Add the 'docker save' image to the output
-        image = add_buildroot_id(output)
+        image = add_buildroot_id(output, buildroot_id)
         output_files.append(image)
 
         return output_files
@@ -472,7 +307,9 @@ class KojiUploadPlugin(PostBuildPlugin):
 
         metadata_version = 0
 
-        buildroot = self.get_buildroot(build_id=self.build_id)
+        self.metadata_builder = KojiMetadataBuilder(self.workflow, self.tasker,
+                                                    self.osbs, self.build_id)
+        buildroot = self.metadata_builder.get_buildroot()
         output_files = self.get_output(buildroot['id'])
 
         koji_metadata = {
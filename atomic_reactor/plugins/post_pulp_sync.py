@@ -54,7 +54,7 @@ from atomic_reactor.constants import PLUGIN_PULP_SYNC_KEY, PLUGIN_PULP_PUSH_KEY
 from atomic_reactor.plugin import PostBuildPlugin
 from atomic_reactor.util import ImageName, Dockercfg, are_plugins_in_order
 # import pulp_util to get the dockpulp.log set up once
-from atomic_reactor.pulp_util import PulpLog
+from atomic_reactor.pulp_util import PulpExecutor, PulpLog
 from atomic_reactor.plugins.pre_reactor_config import get_pulp, get_docker_registry
 import dockpulp
 import os
@@ -125,6 +125,7 @@ class PulpSyncPlugin(PostBuildPlugin):
         pulp = get_pulp(self.workflow, self.pulp_fallback)
         self.pulp_registry_name = pulp['name']
         self.pulp_secret_path = pulp['auth'].get('ssl_certs_dir')
+        self.executor = PulpExecutor(pulp.get('workers'))
 
         docker_fallback = {
             'version': 'v2',
@@ -192,7 +193,7 @@ class PulpSyncPlugin(PostBuildPlugin):
             'basic_auth_password': registry_creds['password'],
         }
 
-    def create_repo_if_missing(self, pulp, repo_id, registry_id):
+    def get_pulp_repo_prefix(self, pulp):
         if self.pulp_repo_prefix is None:
             try:
                 # Requires dockpulp-1.25
@@ -200,6 +201,10 @@ class PulpSyncPlugin(PostBuildPlugin):
             except AttributeError:
                 self.pulp_repo_prefix = 'redhat-'
 
+        return self.pulp_repo_prefix
+
+    def create_repo_if_missing(self, pulp, repo_id, registry_id):
+        self.get_pulp_repo_prefix(pulp)
         prefixed_repo_id = "{prefix}{id}".format(prefix=self.pulp_repo_prefix,
                                                  id=repo_id)
         found_repos = pulp.getRepos([prefixed_repo_id], fields=['id'])
@@ -242,24 +247,31 @@ class PulpSyncPlugin(PostBuildPlugin):
             kwargs['ssl_validation'] = not self.insecure_registry
 
         images = []
-        repos = {}  # pulp repo -> repo id
+        pulp_repos = []
+        registry_ids = {}  # pulp repo -> registry id
         for image in self.workflow.tag_conf.images:
-            if image.pulp_repo not in repos:
-                repo_id = self.create_repo_if_missing(pulp,
-                                                      image.pulp_repo,
-                                                      image.to_str(registry=False,
-                                                                   tag=False))
-                self.log.info("syncing %s", repo_id)
-                pulp.syncRepo(repo=repo_id,
-                              feed=self.docker_registry,
-                              **kwargs)
-                repos[image.pulp_repo] = repo_id
+            if image.pulp_repo not in registry_ids:
+                pulp_repos.append(image.pulp_repo)
+                registry_ids[image.pulp_repo] = image.to_str(registry=False, tag=False)
 
             images.append(ImageName(registry=pulp_registry,
                                     repo=image.repo,
                                     namespace=image.namespace,
                                     tag=image.tag))
 
+        def sync_repo(pulp_repo):
+            repo_id = self.create_repo_if_missing(pulp, pulp_repo, registry_ids[pulp_repo])
+            self.log.info("syncing %s", repo_id)
+            pulp.syncRepo(repo=repo_id,
+                          feed=self.docker_registry,
+                          **kwargs)
+            return repo_id
+
+        if pulp_repos:
+            # resolved once, before repositories are synced concurrently
+            self.get_pulp_repo_prefix(pulp)
+        repos = dict(zip(pulp_repos, self.executor.map(sync_repo, pulp_repos)))
+
         if self.publish:
             self.log.info("publishing to crane")
             pulp.crane(list(repos.values()), wait=True)
@@ -58,7 +58,8 @@ class PulpTagPlugin(PostBuildPlugin):
         repo_tags = {}
         for repo_id, pulp_repo in pulp_repos.items():
             repo_tags[repo_id] = {"tag": "%s:%s" % (",".join(pulp_repo.tags), v1_image_id)}
-            handler.update_repo(repo_id, repo_tags[repo_id])
+        handler.executor.map(lambda repo_id: handler.update_repo(repo_id, repo_tags[repo_id]),
+                             sorted(repo_tags))
         return repo_tags
 
     def run(self):
@@ -43,6 +43,7 @@ from __future__ import print_function, unicode_literals
 import tempfile
 import os
 import subprocess
+from functools import partial
 
 from atomic_reactor.constants import PLUGIN_PULP_SYNC_KEY, PLUGIN_PULP_PUSH_KEY
 from atomic_reactor.plugin import PostBuildPlugin
@@ -169,22 +170,24 @@ class PulpPushPlugin(PostBuildPlugin):
             except Exception:
                 self.log.info("Falling back to full tar upload")
 
-        in_rh_everything = False
         if compressed_filename:
             filename = compressed_filename
-        for repo_id in pulp_repos:
-            in_rh_everything = self.pulp_handler.upload(filename, repo_id)
-            # Content was uploaded to shared redhat-everything repo. This should only be done
-            # once regardless of how many pulp repos are in use.
-            if in_rh_everything:
-                break
+        repo_ids = list(pulp_repos)
+        in_rh_everything = self.pulp_handler.upload(filename, repo_ids[0])
+        # Content uploaded to shared redhat-everything repo is only uploaded
+        # once regardless of how many pulp repos are in use.
+        if not in_rh_everything:
+            self.pulp_handler.executor.map(partial(self.pulp_handler.upload, filename),
+                                           repo_ids[1:])
         self._unlink_file(compressed_filename)
 
-        for repo_id, pulp_repo in pulp_repos.items():
+        def tag_repo(repo_id):
             if in_rh_everything:
                 self.pulp_handler.copy_v1_layers(repo_id, layers)
-            self.pulp_handler.update_repo(repo_id, {"tag": "%s:%s" % (",".join(pulp_repo.tags),
-                                                                      top_layer)})
+            tags = ",".join(pulp_repos[repo_id].tags)
+            self.pulp_handler.update_repo(repo_id, {"tag": "%s:%s" % (tags, top_layer)})
+
+        self.pulp_handler.executor.map(tag_repo, repo_ids)
 
         # Only publish if we don't the pulp_sync plugin also configured
         if self.publish:
@@ -6,9 +6,14 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
+import shutil
+import tempfile
+
+from atomic_reactor.constants import IMAGE_TYPE_DOCKER_ARCHIVE
 from atomic_reactor.plugin import PostBuildPlugin
-from atomic_reactor.rpm_util import rpm_qf_args, parse_rpm_output
-from docker.errors import APIError
+from atomic_reactor.rpm_util import (rpm_qf_args, parse_rpm_records, extract_rpmdb,
+                                     query_rpmdb)
+from atomic_reactor.util import image_archive_stream
 
 
 __all__ = ('PostBuildRPMqaPlugin', )
@@ -19,17 +24,22 @@ class PostBuildRPMqaPlugin(PostBuildPlugin):
     is_allowed_to_fail = False
     sep = ';'
 
-    def __init__(self, tasker, workflow, image_id, ignore_autogenerated_gpg_keys=True):
+    def __init__(self, tasker, workflow, image_id, ignore_autogenerated_gpg_keys=True,
+                 offline_rpmdb=False):
         """
         constructor
 
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
+        :param offline_rpmdb: bool, read rpm database from image layers using rpm
+                              on the host instead of running rpm in a container;
+                              falls back to the container if that is not possible
         """
         # call parent constructor
         super(PostBuildRPMqaPlugin, self).__init__(tasker, workflow)
         self.image_id = image_id
         self.ignore_autogenerated_gpg_keys = ignore_autogenerated_gpg_keys
+        self.offline_rpmdb = offline_rpmdb
 
         self._container_ids = []
 
@@ -38,7 +48,11 @@ class PostBuildRPMqaPlugin(PostBuildPlugin):
         if self.workflow.image_components is not None:
             return None
 
-        plugin_output = self.gather_output()
+        plugin_output = None
+        if self.offline_rpmdb:
+            plugin_output = self.gather_output_offline()
+        if not plugin_output:
+            plugin_output = self.gather_output()
 
         # gpg-pubkey are autogenerated packages by rpm when you import a gpg key
         # these are of course not signed, let's ignore those by default
@@ -46,23 +60,12 @@ class PostBuildRPMqaPlugin(PostBuildPlugin):
             self.log.debug("ignore rpms 'gpg-pubkey'")
             plugin_output = [x for x in plugin_output if not x.startswith("gpg-pubkey" + self.sep)]
 
-        volumes = []
+        # containers and their volumes are removed in the background,
+        # remove_built_image waits for them at the end of the build
         for container_id in self._container_ids:
-            volumes.extend(self.tasker.get_volumes_for_container(container_id))
-
-            try:
-                self.tasker.remove_container(container_id)
-            except APIError:
-                self.log.warning("error removing container %s (ignored):", container_id,
-                                 exc_info=True)
+            self.tasker.cleanup_queue.remove_container(container_id, remove_volumes=True)
 
-        for volume_name in volumes:
-            try:
-                self.tasker.remove_volume(volume_name)
-            except APIError:
-                self.log.warning("error removing volume %s (ignored):", volume_name, exc_info=True)
-
-        self.workflow.image_components = parse_rpm_output(plugin_output)
+        self.workflow.image_components = parse_rpm_records(plugin_output)
 
         return plugin_output
 
@@ -82,3 +85,33 @@ class PostBuildRPMqaPlugin(PostBuildPlugin):
                 return output
 
         raise RuntimeError('Unable to gather list of installed packages in container')
+
+    def gather_output_offline(self):
+        """
+        List RPMs from the rpm database found in image layers
+
+        :return: list of str, rpm output, or None if the database couldn't be read
+        """
+        tmpdir = tempfile.mkdtemp(prefix='rpmdb-')
+        try:
+            exported = self.workflow.exported_image_sequence
+            if exported and exported[-1].get('type') == IMAGE_TYPE_DOCKER_ARCHIVE:
+                image_path = exported[-1]['path']
+                self.log.info('reading rpm database from %s', image_path)
+                with open(image_path, 'rb') as image_stream:
+                    dbpath = extract_rpmdb(image_stream, tmpdir)
+            else:
+                self.log.info('reading rpm database from image %s', self.image_id)
+                with image_archive_stream(self.tasker.d, self.image_id) as image_stream:
+                    dbpath = extract_rpmdb(image_stream, tmpdir)
+
+            if dbpath is None:
+                self.log.warning('rpm database not found in image, using container')
+                return None
+
+            return query_rpmdb(dbpath, separator=self.sep)
+        except Exception as ex:
+            self.log.warning('unable to read rpm database, using container: %r', ex)
+            return None
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
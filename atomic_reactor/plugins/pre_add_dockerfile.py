@@ -68,7 +68,8 @@ class AddDockerfilePlugin(PreBuildPlugin):
         self.use_final_dockerfile = use_final_dockerfile
 
         if nvr is None:
-            labels = Labels(df_parser(self.workflow.builder.df_path).labels)
+            labels = Labels(df_parser(self.workflow.builder.df_path,
+                                      workflow=self.workflow).labels)
             try:
                 _, name = labels.get_name_and_value(Labels.LABEL_TYPE_NAME)
                 _, version = labels.get_name_and_value(Labels.LABEL_TYPE_VERSION)
@@ -45,7 +45,7 @@ class ChangeFromPlugin(PreBuildPlugin):
 
     def run(self):
         builder = self.workflow.builder
-        dfp = df_parser(builder.df_path)
+        dfp = df_parser(builder.df_path, workflow=self.workflow)
 
         organization = get_registries_organization(self.workflow)
         df_base = ImageName.parse(dfp.baseimage)
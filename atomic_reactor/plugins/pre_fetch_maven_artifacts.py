@@ -11,14 +11,19 @@ import fnmatch
 import hashlib
 import koji
 import os
+import re
 
 from atomic_reactor import util
-from atomic_reactor.constants import DEFAULT_DOWNLOAD_BLOCK_SIZE, PLUGIN_FETCH_MAVEN_KEY
+from atomic_reactor.constants import (PLUGIN_FETCH_MAVEN_KEY, DEFAULT_DOWNLOAD_WORKERS,
+                                      DEFAULT_DOWNLOAD_CONNECTIONS_PER_HOST,
+                                      DEFAULT_DOWNLOAD_RETRIES, DEFAULT_DOWNLOAD_CACHE_MAX_SIZE)
+from atomic_reactor.download import DownloadCache, FileDownload, ParallelDownloader
+from atomic_reactor.koji_util import koji_multicall
 from atomic_reactor.plugin import PreBuildPlugin
 from atomic_reactor.plugins.pre_reactor_config import (get_koji_session,
                                                        get_koji_path_info,
                                                        get_artifacts_allowed_domains)
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 
 try:
     from urlparse import urlparse
@@ -26,6 +31,53 @@ except ImportError:
     from urllib.parse import urlparse
 
 
+class ArchiveIndex(object):
+    """
+    Koji build archives indexed for matching against archive requests
+
+    Requests for an exact filename, or for a group_id, are resolved by
+    lookup; only the remaining candidates are matched against the request.
+    """
+
+    GLOB_CHARS = re.compile(r'[*?[]')
+
+    def __init__(self, build_archives):
+        self.build_archives = list(build_archives)
+        self.by_filename = defaultdict(list)
+        self.by_group_id = defaultdict(list)
+        for position, build_archive in enumerate(self.build_archives):
+            self.by_filename[build_archive['filename']].append(position)
+            self.by_group_id[build_archive['group_id']].append(position)
+
+    def find(self, filename=None, group_id=None):
+        """
+        Find archives matching given filename glob and group_id
+
+        :param filename: str, glob the archive filename has to match
+        :param group_id: str, group_id the archive has to have
+        :return: list<int>, positions of matching archives
+        """
+        if filename and not self.GLOB_CHARS.search(filename):
+            candidates = self.by_filename.get(filename, [])
+        elif group_id:
+            candidates = self.by_group_id.get(group_id, [])
+        else:
+            candidates = range(len(self.build_archives))
+
+        return [position for position in candidates
+                if self._matches(self.build_archives[position], filename, group_id)]
+
+    @staticmethod
+    def _matches(build_archive, filename, group_id):
+        if filename and not fnmatch.fnmatch(build_archive['filename'], filename):
+            return False
+
+        if group_id and group_id != build_archive['group_id']:
+            return False
+
+        return True
+
+
 class NvrRequest(object):
 
     def __init__(self, nvr, archives=None):
@@ -35,28 +87,28 @@ class NvrRequest(object):
         for archive in self.archives:
             archive['matched'] = False
 
-    def match(self, build_archive):
-        if not self.archives:
-            return True
-
-        for archive in self.archives:
-            req_filename = archive.get('filename')
-            req_group_id = archive.get('group_id')
-
-            if req_filename and not fnmatch.filter([build_archive['filename']],
-                                                   req_filename):
-                continue
+    def match_all(self, build_archives):
+        """
+        Select build archives matched by this request
 
-            if req_group_id and req_group_id != build_archive['group_id']:
-                continue
+        Each build archive is attributed to the first archive request
+        matching it.
 
-            archive['matched'] = True
-            return True
+        :param build_archives: list<dict>, archives of the Koji build
+        :return: list<dict>, matched archives, in the order of build_archives
+        """
+        if not self.archives:
+            return list(build_archives)
 
-        return False
+        index = ArchiveIndex(build_archives)
+        selected = set()
+        for archive in self.archives:
+            for position in index.find(archive.get('filename'), archive.get('group_id')):
+                if position not in selected:
+                    selected.add(position)
+                    archive['matched'] = True
 
-    def match_all(self, build_archives):
-        return filter(self.match, build_archives)
+        return [index.build_archives[position] for position in sorted(selected)]
 
     def unmatched(self):
         return [archive for archive in self.archives if not archive['matched']]
@@ -78,7 +130,12 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
     def __init__(self, tasker, workflow, koji_hub=None, koji_root=None,
                  koji_proxyuser=None, koji_ssl_certs_dir=None,
                  koji_krb_principal=None, koji_krb_keytab=None,
-                 allowed_domains=None):
+                 allowed_domains=None,
+                 download_workers=DEFAULT_DOWNLOAD_WORKERS,
+                 download_connections_per_host=DEFAULT_DOWNLOAD_CONNECTIONS_PER_HOST,
+                 download_retries=DEFAULT_DOWNLOAD_RETRIES,
+                 download_cache_dir=None,
+                 download_cache_max_size=DEFAULT_DOWNLOAD_CACHE_MAX_SIZE):
         """
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
@@ -90,6 +147,14 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
         :param koji_krb_keytab: str, Kerberos keytab
         :param allowed_domains: list<str>: list of domains that are
                allowed to be used when fetching artifacts by URL (case insensitive)
+        :param download_workers: int, number of artifacts downloaded in parallel
+        :param download_connections_per_host: int, max number of simultaneous
+               connections to a single host
+        :param download_retries: int, number of times an artifact download
+               interrupted by network errors is restarted
+        :param download_cache_dir: str, directory of node-local cache of artifacts,
+               keyed by their checksums; artifacts are not cached if not set
+        :param download_cache_max_size: int, size limit of the cache in bytes
         """
         super(FetchMavenArtifactsPlugin, self).__init__(tasker, workflow)
 
@@ -109,6 +174,13 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
         self.allowed_domains = set(domain.lower() for domain in all_allowed_domains or [])
         self.workdir = self.workflow.source.get_build_file_path()[1]
         self.session = None
+        self.cache = None
+        if download_cache_dir:
+            self.cache = DownloadCache(download_cache_dir, max_size=download_cache_max_size)
+        self.downloader = ParallelDownloader(workers=download_workers,
+                                             connections_per_host=download_connections_per_host,
+                                             retries=download_retries,
+                                             cache=self.cache)
 
     def read_nvr_requests(self):
         file_path = os.path.join(self.workdir, self.NVR_REQUESTS_FILENAME)
@@ -131,16 +203,22 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
         download_queue = []
         errors = []
 
-        for nvr_request in nvr_requests:
-            build_info = self.session.getBuild(nvr_request.nvr)
+        # Look up all builds, and then all their archives, in one request each
+        build_infos = koji_multicall(self.session, [
+            ('getBuild', (nvr_request.nvr,), {}) for nvr_request in nvr_requests
+        ])
+        archive_lists = iter(koji_multicall(self.session, [
+            ('listArchives', (), {'buildID': build_info['id'], 'type': 'maven'})
+            for build_info in build_infos if build_info
+        ]))
+
+        for nvr_request, build_info in zip(nvr_requests, build_infos):
             if not build_info:
                 errors.append('Build {} not found.'.format(nvr_request.nvr))
                 continue
 
             maven_build_path = self.path_info.mavenbuild(build_info)
-            build_archives = self.session.listArchives(buildID=build_info['id'],
-                                                       type='maven')
-            build_archives = nvr_request.match_all(build_archives)
+            build_archives = nvr_request.match_all(next(archive_lists))
 
             for build_archive in build_archives:
                 maven_file_path = self.path_info.mavenfile(build_archive)
@@ -193,33 +271,11 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
     def download_files(self, downloads):
         artifacts_path = os.path.join(self.workdir, self.DOWNLOAD_DIR)
 
-        self.log.debug('%d files to download', len(downloads))
-        session = util.get_retrying_requests_session()
-
-        for index, download in enumerate(downloads):
-            dest_path = os.path.join(artifacts_path, download.dest)
-            dest_dir = dest_path.rsplit('/', 1)[0]
-            if not os.path.exists(dest_dir):
-                os.makedirs(dest_dir)
-
-            self.log.debug('%d/%d downloading %s', index + 1, len(downloads),
-                           download.url)
-
-            checksums = {algo: hashlib.new(algo) for algo in download.checksums}
-            request = session.get(download.url, stream=True)
-            request.raise_for_status()
-
-            with open(dest_path, 'wb') as f:
-                for chunk in request.iter_content(chunk_size=DEFAULT_DOWNLOAD_BLOCK_SIZE):
-                    f.write(chunk)
-                    for checksum in checksums.values():
-                        checksum.update(chunk)
-
-            for algo, checksum in checksums.items():
-                if checksum.hexdigest() != download.checksums[algo]:
-                    raise ValueError(
-                        'Computed {} checksum, {}, does not match expected checksum, {}'
-                        .format(algo, checksum.hexdigest(), download.checksums[algo]))
+        self.downloader.download_all(
+            FileDownload(download.url, os.path.join(artifacts_path, download.dest),
+                         download.checksums)
+            for download in downloads
+        )
 
     def run(self):
         self.session = get_koji_session(self.workflow, self.koji_fallback)
@@ -233,4 +289,7 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
         self.download_files(download_queue)
 
         # TODO: Return a list of files for koji metadata
-        return download_queue
+        return {
+            'downloads': download_queue,
+            'cache': self.cache.get_stats() if self.cache else None,
+        }
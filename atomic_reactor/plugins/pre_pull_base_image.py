@@ -12,18 +12,26 @@ If this build is an auto-rebuild, use the base image from the image change
 trigger instead of what is in the Dockerfile.
 Tag each image to a unique name (the build name plus a nonce) to be used during
 this build so that it isn't removed by other builds doing clean-up.
+With a base image cache directory configured, parent images are resolved to
+digests and images already present on the node are reused without pulling.
 """
 
 from __future__ import unicode_literals
 
 import docker
 import platform
+import threading
+from multiprocessing.pool import ThreadPool
 
+from atomic_reactor.base_image_cache import BaseImageCache
+from atomic_reactor.constants import (DEFAULT_PARENT_PULL_WORKERS,
+                                      DEFAULT_BASE_IMAGE_CACHE_ENTRIES)
 from atomic_reactor.plugin import PreBuildPlugin
-from atomic_reactor.util import (get_build_json, get_manifest_list,
+from atomic_reactor.util import (get_build_json, get_manifest_list, get_manifest_digests,
                                  get_config_from_registry, ImageName,
                                  get_platforms)
 from atomic_reactor.core import RetryGeneratorException
+from atomic_reactor.plugins.exit_remove_built_image import defer_removal
 from atomic_reactor.plugins.pre_reactor_config import (get_source_registry,
                                                        get_platform_to_goarch_mapping,
                                                        get_goarch_to_platform_mapping,
@@ -37,7 +45,10 @@ class PullBaseImagePlugin(PreBuildPlugin):
     is_allowed_to_fail = False
 
     def __init__(self, tasker, workflow, parent_registry=None, parent_registry_insecure=False,
-                 check_platforms=False, inspect_only=False):
+                 check_platforms=False, inspect_only=False,
+                 parent_pull_workers=DEFAULT_PARENT_PULL_WORKERS,
+                 base_image_cache_dir=None,
+                 base_image_cache_entries=DEFAULT_BASE_IMAGE_CACHE_ENTRIES):
         """
         constructor
 
@@ -46,12 +57,27 @@ class PullBaseImagePlugin(PreBuildPlugin):
         :param parent_registry: registry to enforce pulling from
         :param parent_registry_insecure: allow connecting to the registry over plain http
         :param check_platforms: validate parent images provide all platforms expected for the build
+        :param inspect_only: bool, only resolve parent images, do not pull them
+        :param parent_pull_workers: int, max number of parent images processed concurrently
+        :param base_image_cache_dir: str, directory with node-local index of parent
+                                     images kept between builds
+        :param base_image_cache_entries: int, max number of parent images kept on the node
         """
         # call parent constructor
         super(PullBaseImagePlugin, self).__init__(tasker, workflow)
 
         self.check_platforms = check_platforms
         self.inspect_only = inspect_only
+        self.parent_pull_workers = parent_pull_workers
+        self._manifest_list_locks = {}
+        self._manifest_list_locks_lock = threading.Lock()
+        self.base_image_cache = None
+        if base_image_cache_dir:
+            self.base_image_cache = BaseImageCache(base_image_cache_dir,
+                                                   max_entries=base_image_cache_entries)
+        # digest references of parent images used by this build
+        self._cached_images = set()
+        self._cached_images_lock = threading.Lock()
         source_registry = get_source_registry(self.workflow, {
             'uri': RegistryURI(parent_registry) if parent_registry else None,
             'insecure': parent_registry_insecure})
@@ -72,6 +98,7 @@ class PullBaseImagePlugin(PreBuildPlugin):
         self.manifest_list_cache = {}
         organization = get_registries_organization(self.workflow)
 
+        parents = []
         for nonce, parent in enumerate(sorted(self.workflow.builder.parent_images.keys(),
                                               key=str)):
             image = parent
@@ -87,6 +114,10 @@ class PullBaseImagePlugin(PreBuildPlugin):
                 image.enclose(organization)
                 parent.enclose(organization)
 
+            parents.append((parent, image, is_base_image, str(nonce)))
+
+        def process_parent(args):
+            _, image, _, nonce = args
             if self.check_platforms:
                 self._validate_platforms_in_image(image)
 
@@ -95,9 +126,22 @@ class PullBaseImagePlugin(PreBuildPlugin):
                     image = new_arch_image
 
             if self.inspect_only:
-                new_image = image
-            else:
-                new_image = self._pull_and_tag_image(image, build_json, str(nonce))
+                return image
+            return self._pull_and_tag_image(image, build_json, nonce)
+
+        # each parent image is validated, pulled and tagged independently;
+        # results are applied in the original order afterwards
+        if len(parents) > 1 and self.parent_pull_workers > 1:
+            pool = ThreadPool(min(self.parent_pull_workers, len(parents)))
+            try:
+                new_images = pool.map(process_parent, parents)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            new_images = [process_parent(parent) for parent in parents]
+
+        for (parent, _, is_base_image, _), new_image in zip(parents, new_images):
             self.workflow.builder.recreate_parent_images()
             self.workflow.builder.parent_images[parent] = new_image
 
@@ -178,9 +222,19 @@ class PullBaseImagePlugin(PreBuildPlugin):
             # retry until pull and tag is successful or definitively fails.
             # should never require 20 retries but there's a race condition at work.
             # just in case something goes wildly wrong, limit to 20 so it terminates.
+            pinned_image = None
+            if self.base_image_cache:
+                pinned_image = self._pin_image_digest(image)
+
             try:
-                self.tasker.pull_image(image, insecure=self.parent_registry_insecure)
-                self.workflow.pulled_base_images.add(image.to_str())
+                if pinned_image and self.tasker.image_exists(pinned_image.to_str()):
+                    self.log.info("'%s' is already available as '%s', not pulling",
+                                  image, pinned_image)
+                elif pinned_image:
+                    self.tasker.pull_image(pinned_image, insecure=self.parent_registry_insecure)
+                else:
+                    self.tasker.pull_image(image, insecure=self.parent_registry_insecure)
+                    self.workflow.pulled_base_images.add(image.to_str())
             except RetryGeneratorException as exc:
                 # getting here means the pull itself failed. we may want to retry if the
                 # image being pulled lacks a namespace, like e.g. "rhel7". we cannot count
@@ -209,9 +263,11 @@ class PullBaseImagePlugin(PreBuildPlugin):
 
             try:
                 self.log.info("tagging pulled image")
-                response = self.tasker.tag_image(image, new_image)
+                response = self.tasker.tag_image(pinned_image or image, new_image)
                 self.workflow.pulled_base_images.add(response)
                 self.log.debug("image '%s' is available as '%s'", image, new_image)
+                if pinned_image:
+                    self._record_cached_image(pinned_image)
                 return new_image
             except docker.errors.NotFound:
                 # If we get here, some other build raced us to remove
@@ -224,8 +280,56 @@ class PullBaseImagePlugin(PreBuildPlugin):
         self.log.error("giving up trying to pull image")
         raise RuntimeError("too many attempts to pull and tag image")
 
+    def _pin_image_digest(self, image):
+        """
+        Resolve tag of image to digest of its manifest in the registry
+
+        :param image: ImageName, parent image
+        :return: ImageName referencing the image by digest, or None if it can't be resolved
+        """
+        if image.tag and image.tag.startswith('sha256:'):
+            return image.copy()
+        if not image.registry:
+            return None
+
+        try:
+            digests = get_manifest_digests(image, image.registry,
+                                           insecure=self.parent_registry_insecure,
+                                           versions=('v2', 'v2_list', 'oci', 'oci_index'))
+        except (HTTPError, RetryError, Timeout, RuntimeError) as exc:
+            self.log.warning("unable to resolve digest of '%s': %s", image, exc)
+            return None
+
+        if not digests.default or digests.default is True:
+            return None
+        return ImageName.parse('{}@{}'.format(image.to_str(tag=False), digests.default))
+
+    def _record_cached_image(self, image):
+        """
+        Mark the image as recently used in the node-local index, have images
+        evicted from the index removed when the build finishes
+        """
+        with self._cached_images_lock:
+            self._cached_images.add(image.to_str())
+            keep = set(self._cached_images)
+
+        evicted_images = self.base_image_cache.record(image.to_str(), keep=keep)
+        with self._cached_images_lock:
+            for evicted in evicted_images:
+                self.log.info("'%s' evicted from base image cache", evicted)
+                defer_removal(self.workflow, evicted, force=False)
+
     def _get_manifest_list(self, image):
-        """try to figure out manifest list"""
+        """try to figure out manifest list, once for each image"""
+        with self._manifest_list_locks_lock:
+            lock = self._manifest_list_locks.setdefault(str(image), threading.Lock())
+
+        # parents are processed concurrently; make sure the registry is asked
+        # for each manifest list only once
+        with lock:
+            return self._fetch_manifest_list(image)
+
+    def _fetch_manifest_list(self, image):
         if image in self.manifest_list_cache:
             return self.manifest_list_cache[image]
 
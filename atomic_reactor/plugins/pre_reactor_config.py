@@ -100,7 +100,8 @@ def get_pulp_session(workflow, logger, fallback):
                        pulp_secret_path=config['auth'].get('ssl_certs_dir'),
                        username=config['auth'].get('username'),
                        password=config['auth'].get('password'),
-                       dockpulp_loglevel=config.get('loglevel'))
+                       dockpulp_loglevel=config.get('loglevel'),
+                       workers=config.get('workers'))
 
 
 def get_odcs(workflow, fallback=NO_FALLBACK):
@@ -15,6 +15,7 @@ from collections import defaultdict
 from atomic_reactor.constants import (PLUGIN_KOJI_PARENT_KEY, PLUGIN_RESOLVE_COMPOSES_KEY,
                                       REPO_CONTENT_SETS_CONFIG, BASE_IMAGE_KOJI_BUILD)
 
+from atomic_reactor.odcs_util import ODCS_DATETIME_FORMAT, ODCSComposeIndex
 from atomic_reactor.plugin import PreBuildPlugin
 from atomic_reactor.plugins.build_orchestrate_build import override_build_kwarg
 from atomic_reactor.plugins.pre_check_and_set_rebuild import is_rebuild
@@ -23,7 +24,6 @@ from atomic_reactor.plugins.pre_reactor_config import (get_config,
                                                        get_koji_session, get_koji)
 from atomic_reactor.util import get_platforms
 
-ODCS_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 MINIMUM_TIME_TO_EXPIRE = timedelta(hours=2).total_seconds()
 # flag to let ODCS see hidden pulp repos
 UNPUBLISHED_REPOS = 'include_unpublished_pulp_repos'
@@ -51,6 +51,7 @@ class ResolveComposesPlugin(PreBuildPlugin):
                  signing_intent=None,
                  compose_ids=tuple(),
                  minimum_time_to_expire=MINIMUM_TIME_TO_EXPIRE,
+                 compose_index_path=None,
                  ):
         """
         :param tasker: DockerTasker instance
@@ -68,6 +69,8 @@ class ResolveComposesPlugin(PreBuildPlugin):
         :param compose_ids: use the given compose_ids instead of requesting a new one
         :param minimum_time_to_expire: int, used in deciding when to extend compose's time
                                        to expire in seconds
+        :param compose_index_path: str, path to a node-local index of previously requested
+                                   composes; identical requests reuse composes found there
         """
         super(ResolveComposesPlugin, self).__init__(tasker, workflow)
 
@@ -97,12 +100,16 @@ class ResolveComposesPlugin(PreBuildPlugin):
                 raise ValueError('koji_hub is required when koji_target is used')
 
         self.minimum_time_to_expire = minimum_time_to_expire
+        self.compose_index = None
+        if compose_index_path:
+            self.compose_index = ODCSComposeIndex(compose_index_path)
 
         self._koji_session = None
         self._odcs_client = None
         self.odcs_config = None
         self.compose_config = None
         self.composes_info = None
+        self.compose_requests = None
         self._parent_signing_intent = None
 
     def run(self):
@@ -112,6 +119,7 @@ class ResolveComposesPlugin(PreBuildPlugin):
             self.adjust_compose_config()
             self.request_compose_if_needed()
             self.wait_for_composes()
+            self.update_compose_index()
             self.resolve_signing_intent()
             self.forward_composes()
             return self.make_result()
@@ -208,25 +216,48 @@ class ResolveComposesPlugin(PreBuildPlugin):
         self.compose_config.validate_for_request()
 
         self.compose_ids = []
-        for compose_request in self.compose_config.render_requests():
-            compose_info = self.odcs_client.start_compose(**compose_request)
-            self.compose_ids.append(compose_info['id'])
+        self.compose_requests = self.compose_config.render_requests()
+        for compose_request in self.compose_requests:
+            compose_id = None
+            if self.compose_index:
+                compose_id = self.compose_index.lookup(compose_request)
+
+            if compose_id is None:
+                compose_info = self.odcs_client.start_compose(**compose_request)
+                compose_id = compose_info['id']
+            else:
+                self.log.info('Reusing ODCS compose %s for request %s',
+                              compose_id, compose_request)
+
+            self.compose_ids.append(compose_id)
 
     def wait_for_composes(self):
         self.log.debug('Waiting for ODCS composes to be available: %s', self.compose_ids)
-        self.composes_info = []
-        for compose_id in self.compose_ids:
-            compose_info = self.odcs_client.wait_for_compose(compose_id)
+        self.composes_info = self.odcs_client.wait_for_composes(self.compose_ids)
 
+        renewed = {}
+        for index, compose_info in enumerate(self.composes_info):
             if self._needs_renewal(compose_info):
-                compose_info = self.odcs_client.renew_compose(compose_id)
-                compose_id = compose_info['id']
-                compose_info = self.odcs_client.wait_for_compose(compose_id)
+                compose_info = self.odcs_client.renew_compose(compose_info['id'])
+                renewed[index] = compose_info['id']
 
-            self.composes_info.append(compose_info)
+        if renewed:
+            renewed_ids = [renewed[index] for index in sorted(renewed)]
+            self.log.debug('Waiting for renewed ODCS composes to be available: %s',
+                           renewed_ids)
+            renewed_info = self.odcs_client.wait_for_composes(renewed_ids)
+            for index, compose_info in zip(sorted(renewed), renewed_info):
+                self.composes_info[index] = compose_info
 
         self.compose_ids = [item['id'] for item in self.composes_info]
 
+    def update_compose_index(self):
+        if not self.compose_index or not self.compose_requests:
+            return
+
+        for compose_request, compose_info in zip(self.compose_requests, self.composes_info):
+            self.compose_index.record(compose_request, compose_info)
+
     def _needs_renewal(self, compose_info):
         if compose_info['state_name'] == 'removed':
             return True
@@ -14,13 +14,14 @@ import re
 import time
 import warnings
 from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 
 try:
     import dockpulp
 except (ImportError, SyntaxError):
     dockpulp = None
 
-from atomic_reactor.constants import (LOCKEDPULPREPOSITORY_RETRIES,
+from atomic_reactor.constants import (DEFAULT_PULP_WORKERS, LOCKEDPULPREPOSITORY_RETRIES,
                                       LOCKEDPULPREPOSITORY_BACKOFF)
 
 
@@ -48,13 +49,54 @@ class PulpLogWrapper(object):
 PulpLog = PulpLogWrapper()
 
 
+class PulpExecutor(object):
+    """
+    Runner of Pulp operations on several repositories at the same time
+
+    Usage:
+
+    executor = PulpExecutor(max_workers=4)
+    executor.map(lambda repo_id: pulp.syncRepo(repo=repo_id), repo_ids)
+    """
+
+    def __init__(self, max_workers=None):
+        """
+        :param max_workers: int, max number of operations running at the same
+                            time, DEFAULT_PULP_WORKERS if not set
+        """
+        self.max_workers = max_workers or DEFAULT_PULP_WORKERS
+
+    def map(self, func, items):
+        """
+        Call func for each item, in at most max_workers threads
+
+        A single operation runs in the calling thread. When an operation
+        raises an exception, it is raised once all started operations finish.
+
+        :param func: callable taking one item
+        :param items: iterable of items
+        :return: list, results of func in the order of items
+        """
+        items = list(items)
+        workers = min(self.max_workers, len(items))
+        if workers <= 1:
+            return [func(item) for item in items]
+
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.terminate()
+            pool.join()
+
+
 class PulpHandler(object):
     CER = 'pulp.cer'
     KEY = 'pulp.key'
 
     def __init__(self, workflow, pulp_instance, log,
                  pulp_secret_path=None,
-                 username=None, password=None, dockpulp_loglevel=None):
+                 username=None, password=None, dockpulp_loglevel=None, workers=None):
         self.workflow = workflow
         self.pulp_instance = pulp_instance
         self.pulp_secret_path = pulp_secret_path
@@ -63,6 +105,7 @@ class PulpHandler(object):
         self.username = username
         self.password = password
         self.p = None
+        self.executor = PulpExecutor(workers)
         logger = PulpLog.get_pulp_logger()
 
         if dockpulp_loglevel is not None:
@@ -129,20 +172,17 @@ class PulpHandler(object):
 
         missing_repos = set(repos) - set(found_repo_ids)
         self.log.info("Missing repos: %s" % ", ".join(missing_repos))
-        for repo in missing_repos:
-            self.p.createRepo(repo, None,
-                              registry_id=pulp_repos[repo].registry_id,
-                              prefix_with=repo_prefix)
+        self.executor.map(lambda repo: self.p.createRepo(repo, None,
+                                                         registry_id=pulp_repos[repo].registry_id,
+                                                         prefix_with=repo_prefix),
+                          sorted(missing_repos))
 
+        auto_published = []
         for repo in found_repos:
-            do_update = False
-            if 'distributors' in repo:
-                for d in repo["distributors"]:
-                    if d["auto_publish"]:
-                        do_update = True
-                        break
-            if do_update:
-                self.p.updateRepo(repo["id"], {'auto_publish': False})
+            if any(d["auto_publish"] for d in repo.get("distributors", [])):
+                auto_published.append(repo["id"])
+        self.executor.map(lambda repo_id: self.p.updateRepo(repo_id, {'auto_publish': False}),
+                          auto_published)
 
     def get_tar_metadata(self, tarfile):
         metadata = dockpulp.imgutils.get_metadata(tarfile)
@@ -220,7 +260,9 @@ class PulpHandler(object):
         # dockpulp will call publish for every repository if len(keys) == 0
         # so check to make sure keys has values
         assert keys
-        task_ids = self.p.crane(keys, wait=True)
+        # all tasks are started first, then watched together, so publishing
+        # takes as long as the slowest task
+        task_ids = self.p.crane(keys, wait=False)
         self.log.info("waiting for repos to be published to crane, tasks: %s",
                       ", ".join(map(str, task_ids)))
         self.p.watch_tasks(task_ids)
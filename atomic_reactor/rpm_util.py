@@ -6,6 +6,25 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tarfile
+from operator import itemgetter
+
+
+logger = logging.getLogger(__name__)
+
+# locations of rpm database inside image, relative to its root;
+# newer distributions keep it in /usr/lib/sysimage/rpm and make
+# /var/lib/rpm a symlink to it
+RPMDB_PATHS = ('usr/lib/sysimage/rpm', 'var/lib/rpm')
+
+WHITEOUT_PREFIX = '.wh.'
+WHITEOUT_OPAQUE = WHITEOUT_PREFIX + '.wh..opq'
+
 image_component_rpm_tags = [
     'NAME',
     'VERSION',
@@ -26,11 +45,168 @@ def rpm_qf_args(tags=None, separator=';'):
     by parse_rpm_output.
     """
 
+    return r"-qa --qf '{0}\n'".format(rpm_qf_format(tags, separator))
+
+
+def rpm_qf_format(tags=None, separator=';'):
+    """
+    Return the rpm query format (without trailing newline) matching
+    the output expected by parse_rpm_output.
+    """
+
     if tags is None:
         tags = image_component_rpm_tags
 
-    fmt = separator.join(["%%{%s}" % tag for tag in tags])
-    return r"-qa --qf '{0}\n'".format(fmt)
+    return separator.join(["%%{%s}" % tag for tag in tags])
+
+
+class RPMComponent(object):
+    """
+    Compact record of an installed RPM
+
+    Thousands of these are kept per image, so they carry no per-instance
+    dict; use to_dict() to get the structure used in build metadata.
+    """
+
+    __slots__ = ('name', 'version', 'release', 'arch', 'epoch', 'sigmd5', 'signature')
+
+    def __init__(self, name, version, release, arch, epoch, sigmd5, signature):
+        self.name = name
+        self.version = version
+        self.release = release
+        self.arch = arch
+        self.epoch = epoch
+        self.sigmd5 = sigmd5
+        self.signature = signature
+
+    def to_dict(self):
+        """
+        :return: dict, component as expected in Koji metadata
+        """
+        return {
+            'type': 'rpm',
+            'name': self.name,
+            'version': self.version,
+            'release': self.release,
+            'arch': self.arch,
+            'sigmd5': self.sigmd5,
+            'signature': self.signature,
+            'epoch': self.epoch,
+        }
+
+    def _key(self):
+        return (self.name, self.version, self.release, self.arch, self.epoch,
+                self.sigmd5, self.signature)
+
+    def __eq__(self, other):
+        if not isinstance(other, RPMComponent):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return 'RPMComponent({})'.format(', '.join('{}={!r}'.format(slot, getattr(self, slot))
+                                                   for slot in self.__slots__))
+
+
+class RPMOutputParser(object):
+    """
+    Parser of rpm query output
+
+    Positions of the fields are computed once for the query tags,
+    so each line is split and picked apart with a single lookup.
+    """
+
+    # fields of RPMComponent, in the order of its constructor arguments
+    FIELD_TAGS = ('NAME', 'VERSION', 'RELEASE', 'ARCH', 'EPOCH', 'SIGMD5',
+                  'SIGPGP:pgpsig', 'SIGGPG:pgpsig')
+    NONE = '(none)'
+    SIGMARKER = 'Key ID '
+
+    def __init__(self, tags=None, separator=';'):
+        """
+        :param tags: list, str fields used for query output
+        :param separator: str, separator of fields
+        """
+        if tags is None:
+            tags = image_component_rpm_tags
+
+        positions = {}
+        for position, tag in enumerate(tags):
+            positions.setdefault(tag, position)
+
+        self.separator = separator
+        self.min_fields = len(tags)
+        # tags missing from the query point to the last field,
+        # which is a (none) value appended to every line
+        self._get_fields = itemgetter(*[positions.get(tag, -1) for tag in self.FIELD_TAGS])
+
+    def parse_values(self, output):
+        """
+        :param output: iterable of str, lines of rpm output
+        :return: generator of tuples of RPMComponent fields, excluding gpg-pubkey
+        """
+        none = self.NONE
+        separator = self.separator
+        min_fields = self.min_fields
+        get_fields = self._get_fields
+        sigmarker = self.SIGMARKER
+        for line in output:
+            fields = line.rstrip('\n').split(separator)
+            if len(fields) < min_fields:
+                continue
+
+            fields.append(none)
+            (name, version, release, arch, epoch, sigmd5,
+             sigpgp, siggpg) = get_fields(fields)
+            if name == 'gpg-pubkey':
+                continue
+
+            signature = sigpgp if sigpgp != none and sigpgp else siggpg
+            if signature == none:
+                signature = None
+            elif signature:
+                parts = signature.split(sigmarker, 1)
+                if len(parts) > 1:
+                    signature = parts[1]
+
+            # epoch must be an integer or None
+            epoch = None if epoch == none else int(epoch)
+
+            yield (None if name == none else name,
+                   None if version == none else version,
+                   None if release == none else release,
+                   None if arch == none else arch,
+                   epoch,
+                   None if sigmd5 == none else sigmd5,
+                   signature)
+
+    def parse(self, output):
+        """
+        :param output: iterable of str, lines of rpm output
+        :return: generator of RPMComponent, excluding gpg-pubkey
+        """
+        for values in self.parse_values(output):
+            yield RPMComponent(*values)
+
+
+def parse_rpm_records(output, tags=None, separator=';'):
+    """
+    Parse output of the rpm query into compact records.
+
+    :param output: list, decoded output (str) from the rpm subprocess
+    :param tags: list, str fields used for query output
+    :return: list, RPMComponent describing each rpm package
+    """
+    return list(RPMOutputParser(tags, separator).parse(output))
 
 
 def parse_rpm_output(output, tags=None, separator=';'):
@@ -41,55 +217,184 @@ def parse_rpm_output(output, tags=None, separator=';'):
     :param tags: list, str fields used for query output
     :return: list, dicts describing each rpm package
     """
+    # build dicts directly, going through RPMComponent is slower
+    return [{
+        'type': 'rpm',
+        'name': name,
+        'version': version,
+        'release': release,
+        'arch': arch,
+        'sigmd5': sigmd5,
+        'signature': signature,
+        'epoch': epoch,
+    } for (name, version, release, arch, epoch, sigmd5, signature)
+        in RPMOutputParser(tags, separator).parse_values(output)]
 
-    if tags is None:
-        tags = image_component_rpm_tags
 
-    def field(tag):
-        """
-        Get a field value by name
-        """
-        try:
-            value = fields[tags.index(tag)]
-        except ValueError:
-            return None
+def rpm_components_to_dicts(components):
+    """
+    Convert image components to the structure used in build metadata.
 
-        if value == '(none)':
-            return None
+    :param components: list, RPMComponent or dicts as returned by parse_rpm_output
+    :return: list, dicts describing each rpm package
+    """
+    return [component.to_dict() if isinstance(component, RPMComponent) else component
+            for component in components]
 
-        return value
 
-    components = []
-    sigmarker = 'Key ID '
-    for rpm in output:
-        fields = rpm.rstrip('\n').split(separator)
-        if len(fields) < len(tags):
-            continue
+def _relates_to_rpmdb(path):
+    """
+    Whether changing path in a layer may affect the rpm database
+    """
+    for rpmdb_path in RPMDB_PATHS:
+        if path == rpmdb_path or \
+                path.startswith(rpmdb_path + '/') or \
+                rpmdb_path.startswith(path + '/'):
+            return True
 
-        signature = field('SIGPGP:pgpsig') or field('SIGGPG:pgpsig')
-        if signature:
-            parts = signature.split(sigmarker, 1)
-            if len(parts) > 1:
-                signature = parts[1]
+    return False
+
+
+def _extract_layer_rpmdb(layer, dest):
+    """
+    Extract rpm database files from a single layer archive
+
+    :param layer: file-like object, layer tar archive (may be compressed)
+    :param dest: str, directory to extract files to
+    :return: list of str, paths removed by the layer from layers below
+    """
+    removed = []
+    with tarfile.open(fileobj=layer, mode='r|*') as tar:
+        for member in tar:
+            path = os.path.normpath(member.name.lstrip('/'))
+            if path.startswith('..'):
+                continue
+
+            dirname, basename = os.path.split(path)
+            if basename == WHITEOUT_OPAQUE:
+                path = dirname
+            elif basename.startswith(WHITEOUT_PREFIX):
+                path = os.path.join(dirname, basename[len(WHITEOUT_PREFIX):])
+            elif member.isfile() and _relates_to_rpmdb(path):
+                target = os.path.join(dest, path)
+                if not os.path.isdir(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+                with open(target, 'wb') as f:
+                    shutil.copyfileobj(tar.extractfile(member), f)
+                continue
+            else:
+                continue
+
+            if _relates_to_rpmdb(path):
+                removed.append(path)
+
+    return removed
 
-        component_rpm = {
-            'type': 'rpm',
-            'name': field('NAME'),
-            'version': field('VERSION'),
-            'release': field('RELEASE'),
-            'arch': field('ARCH'),
-            'sigmd5': field('SIGMD5'),
-            'signature': signature,
-        }
 
-        # Special handling for epoch as it must be an integer or None
-        epoch = field('EPOCH')
-        if epoch is not None:
-            epoch = int(epoch)
+def _apply_layer(root, layer_dir, removed):
+    for path in removed:
+        target = os.path.join(root, path)
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        elif os.path.exists(target):
+            os.unlink(target)
 
-        component_rpm['epoch'] = epoch
+    for dirpath, _, filenames in os.walk(layer_dir):
+        for filename in filenames:
+            source = os.path.join(dirpath, filename)
+            target = os.path.join(root, os.path.relpath(source, layer_dir))
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            os.rename(source, target)
 
-        if component_rpm['name'] != 'gpg-pubkey':
-            components.append(component_rpm)
 
-    return components
+def find_rpmdb(root):
+    """
+    Find rpm database in a filesystem tree
+
+    :param root: str, path to root of the image filesystem
+    :return: str, path to rpm database directory, or None if not found
+    """
+    for rpmdb_path in RPMDB_PATHS:
+        dbpath = os.path.join(root, rpmdb_path)
+        if os.path.isdir(dbpath) and os.listdir(dbpath):
+            return dbpath
+
+    return None
+
+
+def extract_rpmdb(image_stream, dest):
+    """
+    Extract rpm database from 'docker save' archive without creating a container
+
+    The archive is read sequentially, so it may come directly from the docker
+    daemon. Only rpm database files are extracted from each layer; layers are
+    then applied in the order listed in manifest.json, including whiteouts.
+
+    :param image_stream: file-like object, image archive as produced by 'docker save'
+    :param dest: str, empty directory to extract to
+    :return: str, path to rpm database directory, or None if image has none
+    """
+    layers = {}
+    # identical layers may be stored just once and linked from elsewhere
+    links = {}
+    manifest = None
+    with tarfile.open(fileobj=image_stream, mode='r|*') as image:
+        for member in image:
+            if member.issym():
+                links[member.name] = os.path.normpath(
+                    os.path.join(os.path.dirname(member.name), member.linkname))
+                continue
+
+            if not member.isfile():
+                continue
+
+            if member.name == 'manifest.json':
+                manifest = json.loads(image.extractfile(member).read().decode('utf-8'))
+                continue
+
+            if member.name.endswith('.json') or member.name == 'repositories':
+                continue
+
+            layer_dir = os.path.join(dest, 'layers', str(len(layers)))
+            try:
+                removed = _extract_layer_rpmdb(image.extractfile(member), layer_dir)
+            except tarfile.ReadError:
+                # not a layer
+                continue
+
+            layers[member.name] = (layer_dir, removed)
+
+    if not manifest:
+        raise ValueError('manifest.json not found in image archive')
+
+    root = os.path.join(dest, 'root')
+    os.makedirs(root)
+    for name in manifest[0]['Layers']:
+        try:
+            layer_dir, removed = layers[links.get(name, name)]
+        except KeyError:
+            raise ValueError('layer {} not found in image archive'.format(name))
+        logger.debug('applying rpm database changes from layer %s', name)
+        _apply_layer(root, layer_dir, removed)
+
+    shutil.rmtree(os.path.join(dest, 'layers'), ignore_errors=True)
+    return find_rpmdb(root)
+
+
+def query_rpmdb(dbpath, tags=None, separator=';'):
+    """
+    List RPMs in rpm database using rpm on the host
+
+    :param dbpath: str, path to rpm database directory
+    :param tags: list, str fields used for query output
+    :param separator: str, separator of fields
+    :return: list, str lines of rpm output, as expected by parse_rpm_output
+    """
+    cmd = ['rpm', '--dbpath', os.path.abspath(dbpath),
+           '-qa', '--qf', rpm_qf_format(tags, separator) + '\n']
+    logger.debug('running %s', cmd)
+    output = subprocess.check_output(cmd)
+    if isinstance(output, bytes):
+        output = output.decode('utf-8')
+    return [line for line in output.splitlines() if line]
@@ -11,6 +11,7 @@ Code for getting source code to put inside container.
 
 import logging
 import copy
+import fnmatch
 import os
 import shutil
 import tempfile
@@ -114,7 +115,11 @@ class GitSource(Source):
         super(GitSource, self).__init__(provider, uri, dockerfile_path,
                                         provider_params, tmpdir)
         self.git_commit = self.provider_params.get('git_commit', None)
-        self.lg = util.LazyGit(self.uri, self.git_commit, self.source_path)
+        git_depth = self.provider_params.get('git_depth', None)
+        self.git_depth = int(git_depth) if git_depth else None
+        self.git_cache_dir = self.provider_params.get('git_cache_dir', None)
+        self.lg = util.LazyGit(self.uri, self.git_commit, self.source_path,
+                               depth=self.git_depth, cache_dir=self.git_cache_dir)
 
     @property
     def commit_id(self):
@@ -135,9 +140,20 @@ class GitSource(Source):
 
 
 class PathSource(Source):
+    # Files which plugins may rewrite in place. They must not be hard links to
+    # the original source, so they are always reflinked or copied.
+    MUTABLE_FILES = ('Dockerfile*', '*.md', '*.repo', '*.yaml', '*.yml')
+
     def __init__(self, provider, uri, dockerfile_path=None, provider_params=None, tmpdir=None):
         super(PathSource, self).__init__(provider, uri, dockerfile_path,
                                          provider_params, tmpdir)
+        # Files are reflinked or copied. Hard links are cheaper where
+        # reflinks aren't supported, but anything modifying a linked file
+        # in place modifies the original source, so they are opt-in.
+        hardlink = self.provider_params.get('hardlink', False)
+        if not isinstance(hardlink, bool):
+            hardlink = str(hardlink).lower() in ('1', 'true', 'yes')
+        self.hardlink = hardlink
         # make sure we have canonical URI representation even if we got path without "file://"
         if not self.uri.startswith('file://'):
             self.uri = 'file://' + self.uri
@@ -147,6 +163,7 @@ class PathSource(Source):
     def get(self):
         # work around the weird behaviour of copytree, which requires the top dir
         #  to *not* exist
+        methods = collections.Counter()
         for f in os.listdir(self.schemeless_path):
             old = os.path.join(self.schemeless_path, f)
             new = os.path.join(self.source_path, f)
@@ -155,11 +172,35 @@ class PathSource(Source):
                 break
             else:
                 if os.path.isdir(old):
-                    shutil.copytree(old, new)
+                    self._clone_tree(old, new, methods)
                 else:
-                    shutil.copy2(old, new)
+                    methods[self._clone_file(old, new)] += 1
+
+        if methods:
+            logger.debug("source files materialized: %s",
+                         ', '.join('{} {}'.format(count, method)
+                                   for method, count in sorted(methods.items())))
         return self.source_path
 
+    def _clone_tree(self, src, dest, methods):
+        # same as shutil.copytree, with files cloned as cheaply as possible
+        os.makedirs(dest)
+        for name in os.listdir(src):
+            src_name = os.path.join(src, name)
+            dest_name = os.path.join(dest, name)
+            if os.path.isdir(src_name):
+                self._clone_tree(src_name, dest_name, methods)
+            else:
+                methods[self._clone_file(src_name, dest_name)] += 1
+        shutil.copystat(src, dest)
+
+    def _clone_file(self, src, dest):
+        hardlink = self.hardlink
+        if hardlink:
+            name = os.path.basename(src)
+            hardlink = not any(fnmatch.fnmatch(name, pattern) for pattern in self.MUTABLE_FILES)
+        return util.clone_file(src, dest, hardlink=hardlink)
+
 
 def get_source_instance_for(source, tmpdir=None):
     validate_source_dict_schema(source)
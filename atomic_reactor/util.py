@@ -8,7 +8,9 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import print_function, unicode_literals
 
+import fcntl
 import hashlib
+import io
 from itertools import chain
 import json
 import jsonschema
@@ -17,7 +19,7 @@ import re
 from pipes import quote
 import requests
 from requests.exceptions import ConnectionError, SSLError, HTTPError, RetryError, Timeout
-from requests.adapters import HTTPAdapter
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
 from requests.packages.urllib3.util import Retry
 import shutil
 import subprocess
@@ -29,6 +31,7 @@ import codecs
 import string
 import time
 from collections import namedtuple
+from contextlib import contextmanager
 from copy import deepcopy
 
 from six.moves.urllib.parse import urlparse
@@ -50,6 +53,7 @@ from atomic_reactor.constants import (DOCKERFILE_FILENAME, REPO_CONTAINER_CONFIG
 from atomic_reactor.auth import HTTPRegistryAuth
 
 from dockerfile_parse import DockerfileParser
+from dockerfile_parse.util import b2u
 from pkg_resources import resource_stream
 
 from importlib import import_module
@@ -275,7 +279,8 @@ def wait_for_command(logs_generator):
     return cr
 
 
-def clone_git_repo(git_url, target_dir, commit=None, retry_times=GIT_MAX_RETRIES):
+def clone_git_repo(git_url, target_dir, commit=None, retry_times=GIT_MAX_RETRIES,
+                   depth=None, cache_dir=None):
     """
     clone provided git repo to target_dir, optionally checkout provided commit
 
@@ -283,23 +288,103 @@ def clone_git_repo(git_url, target_dir, commit=None, retry_times=GIT_MAX_RETRIES
     :param target_dir: str, filesystem path where the repo should be cloned
     :param commit: str, commit to checkout, SHA-1 or ref
     :param retry_times: int, number of retries for git clone
+    :param depth: int, truncate history of the clone to this many commits;
+                  ignored when cloning with cache_dir
+    :param cache_dir: str, directory with local mirrors of git repos; the mirror
+                      of git_url is created or updated there and used as a
+                      reference for the clone
     :return: str, commit ID of HEAD
     """
-    retry_delay = GIT_BACKOFF_FACTOR
-
     commit = commit or "master"
     logger.info("cloning git repo '%s'", git_url)
     logger.debug("url = '%s', dir = '%s', commit = '%s'",
                  git_url, target_dir, commit)
 
-    cmd = ["git", "clone", git_url, quote(target_dir)]
+    cmd = ["git", "clone"]
+    mirror = None
+    if cache_dir:
+        try:
+            mirror = update_git_mirror(git_url, cache_dir, retry_times=retry_times)
+        except subprocess.CalledProcessError as exc:
+            logger.warning("failed to update mirror of '%s', cloning without it:\n '%s'",
+                           git_url, exc.output)
+
+    if mirror:
+        # objects are copied from the mirror, only missing ones are fetched
+        cmd += ["--reference", mirror, "--dissociate"]
+    elif depth:
+        # all branches, so that their heads can be checked out later
+        cmd += ["--depth", str(depth), "--no-single-branch"]
+    cmd += [git_url, quote(target_dir)]
 
     logger.debug("cloning '%s'", cmd)
+    _run_git_with_retries(cmd, retry_times)
+
+    if depth and not mirror and not _git_commit_exists(target_dir, commit):
+        logger.debug("commit '%s' not in shallow clone, fetching it", commit)
+        try:
+            _run_git_with_retries(["git", "fetch", "--depth", str(depth), "origin", commit],
+                                  retry_times, cwd=target_dir)
+            commit = "FETCH_HEAD"
+        except subprocess.CalledProcessError:
+            # servers may refuse to serve commits not at the head of a ref
+            logger.info("fetching commit failed, fetching full history")
+            _run_git_with_retries(["git", "fetch", "--unshallow", "origin"],
+                                  retry_times, cwd=target_dir)
+
+    return reset_git_repo(target_dir, commit)
+
+
+def update_git_mirror(git_url, cache_dir, retry_times=GIT_MAX_RETRIES):
+    """
+    create or update local bare mirror of git repo in cache_dir
+
+    Concurrent updates of the same mirror are serialized by a file lock.
+
+    :param git_url: str, git repo to mirror
+    :param cache_dir: str, directory with mirrors of git repos
+    :param retry_times: int, number of retries for git commands
+    :return: str, filesystem path to the mirror
+    """
+    name = hashlib.sha256(git_url.encode('utf-8')).hexdigest()
+    mirror = os.path.join(cache_dir, name + '.git')
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+
+    with open(mirror + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.path.isdir(mirror):
+                logger.debug("updating mirror '%s' of '%s'", mirror, git_url)
+                _run_git_with_retries(["git", "fetch", "--prune", "origin"],
+                                      retry_times, cwd=mirror)
+            else:
+                logger.debug("creating mirror '%s' of '%s'", mirror, git_url)
+                tmp_mirror = tempfile.mkdtemp(dir=cache_dir, prefix='.' + name)
+                try:
+                    _run_git_with_retries(["git", "clone", "--mirror", git_url, tmp_mirror],
+                                          retry_times)
+                    os.rename(tmp_mirror, mirror)
+                except Exception:
+                    shutil.rmtree(tmp_mirror, ignore_errors=True)
+                    raise
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    return mirror
+
+
+def _run_git_with_retries(cmd, retry_times, cwd=None):
+    retry_delay = GIT_BACKOFF_FACTOR
     for counter in range(retry_times + 1):
         try:
             # we are using check_output, even though we aren't using
             # the return value, but we will get 'output' in exception
-            subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+            subprocess.check_output(cmd, stderr=subprocess.STDOUT, cwd=cwd)
             break
         except subprocess.CalledProcessError as exc:
             if counter != retry_times:
@@ -308,7 +393,11 @@ def clone_git_repo(git_url, target_dir, commit=None, retry_times=GIT_MAX_RETRIES
             else:
                 raise
 
-    return reset_git_repo(target_dir, commit)
+
+def _git_commit_exists(target_dir, git_reference):
+    cmd = ["git", "rev-parse", "--verify", "--quiet", git_reference + "^{commit}"]
+    with open(os.devnull, 'w') as devnull:
+        return subprocess.call(cmd, cwd=target_dir, stdout=devnull, stderr=devnull) == 0
 
 
 def reset_git_repo(target_dir, git_reference):
@@ -343,10 +432,14 @@ class LazyGit(object):
         lazy_git = LazyGit(git_url="...", tmpdir=tmp_dir)
         lazy_git.git_path
     """
-    def __init__(self, git_url, commit=None, tmpdir=None):
+    def __init__(self, git_url, commit=None, tmpdir=None, depth=None, cache_dir=None):
         self.git_url = git_url
         # provided commit ID/reference to check out
         self.commit = commit
+        # history depth of shallow clone and directory with git repo mirrors,
+        # see clone_git_repo
+        self.depth = depth
+        self.cache_dir = cache_dir
         # commit ID of HEAD; we'll figure this out ourselves
         self._commit_id = None
         self.provided_tmpdir = tmpdir
@@ -363,7 +456,8 @@ class LazyGit(object):
     @property
     def git_path(self):
         if self._git_path is None:
-            self._commit_id = clone_git_repo(self.git_url, self._tmpdir, self.commit)
+            self._commit_id = clone_git_repo(self.git_url, self._tmpdir, self.commit,
+                                             depth=self.depth, cache_dir=self.cache_dir)
             self._git_path = self._tmpdir
         return self._git_path
 
@@ -527,6 +621,43 @@ def get_checksums(path, algorithms):
     return checksums
 
 
+# ioctl request number for cloning a file (reflink) on copy-on-write file systems
+FICLONE = 0x40049409
+
+
+def clone_file(src, dest, hardlink=True):
+    """
+    Create dest with the same content as src, as cheaply as possible.
+
+    A copy-on-write clone (reflink) is tried first, then a hard link, if
+    allowed, and finally a regular copy.
+
+    :param src: str, path to existing file
+    :param dest: str, path of the new file, must not exist
+    :param hardlink: bool, whether dest may share the inode with src
+    :return: str, method used: 'reflink', 'hardlink' or 'copy'
+    """
+    try:
+        with open(src, 'rb') as src_file, open(dest, 'wb') as dest_file:
+            fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+    except (IOError, OSError):
+        if os.path.exists(dest):
+            os.unlink(dest)
+    else:
+        shutil.copystat(src, dest)
+        return 'reflink'
+
+    if hardlink:
+        try:
+            os.link(src, dest)
+            return 'hardlink'
+        except OSError:
+            pass
+
+    shutil.copy2(src, dest)
+    return 'copy'
+
+
 def get_docker_architecture(tasker):
     docker_version = tasker.get_version()
     host_arch = docker_version['Arch']
@@ -1160,11 +1291,86 @@ def get_config_from_registry(image, registry, digest, insecure=False,
     return blob_config
 
 
+class CachingDockerfileParser(DockerfileParser):
+    """
+    DockerfileParser which keeps Dockerfile content and its parsed structure
+    in memory
+
+    Changes made through the parser are written to the Dockerfile right away,
+    so the file on disk is always up to date. The content is parsed only once
+    for each version of the Dockerfile; call refresh() to pick up changes made
+    to the file other than through this parser.
+    """
+
+    def __init__(self, path, **kwargs):
+        super(CachingDockerfileParser, self).__init__(path, cache_content=True, **kwargs)
+        # incremented whenever the content changes
+        self.version = 0
+        self._structure = None
+        self._structure_version = None
+        self._structure_env = None
+
+    def refresh(self):
+        """
+        drop cached content if the Dockerfile was changed by other means
+
+        The file is read and compared with the cached content, which is
+        cheap next to parsing it and also catches edits that leave its
+        size and mtime unchanged.
+
+        :return: bool, whether the Dockerfile was changed
+        """
+        try:
+            with self._open_dockerfile('rb') as dockerfile:
+                content = b2u(dockerfile.read())
+        except (IOError, OSError):
+            content = ''
+
+        if content == self.cached_content:
+            return False
+
+        logger.debug("%s changed on disk, reloading", self.dockerfile_path)
+        self.cached_content = content
+        self.version += 1
+        return True
+
+    @property
+    def lines(self):
+        return DockerfileParser.lines.fget(self)
+
+    @lines.setter
+    def lines(self, lines):
+        DockerfileParser.lines.fset(self, lines)
+        self.version += 1
+
+    @property
+    def content(self):
+        return DockerfileParser.content.fget(self)
+
+    @content.setter
+    def content(self, content):
+        DockerfileParser.content.fset(self, content)
+        self.version += 1
+
+    @property
+    def structure(self):
+        # ENV substitution depends on the inherited parent ENV as well
+        if self._structure_version != self.version or self._structure_env != self.parent_env:
+            self._structure = DockerfileParser.structure.fget(self)
+            self._structure_version = self.version
+            self._structure_env = dict(self.parent_env)
+        # callers may modify the returned instructions
+        return [dict(instruction) for instruction in self._structure]
+
+
 def df_parser(df_path, workflow=None, cache_content=False, env_replace=True, parent_env=None):
     """
     Wrapper for dockerfile_parse's DockerfileParser that takes into account
     parent_env inheritance.
 
+    When workflow is provided, the parser is shared by everything in the
+    workflow that parses the same Dockerfile, see CachingDockerfileParser.
+
     :param df_path: string, path to Dockerfile (normally in DockerBuildWorkflow instance)
     :param workflow: DockerBuildWorkflow object instance, used to find parent image information
     :param cache_content: bool, tells DockerfileParser to cache Dockerfile content
@@ -1184,47 +1390,78 @@ def df_parser(df_path, workflow=None, cache_content=False, env_replace=True, par
 
         # If parent_env is not provided, but workflow is then attempt to inspect
         # the workflow for the parent_env
-
-        try:
-            parent_config = workflow.builder.base_image_inspect[INSPECT_CONFIG]
-        except (AttributeError, TypeError, KeyError):
-            logger.debug("base image unable to be inspected")
+        p_env = _get_parent_env(workflow)
+
+    parsers = getattr(workflow, 'df_parsers', None)
+    if isinstance(parsers, dict):
+        key = (df_path, env_replace)
+        dfparser = parsers.get(key)
+        if dfparser is None:
+            dfparser = _new_df_parser(CachingDockerfileParser, df_path,
+                                      env_replace=env_replace, parent_env=p_env)
+            parsers[key] = dfparser
         else:
+            dfparser.refresh()
+            dfparser.parent_env = p_env
+        return dfparser
+
+    return _new_df_parser(DockerfileParser, df_path, cache_content=cache_content,
+                          env_replace=env_replace, parent_env=p_env)
+
+
+def _get_parent_env(workflow):
+    """
+    Find ENV inherited from the base image
+
+    The result is kept in workflow.df_parent_env for as long as the builder
+    returns the same base image inspection, so it isn't derived again for
+    every df_parser call.
+
+    :param workflow: DockerBuildWorkflow object instance
+    :return: dict, parent ENV key:value pairs
+    """
+    try:
+        parent_config = workflow.builder.base_image_inspect[INSPECT_CONFIG]
+    except (AttributeError, TypeError, KeyError):
+        logger.debug("base image unable to be inspected")
+        return {}
+
+    cached = getattr(workflow, 'df_parent_env', None)
+    if cached is not None and cached[0] is parent_config:
+        return cached[1]
+
+    p_env = {}
+    try:
+        tmp_env = parent_config["Env"]
+        logger.debug("Parent Config ENV: %s" % tmp_env)
+
+        if isinstance(tmp_env, dict):
+            p_env = tmp_env
+        elif isinstance(tmp_env, list):
             try:
-                tmp_env = parent_config["Env"]
-                logger.debug("Parent Config ENV: %s" % tmp_env)
+                for key_val in tmp_env:
+                    key, val = key_val.split("=", 1)
+                    p_env[key] = val
 
-                if isinstance(tmp_env, dict):
-                    p_env = tmp_env
-                elif isinstance(tmp_env, list):
-                    try:
-                        for key_val in tmp_env:
-                            key, val = key_val.split("=", 1)
-                            p_env[key] = val
+            except ValueError:
+                logger.debug("Unable to parse all of Parent Config ENV")
 
-                    except ValueError:
-                        logger.debug("Unable to parse all of Parent Config ENV")
+    except KeyError:
+        logger.debug("Parent Environment not found, not applied to Dockerfile")
 
-            except KeyError:
-                logger.debug("Parent Environment not found, not applied to Dockerfile")
+    if hasattr(workflow, 'df_parent_env'):
+        # keep a reference to the inspection so that identity check is sound
+        workflow.df_parent_env = (parent_config, p_env)
+    return p_env
 
+
+def _new_df_parser(parser_class, df_path, parent_env=None, **kwargs):
     try:
-        dfparser = DockerfileParser(
-            df_path,
-            cache_content=cache_content,
-            env_replace=env_replace,
-            parent_env=p_env
-        )
+        return parser_class(df_path, parent_env=parent_env, **kwargs)
     except TypeError:
         logger.debug("Old version of dockerfile-parse detected, unable to set inherited parent "
                      "ENVs")
-        dfparser = DockerfileParser(
-            df_path,
-            cache_content=cache_content,
-            env_replace=env_replace,
-        )
-
-    return dfparser
+        return parser_class(df_path, **kwargs)
 
 
 def are_plugins_in_order(plugins_conf, *plugins_names):
@@ -1308,15 +1545,19 @@ class SessionWithTimeout(requests.Session):
         return super(SessionWithTimeout, self).request(*args, **kwargs)
 
 
-# This is a hook to mock during tests to temporarily disable retries
-def _http_retries_disabled():
+def http_retries_disabled():
+    """
+    Whether failed HTTP requests and downloads should not be retried
+
+    This is a hook to mock during tests to temporarily disable retries.
+    """
     return False
 
 
 def get_retrying_requests_session(client_statuses=HTTP_CLIENT_STATUS_RETRY,
                                   times=HTTP_MAX_RETRIES, delay=HTTP_BACKOFF_FACTOR,
-                                  method_whitelist=None):
-    if _http_retries_disabled():
+                                  method_whitelist=None, pool_maxsize=DEFAULT_POOLSIZE):
+    if http_retries_disabled():
         times = 0
 
     retry = Retry(
@@ -1326,8 +1567,8 @@ def get_retrying_requests_session(client_statuses=HTTP_CLIENT_STATUS_RETRY,
         method_whitelist=method_whitelist
     )
     session = SessionWithTimeout()
-    session.mount('http://', HTTPAdapter(max_retries=retry))
-    session.mount('https://', HTTPAdapter(max_retries=retry))
+    session.mount('http://', HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize))
+    session.mount('https://', HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize))
 
     return session
 
@@ -1436,6 +1677,127 @@ def split_module_spec(module):
     return ModuleSpec(name, stream, version, context, profile)
 
 
+class HashingLogFile(object):
+    """
+    Temporary log file which is checksummed as it is written
+
+    Writes are collected in memory and written to the file in chunks of
+    at least buffer_size bytes, so collecting large logs line by line
+    doesn't cost a system call per line, and the file doesn't have to be
+    read again to describe it.
+    """
+
+    BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, prefix, suffix='.log', buffer_size=BUFFER_SIZE):
+        """
+        :param prefix: str, prefix of the temporary file name
+        :param suffix: str, suffix of the temporary file name
+        :param buffer_size: int, number of bytes to collect before writing
+        """
+        # Deleted once closed
+        self.file = NamedTemporaryFile(prefix=prefix, suffix=suffix, mode='r+b')
+        self.buffer_size = buffer_size
+        self.size = 0
+        self._md5 = hashlib.md5()
+        self._buffer = []
+        self._buffered = 0
+
+    def write(self, data):
+        """
+        :param data: bytes, data to append
+        """
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffer_size:
+            self._write_buffer()
+
+    def flush(self):
+        self._write_buffer()
+        self.file.flush()
+
+    def get_metadata(self, filename):
+        """
+        Describe the file by its metadata, flushing it first
+
+        :param filename: str, name to describe the file by
+        :return: dict
+        """
+        self.flush()
+        return {'filename': filename,
+                'filesize': self.size,
+                'checksum': self._md5.hexdigest(),
+                'checksum_type': 'md5'}
+
+    def _write_buffer(self):
+        if not self._buffer:
+            return
+
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        self._md5.update(data)
+        self.file.write(data)
+        self.size += len(data)
+
+
+class ChunkedStream(io.RawIOBase):
+    """
+    Read-only file-like object over an iterable of bytes chunks
+
+    docker-py 3 returns the image archive from APIClient.get_image() as a
+    generator of chunks rather than as a file object; this lets such a
+    generator be read from (e.g. by tarfile) without holding it in memory.
+    """
+
+    def __init__(self, chunks):
+        """
+        :param chunks: iterable of bytes
+        """
+        super(ChunkedStream, self).__init__()
+        self._chunks = iter(chunks)
+        self._chunk = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._chunk:
+            try:
+                self._chunk = next(self._chunks)
+            except StopIteration:
+                return 0
+
+        size = min(len(b), len(self._chunk))
+        b[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+@contextmanager
+def image_archive_stream(docker_client, image):
+    """
+    Context manager yielding the docker archive of image as a file-like object
+
+    :param docker_client: docker.APIClient instance
+    :param image: str, image ID or name
+    :return: file-like object, readable but not seekable
+    """
+    response = docker_client.get_image(image)
+    if hasattr(response, 'read'):
+        # older docker-py returns the raw HTTP response
+        stream = response
+    else:
+        stream = io.BufferedReader(ChunkedStream(response))
+
+    try:
+        yield stream
+    finally:
+        stream.close()
+        if hasattr(response, 'close'):
+            response.close()
+
+
 class OSBSLogs(object):
     def __init__(self, log):
         self.log = log
@@ -1459,6 +1821,9 @@ class OSBSLogs(object):
         """
         Build list of log files
 
+        Log lines are streamed from the server into one file per platform,
+        each file is checksummed while it is written.
+
         :return: list, of log files
         """
 
@@ -1479,18 +1844,17 @@ class OSBSLogs(object):
         platform_logs = {}
         for entry in logs:
             platform = entry.platform
-            if platform not in platform_logs:
+            logfile = platform_logs.get(platform)
+            if logfile is None:
                 filename = 'orchestrator' if platform is None else platform
-                platform_logs[platform] = NamedTemporaryFile(prefix="%s-%s" %
-                                                             (build_id, filename),
-                                                             suffix=".log", mode='r+b')
-            platform_logs[platform].write((entry.line + '\n').encode('utf-8'))
+                logfile = HashingLogFile(prefix="%s-%s" % (build_id, filename))
+                platform_logs[platform] = logfile
+            logfile.write((entry.line + '\n').encode('utf-8'))
 
         for platform, logfile in platform_logs.items():
-            logfile.flush()
             filename = 'orchestrator' if platform is None else platform
-            metadata = self.get_log_metadata(logfile.name, "%s.log" % filename)
-            output.append(Output(file=logfile, metadata=metadata))
+            metadata = logfile.get_metadata("%s.log" % filename)
+            output.append(Output(file=logfile.file, metadata=metadata))
 
         return output
 
@@ -0,0 +1,86 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+
+from atomic_reactor.odcs_util import ODCS_DATETIME_FORMAT
+
+
+class MockODCSClient(object):
+    """
+    In-memory stand-in for ODCSClient
+
+    Composes are finished as soon as they are requested. Use it like this:
+
+    odcs = MockODCSClient()
+    flexmock(pre_reactor_config).should_receive('get_odcs_session').and_return(odcs)
+    """
+
+    def __init__(self, seconds_to_live=timedelta(hours=24), first_id=1):
+        self.seconds_to_live = seconds_to_live
+        self.composes = {}
+        self.started = []
+        self.renewed = []
+        self._next_id = first_id
+
+    def start_compose(self, source_type, source, packages=None, sigkeys=None, arches=None,
+                      flags=None, multilib_arches=None, multilib_method=None):
+        compose_id = self._new_id()
+        compose = {
+            'id': compose_id,
+            'source_type': source_type,
+            'source': source,
+            'packages': ' '.join(packages or []),
+            'sigkeys': ' '.join(sigkeys or []),
+            'flags': flags or [],
+            'state_name': 'done',
+            'result_repo': 'http://odcs.example.com/composes/odcs-{}'.format(compose_id),
+            'result_repofile': ('http://odcs.example.com/composes/odcs-{0}/odcs-{0}.repo'
+                                .format(compose_id)),
+            'time_to_expire': self._time_to_expire(self.seconds_to_live),
+        }
+        if arches:
+            compose['arches'] = ' '.join(arches)
+
+        self.composes[compose_id] = compose
+        self.started.append(compose_id)
+        return dict(compose)
+
+    def renew_compose(self, compose_id):
+        compose = self.composes[compose_id]
+        if compose['state_name'] == 'removed':
+            compose = dict(compose, id=self._new_id())
+            self.composes[compose['id']] = compose
+
+        compose['state_name'] = 'done'
+        compose['time_to_expire'] = self._time_to_expire(self.seconds_to_live)
+        self.renewed.append(compose_id)
+        return dict(compose)
+
+    def wait_for_compose(self, compose_id, **kwargs):
+        return dict(self.composes[compose_id])
+
+    def wait_for_composes(self, compose_ids, **kwargs):
+        return [self.wait_for_compose(compose_id) for compose_id in compose_ids]
+
+    def expire_compose(self, compose_id, time_left=timedelta()):
+        """Make compose expire after time_left, or remove it if time_left is not positive"""
+        compose = self.composes[compose_id]
+        compose['time_to_expire'] = self._time_to_expire(time_left)
+        if time_left <= timedelta():
+            compose['state_name'] = 'removed'
+
+    def _new_id(self):
+        compose_id = self._next_id
+        self._next_id += 1
+        return compose_id
+
+    def _time_to_expire(self, time_left):
+        return (datetime.utcnow() + time_left).strftime(ODCS_DATETIME_FORMAT)
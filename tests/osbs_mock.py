@@ -0,0 +1,222 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from osbs.exceptions import OsbsException
+
+
+class FakeBuild(object):
+    """
+    Worker build as returned by FakeOSBS, with the BuildResponse methods
+    used by orchestrate_build
+    """
+
+    def __init__(self, name, platform, status='Running', annotations=None):
+        self.name = name
+        self.platform = platform
+        self.status = status
+        self.annotations = annotations or {}
+
+    def get_build_name(self):
+        return self.name
+
+    def get_annotations(self):
+        return self.annotations
+
+    def get_labels(self):
+        return {}
+
+    def get_repositories(self):
+        return json.loads(self.annotations.get('repositories', '{}'))
+
+    def get_koji_build_id(self):
+        return None
+
+    def is_finished(self):
+        return self.status in ('Complete', 'Failed', 'Cancelled')
+
+    def is_succeeded(self):
+        return self.status == 'Complete'
+
+
+class FakeConfigMap(object):
+    """
+    ConfigMap as returned by FakeOSBS.get_config_map()
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def get_data_by_key(self, key):
+        return self.data[key]
+
+
+class FakeCluster(object):
+    """
+    Simulated worker cluster
+
+    All delays are in seconds. Failure rates are probabilities of an
+    API call raising OsbsException. Counters of API calls are updated
+    under a lock, since platforms talk to clusters from several threads.
+    """
+
+    def __init__(self, name, current_builds=0, latency=0.0, list_failure_rate=0.0,
+                 create_failure_rate=0.0, build_duration=0.0, log_lines=0, seed=None,
+                 build_annotations=None, config_maps=None):
+        self.name = name
+        self.current_builds = current_builds
+        self.latency = latency
+        self.list_failure_rate = list_failure_rate
+        self.create_failure_rate = create_failure_rate
+        self.build_duration = build_duration
+        self.log_lines = log_lines
+        # annotations of finished worker builds
+        self.build_annotations = build_annotations or {}
+        self.config_maps = config_maps or {}
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.list_calls = 0
+        self.builds = {}
+        self.cancelled = []
+        # time.time() when each worker build was created
+        self.created_at = {}
+
+    @property
+    def url(self):
+        return 'https://{}.example.com/'.format(self.name)
+
+    def call(self, failure_rate):
+        time.sleep(self.latency)
+        with self.lock:
+            if self.random.random() < failure_rate:
+                raise OsbsException('{} is not available'.format(self.name))
+
+
+class FakeConfiguration(object):
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    def get_openshift_base_uri(self):
+        return self.cluster.url
+
+    def get_namespace(self):
+        return '{}-namespace'.format(self.cluster.name)
+
+    def get_builder_build_json_store(self):
+        return None
+
+    def get_verify_ssl(self):
+        return True
+
+    def get_use_auth(self):
+        return True
+
+
+class FakeOSBS(object):
+    """
+    In-memory stand-in for an OSBS session of one worker cluster
+    """
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.os_conf = self.build_conf = FakeConfiguration(cluster)
+
+    @contextmanager
+    def retries_disabled(self):
+        yield
+
+    def list_builds(self, field_selector=None):
+        self.cluster.call(self.cluster.list_failure_rate)
+        with self.cluster.lock:
+            self.cluster.list_calls += 1
+            running = [build for build in self.cluster.builds.values()
+                       if not build.is_finished()]
+            return list(range(self.cluster.current_builds)) + running
+
+    def create_worker_build(self, **kwargs):
+        self.cluster.call(self.cluster.create_failure_rate)
+        with self.cluster.lock:
+            name = 'worker-build-{}-{}'.format(kwargs['platform'], len(self.cluster.builds))
+            build = FakeBuild(name, kwargs['platform'])
+            self.cluster.builds[name] = build
+            self.cluster.created_at[name] = time.time()
+            return build
+
+    def get_build_logs(self, build_name, follow=False):
+        for index in range(self.cluster.log_lines):
+            yield '{} line {}'.format(build_name, index)
+
+    def wait_for_build_to_finish(self, build_name):
+        build = self.cluster.builds[build_name]
+        deadline = self.cluster.created_at[build_name] + self.cluster.build_duration
+        while not build.is_finished() and time.time() < deadline:
+            time.sleep(min(0.01, max(0, deadline - time.time())))
+
+        with self.cluster.lock:
+            if not build.is_finished():
+                build.status = 'Complete'
+                build.annotations = dict(self.cluster.build_annotations)
+        return build
+
+    def cancel_build(self, build_name):
+        with self.cluster.lock:
+            self.cluster.cancelled.append(build_name)
+            self.cluster.builds[build_name].status = 'Cancelled'
+
+    def get_config_map(self, name):
+        return FakeConfigMap(self.cluster.config_maps[name])
+
+    def get_pod_for_build(self, build_name):
+        raise OsbsException('no pod for {}'.format(build_name))
+
+
+class FakeOSBSService(object):
+    """
+    Fake worker clusters for OrchestrateBuildPlugin
+
+    Use session() in place of OrchestrateBuildPlugin._get_openshift_session:
+
+    service = FakeOSBSService([FakeCluster('worker1', current_builds=3)])
+    flexmock(plugin, _get_openshift_session=service.session)
+    """
+
+    def __init__(self, clusters):
+        self.clusters = dict((cluster.name, cluster) for cluster in clusters)
+
+    def session(self, kwargs):
+        return FakeOSBS(self.clusters[kwargs['conf_section']])
+
+    def get_builds(self):
+        """
+        :return: dict, build name -> (cluster name, FakeBuild)
+        """
+        builds = {}
+        for cluster in self.clusters.values():
+            with cluster.lock:
+                for name, build in cluster.builds.items():
+                    builds[name] = (cluster.name, build)
+        return builds
+
+    def get_created_at(self):
+        """
+        :return: dict, platform -> time.time() when its worker build was created
+        """
+        created_at = {}
+        for cluster in self.clusters.values():
+            with cluster.lock:
+                for name, build in cluster.builds.items():
+                    created_at[build.platform] = cluster.created_at[name]
+        return created_at
@@ -18,6 +18,8 @@ from atomic_reactor.constants import (PLUGIN_FETCH_WORKER_METADATA_KEY,
 from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugin import PostBuildPluginsRunner, PluginFailedException
+from atomic_reactor.plugins.post_compare_components import (ComponentComparison,
+                                                            get_component_comparison_report)
 from atomic_reactor.plugins.pre_reactor_config import (ReactorConfigPlugin,
                                                        WORKSPACE_CONF_KEY,
                                                        ReactorConfig)
@@ -126,11 +128,25 @@ def test_compare_components_plugin(tmpdir, mismatch, exception, fail):
     )
 
     if fail:
-        with pytest.raises(PluginFailedException):
+        with pytest.raises(PluginFailedException) as exc_info:
             runner.run()
+        assert 'Failed component comparison: 1 of' in str(exc_info.value)
     else:
         runner.run()
 
+    report = get_component_comparison_report(workflow)
+    assert report['platforms'] == ['ppc64le', 'x86_64']
+    assert report['ignored'] == ([component['name']] if exception else [])
+    if fail:
+        assert len(report['mismatches']) == 1
+        mismatch = report['mismatches'][0]
+        assert mismatch['name'] == component['name']
+        assert mismatch['fields'] == ['version']
+        assert mismatch['platforms']['ppc64le'][0]['version'] == 'bacon'
+        assert mismatch['platforms']['x86_64'][0]['version'] != 'bacon'
+    else:
+        assert report['mismatches'] == []
+
 
 def test_no_components(tmpdir):
     workflow = mock_workflow(tmpdir)
@@ -173,5 +189,51 @@ def test_bad_component_type(tmpdir):
         }]
     )
 
-    with pytest.raises(PluginFailedException):
+    with pytest.raises(PluginFailedException) as exc_info:
         runner.run()
+    assert 'Type foo not supported' in str(exc_info.value)
+
+
+def rpm(name, version='1.0', release='1', signature='abc'):
+    return {'type': 'rpm', 'name': name, 'version': version, 'release': release,
+            'signature': signature, 'arch': 'noarch', 'epoch': None, 'sigmd5': '0' * 32}
+
+
+def test_component_comparison():
+    components = {
+        'x86_64': [rpm('bash'), rpm('glibc'), rpm('glibc', signature='def'), rpm('grub2'),
+                   rpm('kernel', release='2')],
+        'ppc64le': [rpm('bash'), rpm('glibc'), rpm('kernel'), rpm('ignored', '2.0')],
+        's390x': [rpm('bash', '2.0', '2'), rpm('glibc'), rpm('kernel'), rpm('ignored')],
+    }
+
+    report = ComponentComparison(['ignored']).compare(components)
+
+    assert report['platforms'] == ['ppc64le', 's390x', 'x86_64']
+    assert report['compared'] == 4
+    assert report['ignored'] == ['ignored']
+    assert report['missing'] == {'ppc64le': ['grub2'], 's390x': ['grub2']}
+    assert report['unsupported'] == []
+    assert [(m['name'], m['fields']) for m in report['mismatches']] == [
+        ('bash', ['version', 'release']),
+        ('glibc', ['signature']),
+        ('kernel', ['release']),
+    ]
+    assert report['mismatches'][1]['platforms']['x86_64'] == [
+        {'version': '1.0', 'release': '1', 'signature': 'abc'},
+        {'version': '1.0', 'release': '1', 'signature': 'def'},
+    ]
+
+
+def test_component_comparison_scales():
+    # every component is looked at once per platform, not once per other component
+    platforms = ['arch{}'.format(index) for index in range(8)]
+    components = dict((platform, [rpm('package{}'.format(index)) for index in range(5000)])
+                      for platform in platforms)
+    components['arch0'][0]['version'] = '2.0'
+
+    report = ComponentComparison().compare(components)
+
+    assert report['compared'] == 5000
+    assert report['missing'] == {}
+    assert [m['name'] for m in report['mismatches']] == ['package0']
@@ -55,7 +55,7 @@ class MockInsideBuilder(object):
         self.df_path = 'some'
         self.df_dir = 'some'
 
-        def simplegen(x, y):
+        def simplegen(x, y, **kwargs):
             yield "some\u2018".encode('utf-8')
         flexmock(self.tasker, build_image_from_path=simplegen)
 
@@ -275,6 +275,27 @@ def mock_koji_session(koji_proxyuser=None, koji_ssl_certs_dir=None,
         .once()
         .and_return(session))
 
+    session.multicall = False
+    # number of calls made in each multicall
+    session.multicalls = []
+    queued_results = []
+
+    def queue_in_multicall(func):
+        def call(*args, **kwargs):
+            result = func(*args, **kwargs)
+            if session.multicall:
+                queued_results.append([result])
+                return None
+            return result
+        return call
+
+    def mock_multi_call(strict=False):
+        session.multicall = False
+        results = list(queued_results)
+        del queued_results[:]
+        session.multicalls.append(len(results))
+        return results
+
     def mock_get_build(nvr):
         if nvr == DEFAULT_KOJI_BUILD['nvr']:
             return DEFAULT_KOJI_BUILD
@@ -282,11 +303,15 @@ def mock_koji_session(koji_proxyuser=None, koji_ssl_certs_dir=None,
             return None
     (session
         .should_receive('getBuild')
-        .replace_with(mock_get_build))
+        .replace_with(queue_in_multicall(mock_get_build)))
 
     (session
         .should_receive('listArchives')
-        .and_return(archives))
+        .replace_with(queue_in_multicall(lambda **kwargs: archives)))
+
+    (session
+        .should_receive('multiCall')
+        .replace_with(mock_multi_call))
 
     (session
         .should_receive('krb_login')
@@ -400,7 +425,7 @@ def test_fetch_maven_artifacts(tmpdir, docker_tasker, reactor_config_map):
     )
 
     results = runner.run()
-    plugin_result = results[FetchMavenArtifactsPlugin.key]
+    plugin_result = results[FetchMavenArtifactsPlugin.key]['downloads']
 
     assert len(plugin_result) == len(DEFAULT_ARCHIVES) + len(DEFAULT_REMOTE_FILES)
     for download in plugin_result:
@@ -408,6 +433,50 @@ def test_fetch_maven_artifacts(tmpdir, docker_tasker, reactor_config_map):
         assert os.path.exists(dest)
 
 
+@responses.activate  # noqa
+def test_fetch_maven_artifacts_cache(tmpdir, docker_tasker, reactor_config_map):
+    """Artifacts are provided from the download cache on subsequent builds."""
+    cache_dir = str(tmpdir.join('cache'))
+    downloads_count = len(DEFAULT_ARCHIVES) + len(DEFAULT_REMOTE_FILES)
+
+    for build, expected_hits in enumerate((0, downloads_count)):
+        workdir = tmpdir.join('build-{}'.format(build))
+        workdir.ensure(dir=True)
+        workflow = mock_workflow(workdir)
+        mock_koji_session()
+        mock_fetch_artifacts_by_nvr(str(workdir))
+        mock_fetch_artifacts_by_url(str(workdir))
+        mock_nvr_downloads()
+        mock_url_downloads()
+
+        if reactor_config_map:
+            make_and_store_reactor_config_map(workflow)
+
+        runner = PreBuildPluginsRunner(
+            docker_tasker,
+            workflow,
+            [{
+                'name': FetchMavenArtifactsPlugin.key,
+                'args': {
+                    'koji_hub': KOJI_HUB,
+                    'koji_root': KOJI_ROOT,
+                    'download_cache_dir': cache_dir,
+                }
+            }]
+        )
+
+        responses.calls.reset()
+        plugin_result = runner.run()[FetchMavenArtifactsPlugin.key]
+
+        assert plugin_result['cache']['hits'] == expected_hits
+        assert plugin_result['cache']['misses'] == downloads_count - expected_hits
+        assert len(responses.calls) == downloads_count - expected_hits
+        for download in plugin_result['downloads']:
+            dest = os.path.join(str(workdir), FetchMavenArtifactsPlugin.DOWNLOAD_DIR,
+                                download.dest)
+            assert os.path.exists(dest)
+
+
 @pytest.mark.parametrize(('nvr_requests', 'expected'), (  # noqa
     ([
         {
@@ -456,7 +525,7 @@ def test_fetch_maven_artifacts_nvr_filtering(tmpdir, docker_tasker, nvr_requests
     )
 
     results = runner.run()
-    plugin_result = results[FetchMavenArtifactsPlugin.key]
+    plugin_result = results[FetchMavenArtifactsPlugin.key]['downloads']
 
     assert len(plugin_result) == len(expected)
     for download in plugin_result:
@@ -468,6 +537,46 @@ def test_fetch_maven_artifacts_nvr_filtering(tmpdir, docker_tasker, nvr_requests
         assert os.path.exists(dest)
 
 
+@responses.activate  # noqa
+def test_fetch_maven_artifacts_nvr_batched(tmpdir, docker_tasker, reactor_config_map):
+    """Builds and their archives are looked up in one Koji request each."""
+    nvr_requests = [
+        {
+            'nvr': 'com.sun.xml.bind.mvn-jaxb-parent-2.2.11.4-1',
+            'archives': [{'filename': 'jaxb-core-2.2.11-4.pom'}],
+        },
+        {
+            'nvr': 'com.sun.xml.bind.mvn-jaxb-parent-2.2.11.4-1',
+            'archives': [{'group_id': 'org.glassfish.jaxb', 'filename': '*.jar'}],
+        },
+    ]
+    expected = [ARCHIVE_JAXB_SUN_POM, ARCHIVE_JAXB_GLASSFISH_POM,
+                ARCHIVE_JAXB_GLASSFISH_JAR, ARCHIVE_JAXB_JAVADOC_GLASSFIX_JAR]
+    workflow = mock_workflow(tmpdir)
+    session = mock_koji_session()
+    mock_fetch_artifacts_by_nvr(str(tmpdir), contents=yaml.safe_dump(nvr_requests))
+    mock_nvr_downloads(archives=expected)
+
+    if reactor_config_map:
+        make_and_store_reactor_config_map(workflow)
+
+    runner = PreBuildPluginsRunner(
+        docker_tasker,
+        workflow,
+        [{
+            'name': FetchMavenArtifactsPlugin.key,
+            'args': {'koji_hub': KOJI_HUB, 'koji_root': KOJI_ROOT}
+        }]
+    )
+
+    results = runner.run()
+    plugin_result = results[FetchMavenArtifactsPlugin.key]['downloads']
+
+    assert session.multicalls == [2, 2]
+    assert ([download.checksums['md5'] for download in plugin_result] ==
+            [archive['checksum'] for archive in expected])
+
+
 @pytest.mark.parametrize(('nvr_requests', 'error_msg'), (  # noqa
     ([
         {
@@ -671,7 +780,7 @@ def test_fetch_maven_artifacts_url_with_target(tmpdir, docker_tasker, reactor_co
     )
 
     results = runner.run()
-    plugin_result = results[FetchMavenArtifactsPlugin.key]
+    plugin_result = results[FetchMavenArtifactsPlugin.key]['downloads']
 
     assert len(plugin_result) == len(remote_files)
 
@@ -842,7 +951,7 @@ def test_fetch_maven_artifacts_url_allowed_domains(tmpdir, docker_tasker, domain
 
     else:
         results = runner.run()
-        plugin_result = results[FetchMavenArtifactsPlugin.key]
+        plugin_result = results[FetchMavenArtifactsPlugin.key]['downloads']
         for download in plugin_result:
             dest = os.path.join(str(tmpdir), FetchMavenArtifactsPlugin.DOWNLOAD_DIR, download.dest)
             assert os.path.exists(dest)
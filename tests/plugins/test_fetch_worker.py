@@ -10,6 +10,8 @@ from __future__ import print_function, unicode_literals
 
 import os
 import logging
+import threading
+import time
 
 from flexmock import flexmock
 
@@ -17,11 +19,14 @@ from atomic_reactor.core import DockerTasker
 from atomic_reactor.constants import PLUGIN_FETCH_WORKER_METADATA_KEY
 from atomic_reactor.build import BuildResult
 from atomic_reactor.inner import DockerBuildWorkflow
-from atomic_reactor.plugin import PostBuildPluginsRunner
+from atomic_reactor.plugin import PostBuildPluginsRunner, PluginFailedException
 from atomic_reactor.util import ImageName
 
 from atomic_reactor.plugins.build_orchestrate_build import (WorkerBuildInfo, ClusterInfo,
                                                             OrchestrateBuildPlugin)
+from atomic_reactor.plugins.exit_remove_worker_metadata import RemoveWorkerMetadataPlugin
+from atomic_reactor.plugins.post_fetch_worker_metadata import (WorkerMetadataIndex,
+                                                               get_worker_metadata_index)
 
 from tests.constants import MOCK_SOURCE, TEST_IMAGE, INPUT_IMAGE
 from tests.docker_mock import mock_docker
@@ -165,3 +170,140 @@ def test_fetch_worker_plugin(tmpdir, fragment_key):
         assert output == expected
     else:
         assert output == expected_failed
+
+
+def test_fetch_worker_plugin_concurrent(tmpdir):
+    workflow = mock_workflow(tmpdir)
+    platforms = ['aarch64', 'ppc64le', 's390x', 'x86_64']
+    log = logging.getLogger("atomic_reactor.plugins." + OrchestrateBuildPlugin.key)
+
+    started = []
+    all_started = threading.Condition()
+
+    class WaitingOSBS(MockOSBS):
+        def get_config_map(self, name):
+            # only returns once all platforms are being fetched
+            with all_started:
+                started.append(name)
+                all_started.notify_all()
+                deadline = time.time() + 5
+                while len(started) < len(platforms) and time.time() < deadline:
+                    all_started.wait(deadline - time.time())
+                assert len(started) == len(platforms)
+            return super(WaitingOSBS, self).get_config_map(name)
+
+    annotations = {'worker-builds': {}}
+    build_info = {}
+    for platform in platforms:
+        name = 'build-1-{}-md'.format(platform)
+        annotations['worker-builds'][platform] = {
+            'metadata_fragment': 'configmap/' + name,
+            'metadata_fragment_key': 'metadata.json',
+        }
+        osbs = WaitingOSBS({name: {'metadata.json': {'platform': platform}}})
+        build_info[platform] = WorkerBuildInfo(None, ClusterInfo(None, platform, osbs, None), log)
+
+    workflow.build_result = BuildResult(annotations=annotations, image_id="id1234")
+    workflow.plugin_workspace[OrchestrateBuildPlugin.key] = {'build_info': build_info}
+
+    runner = PostBuildPluginsRunner(None, workflow,
+                                    [{'name': PLUGIN_FETCH_WORKER_METADATA_KEY, 'args': {}}])
+    output = runner.run()
+
+    assert output[PLUGIN_FETCH_WORKER_METADATA_KEY] == dict(
+        (platform, {'platform': platform}) for platform in platforms)
+    assert sorted(started) == ['build-1-{}-md'.format(platform) for platform in platforms]
+
+
+def test_fetch_worker_plugin_failure(tmpdir):
+    workflow = mock_workflow(tmpdir)
+    log = logging.getLogger("atomic_reactor.plugins." + OrchestrateBuildPlugin.key)
+
+    annotations = {'worker-builds': {}}
+    build_info = {}
+    for platform in ['ppc64le', 'x86_64']:
+        name = 'build-1-{}-md'.format(platform)
+        annotations['worker-builds'][platform] = {
+            'metadata_fragment': 'configmap/' + name,
+            'metadata_fragment_key': 'metadata.json',
+        }
+        # the ppc64le ConfigMap is read, but lacks the metadata
+        data = {'metadata.json': {}} if platform == 'x86_64' else {}
+        osbs = MockOSBS({name: data})
+        build_info[platform] = WorkerBuildInfo(None, ClusterInfo(None, platform, osbs, None), log)
+
+    workflow.build_result = BuildResult(annotations=annotations, image_id="id1234")
+    workflow.plugin_workspace[OrchestrateBuildPlugin.key] = {'build_info': build_info}
+
+    runner = PostBuildPluginsRunner(None, workflow,
+                                    [{'name': PLUGIN_FETCH_WORKER_METADATA_KEY, 'args': {}}])
+    with pytest.raises(PluginFailedException):
+        runner.run()
+
+    # ConfigMaps of all platforms are still removed
+    workspace = workflow.plugin_workspace[RemoveWorkerMetadataPlugin.key]
+    assert sorted(name for name, _ in workspace['cf_maps_to_remove']) == [
+        'build-1-ppc64le-md', 'build-1-x86_64-md']
+
+
+def rpm(name, arch='noarch', version='1.0'):
+    return {'type': 'rpm', 'name': name, 'version': version, 'release': '1', 'arch': arch}
+
+
+def make_worker_metadata(arch, components):
+    return {
+        'buildroots': [{'id': 1, 'container': {'type': 'docker', 'arch': arch}}],
+        'output': [
+            {'type': 'log', 'arch': arch, 'filename': 'build.log', 'buildroot_id': 1},
+            {'type': 'docker-image', 'arch': arch, 'filename': 'image.tar.gz',
+             'buildroot_id': 1, 'components': components},
+        ],
+    }
+
+
+def test_worker_metadata_index():
+    worker_metadatas = {
+        'x86_64': make_worker_metadata('x86_64', [rpm('bash'), rpm('glibc', 'x86_64')]),
+        'ppc64le': make_worker_metadata('ppc64le', [rpm('bash'), rpm('glibc', 'ppc64le')]),
+        's390x': make_worker_metadata('s390x', [rpm('bash'), rpm('glibc', 'ppc64le')]),
+    }
+    index = WorkerMetadataIndex(worker_metadatas)
+
+    assert index.platforms == ['ppc64le', 's390x', 'x86_64']
+    assert len(index) == 3
+    assert [(platform, output['filename']) for platform, output in index.get_outputs()] == [
+        ('ppc64le', 'build.log'), ('ppc64le', 'image.tar.gz'),
+        ('s390x', 'build.log'), ('s390x', 'image.tar.gz'),
+        ('x86_64', 'build.log'), ('x86_64', 'image.tar.gz'),
+    ]
+    assert index.get_outputs('docker-image', arch='x86_64') == [
+        ('x86_64', worker_metadatas['x86_64']['output'][1])]
+    assert index.get_outputs('log', platform='s390x', filename='build.log') == [
+        ('s390x', worker_metadatas['s390x']['output'][0])]
+    assert index.get_outputs('docker-image', filename='missing') == []
+    assert index.get_buildroots('ppc64le') == worker_metadatas['ppc64le']['buildroots']
+
+    components, skipped = index.get_components('x86_64')
+    assert components == [rpm('bash'), rpm('glibc', 'x86_64')]
+    assert skipped == []
+    assert index.get_components('aarch64') == ([], [])
+
+    # docker-image outputs without components are reported
+    worker_metadatas['x86_64']['output'][1]['components'] = []
+    index = WorkerMetadataIndex(worker_metadatas)
+    assert index.get_components('x86_64') == ([], [worker_metadatas['x86_64']['output'][1]])
+
+
+def test_get_worker_metadata_index(tmpdir):
+    workflow = mock_workflow(tmpdir)
+    assert get_worker_metadata_index(workflow) is None
+
+    workflow.postbuild_results[PLUGIN_FETCH_WORKER_METADATA_KEY] = {
+        'x86_64': make_worker_metadata('x86_64', [rpm('bash')]),
+    }
+    index = get_worker_metadata_index(workflow)
+    assert index.platforms == ['x86_64']
+    assert get_worker_metadata_index(workflow) is index
+
+    workflow.postbuild_results[PLUGIN_FETCH_WORKER_METADATA_KEY] = {}
+    assert get_worker_metadata_index(workflow).platforms == []
@@ -36,7 +36,8 @@ except ImportError:
 
 from osbs.build.build_response import BuildResponse
 from atomic_reactor.core import DockerTasker
-from atomic_reactor.plugins.post_fetch_worker_metadata import FetchWorkerMetadataPlugin
+from atomic_reactor.plugins.post_fetch_worker_metadata import (FetchWorkerMetadataPlugin,
+                                                               WorkerMetadataIndex)
 from atomic_reactor.plugins.build_orchestrate_build import (OrchestrateBuildPlugin,
                                                             WORKSPACE_KEY_UPLOAD_DIR,
                                                             WORKSPACE_KEY_BUILD_INFO)
@@ -605,7 +606,7 @@ class TestKojiImport(object):
                                             release='1')
         plugin = KojiImportPlugin(tasker, workflow, '', '/')
 
-        assert plugin.get_buildroot(metadatas) == results
+        assert plugin.get_buildroot(WorkerMetadataIndex(metadatas)) == results
 
     def test_koji_import_failed_build(self, tmpdir, os_env, reactor_config_map):  # noqa
         session = MockedClientSession('')
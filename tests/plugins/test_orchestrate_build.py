@@ -8,16 +8,24 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+from atomic_reactor.annotations import encode_annotations
 from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugin import BuildCanceledException, PluginFailedException
 from atomic_reactor.plugin import BuildStepPluginsRunner
 from atomic_reactor.plugins import pre_reactor_config
 from atomic_reactor.plugins.build_orchestrate_build import (OrchestrateBuildPlugin,
+                                                            ClusterInfo, ClusterLoadCache,
+                                                            WorkerBuildInfo,
+                                                            WorkerLogMultiplexer,
+                                                            ClusterRetryContext,
+                                                            ClusterRetryCoordinator,
+                                                            AllClustersFailedException,
+                                                            RetryWaitCanceledException,
                                                             get_worker_build_info,
                                                             get_koji_upload_dir,
                                                             override_build_kwarg)
-from atomic_reactor.plugins.pre_reactor_config import (ReactorConfig,
+from atomic_reactor.plugins.pre_reactor_config import (ClusterConfig, ReactorConfig,
                                                        ReactorConfigPlugin,
                                                        WORKSPACE_CONF_KEY)
 from atomic_reactor.plugins.pre_check_and_set_rebuild import CheckAndSetRebuildPlugin
@@ -34,12 +42,15 @@ from osbs.core import Openshift
 from tests.constants import MOCK_SOURCE, TEST_IMAGE, INPUT_IMAGE, SOURCE
 from tests.fixtures import reactor_config_map  # noqa
 from tests.docker_mock import mock_docker
+from tests.osbs_mock import FakeCluster, FakeOSBSService
 from textwrap import dedent
 from copy import deepcopy
 
 import json
+import logging
 import os
 import pytest
+import threading
 import time
 import platform
 
@@ -439,7 +450,8 @@ def test_orchestrate_build(tmpdir, caplog, config_kwargs,
             continue
 
         assert hasattr(record, 'arch')
-        if record.funcName == 'watch_logs':
+        # worker logs are written by WorkerLogMultiplexer
+        if record.funcName in ('watch_logs', '_write_batch'):
             assert record.arch == 'x86_64'
         else:
             assert record.arch == '-'
@@ -1006,7 +1018,14 @@ def test_orchestrate_build_failed_to_list_builds(tmpdir, fail_at):
         flexmock_chain.and_raise(OsbsException("foo"))
 
     if fail_at == 'first':
-        flexmock_chain.and_return(['a', 'b'])
+        # clusters are listed concurrently, fail for the preferred one
+        def get_current_builds(osbs):
+            if osbs.os_conf.get_openshift_base_uri() == 'https://spam.com/':
+                raise OsbsException("foo")
+            return 2
+        (flexmock(OrchestrateBuildPlugin)
+            .should_receive('get_current_builds')
+            .replace_with(get_current_builds))
 
     if fail_at == 'build_canceled':
         flexmock_chain.and_raise(OsbsException(cause=BuildCanceledException()))
@@ -1673,3 +1692,372 @@ def test_no_platforms(tmpdir):
     with pytest.raises(PluginFailedException) as exc:
         runner.run()
     assert 'No enabled platform to build on' in str(exc)
+
+
+def test_cluster_load_cache():
+    clusters = [ClusterConfig('spam', 4, priority=0), ClusterConfig('eggs', 4, priority=1)]
+    infos = [ClusterInfo(cluster, 'x86_64', None, None) for cluster in clusters]
+    fetched = []
+
+    def fetch(builds):
+        def _fetch():
+            fetched.append(builds)
+            return builds
+        return _fetch
+
+    cache = ClusterLoadCache(ttl=60)
+    assert cache.get_builds(clusters[0], fetch(2)) == 2
+    assert cache.get_builds(clusters[1], fetch(2)) == 2
+    # listed builds are reused
+    assert cache.get_builds(clusters[0], fetch(3)) == 2
+    assert fetched == [2, 2]
+
+    # builds just placed count towards the load
+    assert cache.place_build(infos).cluster.name == 'spam'
+    assert cache.place_build(infos).cluster.name == 'eggs'
+    chosen = cache.place_build(infos)
+    assert chosen.cluster.name == 'spam'
+    assert chosen.load == 0.75
+    cache.forget_build(clusters[0])
+    assert cache.get_builds(clusters[0], fetch(3)) == 3
+
+    # placements are dropped once the cluster is listed again
+    cache.ttl = 0
+    assert cache.get_builds(clusters[0], fetch(3)) == 3
+    assert cache.get_builds(clusters[1], fetch(5)) == 5
+    assert fetched == [2, 2, 3, 5]
+
+
+def test_cluster_load_cache_single_flight():
+    cluster = ClusterConfig('spam', 4, priority=0)
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(threading.current_thread())
+        release.wait(5)
+        return 3
+
+    cache = ClusterLoadCache(ttl=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_builds(cluster, fetch)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    # concurrent callers wait for a single listing
+    assert len(calls) == 1
+    assert results == [3] * 5
+
+
+def test_cluster_load_cache_single_flight_error():
+    cluster = ClusterConfig('spam', 4, priority=0)
+    release = threading.Event()
+
+    def fetch():
+        release.wait(5)
+        raise OsbsException('spam is down')
+
+    cache = ClusterLoadCache(ttl=60)
+    errors = []
+
+    def get_builds():
+        try:
+            cache.get_builds(cluster, fetch)
+        except OsbsException as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=get_builds) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    # waiting callers get the error of the listing
+    assert len(errors) == 3
+    # and the next caller lists the cluster again
+    assert cache.get_builds(cluster, lambda: 1) == 1
+
+
+def test_retry_coordinator_wait():
+    coordinator = ClusterRetryCoordinator()
+    contexts = {'spam': ClusterRetryContext(2), 'eggs': ClusterRetryContext(2)}
+
+    start = time.time()
+    coordinator.wait_for_any_cluster(contexts)
+    assert time.time() - start < 0.1
+
+    # waits for the earliest cluster, with sub-second precision
+    contexts['spam'].try_again_later(0.3)
+    contexts['eggs'].try_again_later(60)
+    start = time.time()
+    coordinator.wait_for_any_cluster(contexts)
+    assert 0.25 < time.time() - start < 5
+    assert not contexts['spam'].in_retry_wait
+
+    contexts['spam'].fails = contexts['eggs'].fails = 2
+    with pytest.raises(AllClustersFailedException):
+        coordinator.wait_for_any_cluster(contexts)
+
+
+def test_retry_coordinator_cancel():
+    coordinator = ClusterRetryCoordinator()
+    contexts = {'spam': ClusterRetryContext(2)}
+    contexts['spam'].try_again_later(60)
+    errors = []
+
+    def wait():
+        try:
+            coordinator.wait_for_any_cluster(contexts)
+        except RetryWaitCanceledException as ex:
+            errors.append(ex)
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    time.sleep(0.1)
+    coordinator.cancel()
+    waiter.join(5)
+
+    assert not waiter.is_alive()
+    assert len(errors) == 1
+
+
+class CollectingLog(object):
+    def __init__(self):
+        self.infos = []
+        self.warnings = []
+
+    def info(self, msg, *args):
+        self.infos.append(msg % args)
+
+    def warning(self, msg, *args):
+        self.warnings.append(msg % args)
+
+
+def test_worker_log_multiplexer():
+    multiplexer = WorkerLogMultiplexer(max_buffered=5, batch_size=2, flush_interval=60)
+    logs = {'x86_64': CollectingLog(), 'ppc64le': CollectingLog()}
+    for plat, log in logs.items():
+        multiplexer.add(plat, log)
+
+    multiplexer.start()
+    for index in range(2):
+        multiplexer.put('x86_64', 'x86_64 line {}'.format(index))
+    # a full batch is written without waiting for flush_interval
+    for _ in range(50):
+        if logs['x86_64'].infos:
+            break
+        time.sleep(0.1)
+    assert logs['x86_64'].infos == ['x86_64 line 0', 'x86_64 line 1']
+
+    # oldest lines are dropped from a full queue
+    with multiplexer._condition:
+        for index in range(7):
+            multiplexer.put('ppc64le', b'ppc64le line %d' % index)
+    multiplexer.stop()
+
+    assert logs['ppc64le'].infos == ['ppc64le line {}'.format(index) for index in range(2, 7)]
+    assert logs['ppc64le'].warnings == ['2 lines of worker build log dropped']
+
+
+def test_worker_log_multiplexer_rate_limit():
+    multiplexer = WorkerLogMultiplexer(max_lines_per_second=3)
+    log = CollectingLog()
+    multiplexer.add('x86_64', log)
+    flexmock(time).should_receive('time').and_return(1000.5)
+
+    for index in range(10):
+        multiplexer.put('x86_64', 'line {}'.format(index))
+    multiplexer.stop()
+
+    assert log.infos == ['line 0', 'line 1', 'line 2']
+    assert log.warnings == ['7 lines of worker build log dropped']
+
+
+def test_worker_log_multiplexer_unbounded():
+    multiplexer = WorkerLogMultiplexer(batch_size=10)
+    log = CollectingLog()
+    multiplexer.add('x86_64', log)
+
+    # nothing is dropped when the writer falls behind
+    for index in range(1000):
+        multiplexer.put('x86_64', 'line {}'.format(index))
+    multiplexer.stop()
+
+    assert log.infos == ['line {}'.format(index) for index in range(1000)]
+    assert log.warnings == []
+
+
+def test_watch_logs_reconnect():
+    def get_build_logs(name, follow):
+        assert follow
+        for line in ['line 0', 'line 1']:
+            yield line
+        raise OsbsException('connection reset')
+
+    streams = [get_build_logs('worker-build', True), iter(['line 0', 'line 1', 'line 2'])]
+    osbs = flexmock()
+    osbs.should_receive('get_build_logs').replace_with(lambda name, follow: streams.pop(0))
+
+    cluster_info = ClusterInfo(None, 'x86_64', osbs, None)
+    build_info = WorkerBuildInfo(build=None, cluster_info=cluster_info,
+                                 logger=logging.getLogger(__name__))
+    multiplexer = WorkerLogMultiplexer()
+    lines = []
+    flexmock(multiplexer).should_receive('put').replace_with(
+        lambda plat, line: lines.append((plat, line)))
+
+    build_info.watch_logs(multiplexer)
+
+    # lines seen before reconnecting are not repeated
+    assert lines == [('x86_64', 'line 0'), ('x86_64', 'line 1'), ('x86_64', 'line 2')]
+
+
+def simulate_orchestration(tmpdir, platforms, clusters, **plugin_kwargs):
+    """
+    Run OrchestrateBuildPlugin against fake worker clusters
+
+    All platforms may be built on all clusters.
+
+    :return: tuple, (BuildResult, FakeOSBSService, dict with timings)
+    """
+    workflow = mock_workflow(tmpdir, platforms=platforms)
+    mock_orchestrator_platfrom()
+    service = FakeOSBSService(clusters)
+
+    cluster_configs = [{'name': cluster.name, 'max_concurrent_builds': 10}
+                       for cluster in clusters]
+    reactor_config = {
+        'version': 1,
+        'clusters': {plat: deepcopy(cluster_configs) for plat in platforms},
+        'build_image_override': {plat: 'registry/osbs-buildroot-{}:latest'.format(plat)
+                                 for plat in platforms},
+    }
+    workflow.plugin_workspace[ReactorConfigPlugin.key] = {}
+    workflow.plugin_workspace[ReactorConfigPlugin.key][WORKSPACE_CONF_KEY] =\
+        ReactorConfig(reactor_config)
+
+    plugin_kwargs.setdefault('find_cluster_retry_delay', 0.01)
+    plugin_kwargs.setdefault('failure_retry_delay', 0.01)
+    plugin = OrchestrateBuildPlugin(workflow.builder.tasker, workflow,
+                                    build_kwargs=make_worker_build_kwargs(),
+                                    platforms=platforms,
+                                    osbs_client_config=str(tmpdir),
+                                    **plugin_kwargs)
+    flexmock(plugin, _get_openshift_session=service.session)
+
+    peak_threads = [threading.active_count()]
+    original_do_worker_build = plugin.do_worker_build
+
+    def do_worker_build(cluster_info):
+        peak_threads.append(threading.active_count())
+        return original_do_worker_build(cluster_info)
+
+    flexmock(plugin, do_worker_build=do_worker_build)
+
+    start = time.time()
+    result = plugin.run()
+    end = time.time()
+
+    created_at = service.get_created_at()
+    timings = {
+        'total': end - start,
+        'dispatch': max(created_at.values()) - start if created_at else None,
+        'peak_threads': max(peak_threads),
+    }
+    return result, service, timings
+
+
+def test_simulation_spreads_builds(tmpdir):
+    platforms = ['x86_64', 'ppc64le', 's390x', 'aarch64']
+    clusters = [FakeCluster('busy', current_builds=8, latency=0.001),
+                FakeCluster('idle', current_builds=0, latency=0.001)]
+
+    result, service, _ = simulate_orchestration(tmpdir, platforms, clusters)
+
+    assert not result.is_failed()
+    builds = service.get_builds()
+    assert sorted(build.platform for _, build in builds.values()) == sorted(platforms)
+    # builds just placed count towards the load, 'idle' stays below 'busy'
+    by_cluster = [cluster for cluster, _ in builds.values()]
+    assert by_cluster.count('idle') == 4
+    for cluster in clusters:
+        # platforms share a single listing of each cluster
+        assert cluster.list_calls == 1
+    assert set(result.annotations['worker-builds']) == set(platforms)
+
+
+def test_simulation_flaky_clusters(tmpdir):
+    platforms = ['x86_64', 'ppc64le', 's390x']
+    clusters = [FakeCluster('flaky{}'.format(index), latency=0.001, list_failure_rate=0.3,
+                            create_failure_rate=0.3, log_lines=5, seed=index)
+                for index in range(3)]
+
+    result, service, _ = simulate_orchestration(tmpdir, platforms, clusters,
+                                                max_cluster_fails=50)
+
+    assert not result.is_failed()
+    assert sorted(build.platform for _, build in service.get_builds().values()) == \
+        sorted(platforms)
+
+
+def test_simulation_all_clusters_fail(tmpdir):
+    platforms = ['x86_64', 'ppc64le']
+    clusters = [FakeCluster('down', list_failure_rate=1.0)]
+
+    result, service, _ = simulate_orchestration(tmpdir, platforms, clusters,
+                                                max_cluster_fails=2)
+
+    assert result.is_failed()
+    assert set(json.loads(result.fail_reason)) == set(platforms)
+    assert not service.get_builds()
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('num_platforms', [1, 5, 20])
+@pytest.mark.parametrize('num_clusters', [1, 10, 50])
+def test_simulation_benchmark(tmpdir, num_platforms, num_clusters):
+    platforms = ['platform{}'.format(index) for index in range(num_platforms)]
+    clusters = [FakeCluster('cluster{}'.format(index), current_builds=index % 7,
+                            latency=0.005, list_failure_rate=0.05, create_failure_rate=0.05,
+                            build_duration=0.1, log_lines=100, seed=index)
+                for index in range(num_clusters)]
+
+    result, service, timings = simulate_orchestration(tmpdir, platforms, clusters,
+                                                      max_cluster_fails=50)
+
+    list_calls = sum(cluster.list_calls for cluster in clusters)
+    print('{} platforms, {} clusters: dispatch {:.0f} ms, total {:.0f} ms, '
+          'overhead {:.0f} ms, {} list calls, peak {} threads'
+          .format(num_platforms, num_clusters, timings['dispatch'] * 1000,
+                  timings['total'] * 1000, (timings['total'] - 0.1) * 1000,
+                  list_calls, timings['peak_threads']))
+    assert not result.is_failed()
+    assert len(service.get_builds()) == num_platforms
+
+
+def test_simulation_encoded_annotations(tmpdir):
+    plugins_metadata = json.dumps({'errors': {}, 'durations': {'koji_upload': 1.0}})
+    repositories = json.dumps({'unique': ['registry/image:unique'],
+                               'primary': ['registry/image:primary']})
+    annotations, config_map_data = encode_annotations(
+        {'plugins-metadata': plugins_metadata, 'repositories': repositories},
+        compress_threshold=10, config_map_threshold=80,
+        config_map_name='worker-annotations')
+    assert config_map_data
+    clusters = [FakeCluster('worker', build_annotations=annotations,
+                            config_maps={'worker-annotations': config_map_data})]
+
+    result, _, _ = simulate_orchestration(tmpdir, ['x86_64', 'ppc64le'], clusters)
+
+    assert not result.is_failed()
+    for plat in ['x86_64', 'ppc64le']:
+        worker_annotations = result.annotations['worker-builds'][plat]
+        assert worker_annotations['plugins-metadata'] == json.loads(plugins_metadata)
+    assert result.annotations['repositories'] == json.loads(repositories)
@@ -19,8 +19,10 @@ from atomic_reactor.constants import (PLUGIN_BUILD_ORCHESTRATE_KEY,
                                       PLUGIN_CHECK_AND_SET_PLATFORMS_KEY)
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugin import PreBuildPluginsRunner, PluginFailedException
-from atomic_reactor.util import ImageName, CommandResult
+from atomic_reactor.base_image_cache import BaseImageCache
+from atomic_reactor.util import ImageName, CommandResult, ManifestDigest
 from atomic_reactor.core import DockerTasker
+from atomic_reactor.plugins.exit_remove_built_image import GarbageCollectionPlugin
 from atomic_reactor.plugins.pre_pull_base_image import PullBaseImagePlugin
 from atomic_reactor.plugins.pre_reactor_config import (ReactorConfigPlugin,
                                                        WORKSPACE_CONF_KEY,
@@ -136,7 +138,8 @@ def set_build_json(monkeypatch):
 ])
 def test_pull_base_image_plugin(parent_registry, df_base, expected, not_expected,
                                 reactor_config_map, inspect_only, workflow_callback=None,
-                                check_platforms=False, parent_images=None, organization=None):
+                                check_platforms=False, parent_images=None, organization=None,
+                                parent_pull_workers=None):
     if MOCK:
         mock_docker(remember_images=True)
 
@@ -169,15 +172,19 @@ def test_pull_base_image_plugin(parent_registry, df_base, expected, not_expected
     if workflow_callback:
         workflow = workflow_callback(workflow)
 
+    plugin_args = {'parent_registry': parent_registry,
+                   'parent_registry_insecure': True,
+                   'check_platforms': check_platforms,
+                   'inspect_only': inspect_only}
+    if parent_pull_workers:
+        plugin_args['parent_pull_workers'] = parent_pull_workers
+
     runner = PreBuildPluginsRunner(
         tasker,
         workflow,
         [{
             'name': PullBaseImagePlugin.key,
-            'args': {'parent_registry': parent_registry,
-                     'parent_registry_insecure': True,
-                     'check_platforms': check_platforms,
-                     'inspect_only': inspect_only}
+            'args': plugin_args,
         }]
     )
 
@@ -236,6 +243,104 @@ def test_pull_parent_images(organization, reactor_config_map, inspect_only):
         organization=organization)
 
 
+@pytest.mark.parametrize('parent_pull_workers', [1, 4])  # noqa
+def test_pull_parent_images_concurrently(reactor_config_map, parent_pull_workers):
+    builder_images = ['builder{}:image'.format(index) for index in range(4)]
+    parent_images = {BASE_IMAGE_NAME.copy(): None}
+    for builder_image in builder_images:
+        parent_images[ImageName.parse(builder_image)] = None
+
+    workflows = []
+
+    def workflow_callback(workflow):
+        workflows.append(workflow)
+        return workflow
+
+    test_pull_base_image_plugin(
+        LOCALHOST_REGISTRY, BASE_IMAGE,
+        [BASE_IMAGE_W_REGISTRY] + [LOCALHOST_REGISTRY + '/' + builder_image
+                                   for builder_image in builder_images],
+        [],
+        reactor_config_map=reactor_config_map,
+        inspect_only=False,
+        parent_images=parent_images,
+        parent_pull_workers=parent_pull_workers,
+        workflow_callback=workflow_callback)
+
+    # nonces follow the order of parent image names, regardless of pull order
+    builder = workflows[0].builder
+    parents = sorted(builder.parent_images, key=str)
+    assert [builder.parent_images[parent].to_str() for parent in parents] == [
+        '{}:{}'.format(UNIQUE_ID, nonce) for nonce in range(len(parents))
+    ]
+
+
+
+def test_pull_base_image_cache(tmpdir, reactor_config_map):  # noqa
+    if MOCK:
+        mock_docker(remember_images=True)
+
+    digests = {
+        'busybox': 'sha256:' + 'a' * 64,
+        'builder': 'sha256:' + 'b' * 64,
+    }
+
+    def mock_get_manifest_digests(image, registry, **kwargs):
+        return ManifestDigest(v2=digests[image.repo])
+
+    flexmock(atomic_reactor.util).should_receive('get_manifest_digests').replace_with(
+        mock_get_manifest_digests)
+    cache_dir = str(tmpdir.join('cache'))
+
+    def run_build(parent, max_entries=20):
+        tasker = DockerTasker(retry_times=0)
+        workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+        builder = workflow.builder = MockBuilder()
+        builder.base_image = builder.original_base_image = ImageName.parse(parent)
+        builder.parent_images = {ImageName.parse(parent): None}
+
+        if reactor_config_map:
+            workflow.plugin_workspace[ReactorConfigPlugin.key] = {}
+            workflow.plugin_workspace[ReactorConfigPlugin.key][WORKSPACE_CONF_KEY] =\
+                ReactorConfig({'version': 1,
+                               'source_registry': {'url': LOCALHOST_REGISTRY,
+                                                   'insecure': True}})
+
+        pulled = []
+        flexmock(tasker).should_receive('pull_image').replace_with(
+            lambda image, insecure=False: pulled.append(image.to_str()) or
+            DockerTasker.pull_image(tasker, image, insecure=insecure))
+
+        runner = PreBuildPluginsRunner(tasker, workflow, [{
+            'name': PullBaseImagePlugin.key,
+            'args': {'parent_registry': LOCALHOST_REGISTRY,
+                     'parent_registry_insecure': True,
+                     'base_image_cache_dir': cache_dir,
+                     'base_image_cache_entries': max_entries},
+        }])
+        runner.run()
+        return workflow, pulled
+
+    pinned_busybox = '{}/busybox@{}'.format(LOCALHOST_REGISTRY, digests['busybox'])
+    pinned_builder = '{}/builder@{}'.format(LOCALHOST_REGISTRY, digests['builder'])
+
+    # parent image is pulled by digest, only the unique tag is cleaned up
+    workflow, pulled = run_build(BASE_IMAGE)
+    assert pulled == [pinned_busybox]
+    assert workflow.pulled_base_images == set(['{}:0'.format(UNIQUE_ID)])
+
+    # the same digest is reused without pulling
+    workflow, pulled = run_build(BASE_IMAGE)
+    assert pulled == []
+    assert workflow.builder.base_image.to_str() == '{}:0'.format(UNIQUE_ID)
+
+    # least recently used image is evicted, but only removed if not in use
+    workflow, pulled = run_build('builder:image', max_entries=1)
+    assert pulled == [pinned_builder]
+    workspace = workflow.plugin_workspace[GarbageCollectionPlugin.key]
+    assert workspace['images_to_remove_unforced'] == set([pinned_busybox])
+    assert BaseImageCache(cache_dir).get_images() == [pinned_builder]
+
 def test_pull_base_wrong_registry(reactor_config_map, inspect_only):  # noqa
     with pytest.raises(PluginFailedException) as exc:
         test_pull_base_image_plugin(
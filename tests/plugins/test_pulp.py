@@ -130,7 +130,7 @@ def prepare(check_repo_retval=0, existing_layers=[],
      .with_args(unicode, dict))
     (flexmock(dockpulp.Pulp)
      .should_receive('crane')
-     .with_args(list, wait=True)
+     .with_args(list, wait=False)
      .and_return([2, 3, 4]))
     (flexmock(dockpulp.Pulp)
      .should_receive('')
@@ -160,7 +160,7 @@ def test_pulp_publish_success(caplog, reactor_config_map):
      .with_args(set(['redhat-image-name1',
                      'redhat-image-name3',
                      'redhat-namespace-image-name2']),
-                wait=True)
+                wait=False)
      .and_return([]))
     (flexmock(dockpulp.Pulp)
      .should_receive('watch_tasks')
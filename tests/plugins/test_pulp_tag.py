@@ -108,7 +108,7 @@ def prepare(v1_image_ids={}):
      .with_args('redhat-image-name1', {'tag': 'latest:ppc64le_v1_image_id'}))
     (flexmock(dockpulp.Pulp)
      .should_receive('crane')
-     .with_args(list, wait=True)
+     .with_args(list, wait=False)
      .and_return([2, 3, 4]))
     (flexmock(dockpulp.Pulp)
      .should_receive('')
@@ -887,6 +887,24 @@ class TestReactorConfigPlugin(object):
                   ssl_certs_dir: /var/certs
         """, False),
 
+        ("""\
+          version: 1
+          pulp:
+              name: my-pulp
+              workers: 2
+              auth:
+                  ssl_certs_dir: /var/certs
+        """, False),
+
+        ("""\
+          version: 1
+          pulp:
+              name: my-pulp
+              workers: 0
+              auth:
+                  ssl_certs_dir: /var/certs
+        """, True),
+
         ("""\
           version: 1
           pulp:
@@ -953,9 +971,11 @@ class TestReactorConfigPlugin(object):
         if fallback:
             fallback_map = {'auth': deepcopy(auth_info), 'name': config_json['pulp']['name']}
             fallback_map['auth']['ssl_certs_dir'] = fallback_map['auth'].pop('pulp_secret_path')
+            auth_info['workers'] = None
         else:
             workflow.plugin_workspace[ReactorConfigPlugin.key][WORKSPACE_CONF_KEY] =\
                 ReactorConfig(config_json)
+            auth_info['workers'] = config_json['pulp'].get('workers')
 
         (flexmock(atomic_reactor.pulp_util.PulpHandler)
             .should_receive('__init__')
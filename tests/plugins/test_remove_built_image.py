@@ -10,10 +10,11 @@ from __future__ import print_function, unicode_literals
 
 import flexmock
 import pytest
+import time
 
 from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
-from atomic_reactor.plugin import PostBuildPluginsRunner
+from atomic_reactor.plugin import ExitPluginsRunner, PostBuildPluginsRunner
 from atomic_reactor.plugins.exit_remove_built_image import (GarbageCollectionPlugin,
                                                             defer_removal)
 from atomic_reactor.plugins.post_tag_and_push import TagAndPushPlugin
@@ -83,3 +84,55 @@ class TestGarbageCollectionPlugin(object):
         image_set = set(removed_images)
         assert len(image_set) == len(removed_images)
         assert image_set == expected
+
+    def test_remove_unforced(self):
+        tasker, workflow = mock_environment()
+        runner = PostBuildPluginsRunner(
+            tasker,
+            workflow,
+            [{
+                'name': GarbageCollectionPlugin.key,
+                'args': {'remove_pulled_base_image': False},
+            }]
+        )
+        removed_images = {}
+
+        def spy_remove_image(image_id, force=None):
+            removed_images[image_id] = force
+
+        flexmock(tasker, remove_image=spy_remove_image)
+        defer_removal(workflow, 'forced')
+        defer_removal(workflow, 'cached', force=False)
+
+        runner.run()
+        assert removed_images == {INPUT_IMAGE: True, 'forced': True, 'cached': False}
+
+    def test_base_image_removed_after_built_image(self):
+        tasker, workflow = mock_environment()
+        runner = ExitPluginsRunner(
+            tasker,
+            workflow,
+            [{
+                'name': GarbageCollectionPlugin.key,
+                'args': {'remove_pulled_base_image': True},
+            }]
+        )
+        removed_images = []
+
+        def spy_remove_image(image_id, force=None):
+            if image_id == IMPORTED_IMAGE_ID:
+                # parent images can't be removed while the built image exists
+                assert INPUT_IMAGE in removed_images
+            else:
+                time.sleep(0.01)
+            removed_images.append(image_id)
+
+        flexmock(tasker, remove_image=spy_remove_image)
+        defer_removal(workflow, 'defer')
+
+        results = runner.run()
+        report = results[GarbageCollectionPlugin.key]
+        assert sorted(report['images']['removed']) == sorted([IMPORTED_IMAGE_ID, INPUT_IMAGE,
+                                                              'defer'])
+        assert report['images']['failed'] == {}
+        assert report['images']['pending'] == []
@@ -37,7 +37,7 @@ from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.source import SourceConfig
 from atomic_reactor.odcs_util import ODCSClient
 from atomic_reactor.plugin import PreBuildPluginsRunner, PluginFailedException
-from atomic_reactor.plugins import pre_check_and_set_rebuild
+from atomic_reactor.plugins import pre_check_and_set_rebuild, pre_reactor_config
 from atomic_reactor.plugins.build_orchestrate_build import (WORKSPACE_KEY_OVERRIDE_KWARGS,
                                                             OrchestrateBuildPlugin)
 from atomic_reactor.plugins.pre_reactor_config import (ReactorConfigPlugin,
@@ -51,6 +51,7 @@ from datetime import datetime, timedelta
 from flexmock import flexmock
 from tests.constants import MOCK, MOCK_SOURCE
 from tests.fixtures import reactor_config_map  # noqa
+from tests.odcs_mock import MockODCSClient
 from textwrap import dedent
 
 import logging
@@ -218,9 +219,9 @@ def mock_odcs_request():
         .and_return(ODCS_COMPOSE))
 
     (flexmock(ODCSClient)
-        .should_receive('wait_for_compose')
-        .with_args(ODCS_COMPOSE_ID)
-        .and_return(ODCS_COMPOSE))
+        .should_receive('wait_for_composes')
+        .with_args([ODCS_COMPOSE_ID])
+        .and_return([ODCS_COMPOSE]))
 
 
 def mock_koji_session():
@@ -401,6 +402,7 @@ class TestResolveComposes(object):
                                         signing_intent, expected_intent, flags, expected_flags):
         content_set = ''
         pulp_composes = {}
+        pulp_compose_ids = []
         base_repos = ['spam', 'bacon', 'eggs']
         pulp_id = ODCS_COMPOSE_ID
         arches = arches or []
@@ -438,10 +440,7 @@ class TestResolveComposes(object):
                 .with_args(source_type='pulp', source=source, arches=[arch], sigkeys=[],
                            flags=expected_flags)
                 .and_return(pulp_composes[arch]).once())
-            (flexmock(ODCSClient)
-                .should_receive('wait_for_compose')
-                .with_args(pulp_id)
-                .and_return(pulp_composes[arch]).once())
+            pulp_compose_ids.append(pulp_id)
 
         mock_content_sets_config(workflow._tmpdir, content_set)
 
@@ -481,9 +480,10 @@ class TestResolveComposes(object):
                 .and_return(tag_compose).once())
 
         (flexmock(ODCSClient)
-            .should_receive('wait_for_compose')
-            .with_args(ODCS_COMPOSE_ID)
-            .and_return(tag_compose).once())
+            .should_receive('wait_for_composes')
+            .with_args([ODCS_COMPOSE_ID] + pulp_compose_ids)
+            .and_return([tag_compose] + [pulp_composes[arch] for arch in pulp_arches or []
+                                         if arch in arches]).once())
 
         plugin_result = self.run_plugin_with_args(workflow, reactor_config_map=reactor_config_map,
                                                   platforms=arches, is_pulp=pulp_arches)
@@ -500,8 +500,8 @@ class TestResolveComposes(object):
                 sigkeys=[])
             .never())
         (flexmock(ODCSClient)
-            .should_receive('wait_for_compose')
-            .with_args(85)
+            .should_receive('wait_for_composes')
+            .with_args([ODCS_COMPOSE_ID, 85])
             .never())
 
         mock_content_sets_config(workflow._tmpdir, '')
@@ -691,10 +691,10 @@ class TestResolveComposes(object):
             .and_return(odcs_compose))
 
         (flexmock(ODCSClient)
-            .should_receive('wait_for_compose')
+            .should_receive('wait_for_composes')
             .once()
-            .with_args(odcs_compose['id'])
-            .and_return(odcs_compose))
+            .with_args([odcs_compose['id']])
+            .and_return([odcs_compose]))
 
         parent_build_info = {
             'id': 1234,
@@ -738,14 +738,14 @@ class TestResolveComposes(object):
             compose['id'] = compose_id
             compose['sigkeys'] = ' '.join(SIGNING_INTENTS[signing_intent])
 
-            (flexmock(ODCSClient)
-                .should_receive('wait_for_compose')
-                .once()
-                .with_args(compose_id)
-                .and_return(compose))
-
             composes.append(compose)
 
+        (flexmock(ODCSClient)
+            .should_receive('wait_for_composes')
+            .once()
+            .with_args([item['id'] for item in composes])
+            .and_return(composes))
+
         (flexmock(ODCSClient)
             .should_receive('start_compose')
             .never())
@@ -834,10 +834,10 @@ class TestResolveComposes(object):
             .never())
 
         (flexmock(ODCSClient)
-            .should_receive('wait_for_compose')
+            .should_receive('wait_for_composes')
             .once()
-            .with_args(old_odcs_compose['id'])
-            .and_return(old_odcs_compose))
+            .with_args([old_odcs_compose['id']])
+            .and_return([old_odcs_compose]))
 
         (flexmock(ODCSClient)
             .should_receive('renew_compose')
@@ -846,10 +846,10 @@ class TestResolveComposes(object):
             .and_return(new_odcs_compose))
 
         (flexmock(ODCSClient)
-            .should_receive('wait_for_compose')
+            .should_receive('wait_for_composes')
             .times(1 if expect_renew else 0)
-            .with_args(new_odcs_compose['id'])
-            .and_return(new_odcs_compose))
+            .with_args([new_odcs_compose['id']])
+            .and_return([new_odcs_compose]))
 
         plugin_args = {
             'compose_ids': [old_odcs_compose['id']],
@@ -869,6 +869,7 @@ class TestResolveComposes(object):
 
     def test_inject_yum_repos_from_existing_composes(self, workflow, reactor_config_map):  # noqa:F811
         compose_ids = []
+        composes = []
         expected_yum_repourls = []
 
         for compose_id in range(3):
@@ -876,15 +877,16 @@ class TestResolveComposes(object):
             compose['id'] = compose_id
             compose['result_repofile'] = ODCS_COMPOSE_REPO + '/odcs-{}.repo'.format(compose_id)
 
-            (flexmock(ODCSClient)
-                .should_receive('wait_for_compose')
-                .once()
-                .with_args(compose_id)
-                .and_return(compose))
-
             compose_ids.append(compose_id)
+            composes.append(compose)
             expected_yum_repourls.append(compose['result_repofile'])
 
+        (flexmock(ODCSClient)
+            .should_receive('wait_for_composes')
+            .once()
+            .with_args(compose_ids)
+            .and_return(composes))
+
         (flexmock(ODCSClient)
             .should_receive('start_compose')
             .never())
@@ -939,6 +941,71 @@ class TestResolveComposes(object):
 
         assert msg in (x.message for x in caplog.records())
 
+    def test_compose_index_reuses_compose(self, tmpdir, workflow):
+        odcs = MockODCSClient()
+        flexmock(pre_reactor_config).should_receive('get_odcs_session').and_return(odcs)
+        index_path = str(tmpdir.join('index', 'composes.json'))
+
+        first = self.run_plugin_with_index(workflow, index_path)
+        second = self.run_plugin_with_index(workflow, index_path)
+
+        assert len(odcs.started) == 1
+        assert odcs.renewed == []
+        assert first['composes'] == second['composes']
+
+    def test_compose_index_renews_expiring_compose(self, tmpdir, workflow):
+        odcs = MockODCSClient()
+        flexmock(pre_reactor_config).should_receive('get_odcs_session').and_return(odcs)
+        index_path = str(tmpdir.join('composes.json'))
+
+        first = self.run_plugin_with_index(workflow, index_path)
+        compose_id = first['composes'][0]['id']
+        odcs.expire_compose(compose_id, time_left=timedelta(hours=1))
+
+        second = self.run_plugin_with_index(workflow, index_path)
+
+        assert odcs.started == [compose_id]
+        assert odcs.renewed == [compose_id]
+        assert second['composes'][0]['id'] == compose_id
+        time_to_expire = datetime.strptime(second['composes'][0]['time_to_expire'],
+                                           ODCS_DATETIME_FORMAT)
+        assert time_to_expire > datetime.utcnow() + timedelta(hours=2)
+
+    def test_compose_index_different_request(self, tmpdir, workflow):
+        odcs = MockODCSClient()
+        flexmock(pre_reactor_config).should_receive('get_odcs_session').and_return(odcs)
+        index_path = str(tmpdir.join('composes.json'))
+
+        first = self.run_plugin_with_index(workflow, index_path)
+
+        mock_repo_config(workflow._tmpdir, dedent("""\
+            compose:
+                packages:
+                - spam
+                - ham
+            """))
+        workflow.source._config = None
+        second = self.run_plugin_with_index(workflow, index_path)
+
+        assert len(odcs.started) == 2
+        assert first['composes'][0]['id'] != second['composes'][0]['id']
+
+    def run_plugin_with_index(self, workflow, index_path):
+        plugin_args = {
+            'odcs_url': ODCS_URL,
+            'koji_target': KOJI_TARGET_NAME,
+            'koji_hub': KOJI_HUB,
+            'compose_index_path': index_path,
+        }
+        runner = PreBuildPluginsRunner(
+            workflow.builder.tasker,
+            workflow,
+            [
+                {'name': ResolveComposesPlugin.key, 'args': plugin_args},
+            ]
+        )
+        return runner.run()[ResolveComposesPlugin.key]
+
     def run_plugin_with_args(self, workflow, plugin_args=None,  # noqa:F811
                              expect_error=None, reactor_config_map=False,
                              platforms=ODCS_COMPOSE_DEFAULT_ARCH_LIST, is_pulp=None):
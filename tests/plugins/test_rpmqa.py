@@ -8,20 +8,25 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+import subprocess
+
 import docker
 from flexmock import flexmock
 import pytest
 
+from atomic_reactor.constants import IMAGE_TYPE_DOCKER_ARCHIVE
+from atomic_reactor.core import CleanupQueue
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugin import PostBuildPluginsRunner, PluginFailedException
 from atomic_reactor.plugins.post_rpmqa import PostBuildRPMqaPlugin
-from atomic_reactor.rpm_util import parse_rpm_output
+from atomic_reactor.rpm_util import parse_rpm_records
 from atomic_reactor.util import ImageName
 from tests.constants import DOCKERFILE_GIT
 from tests.docker_mock import mock_docker
 from tests.fixtures import docker_tasker  # noqa
 from tests.stubs import StubInsideBuilder
 from tests.test_inner import FakeLogger
+from tests.test_rpm_util import make_image_archive
 import atomic_reactor.core
 
 TEST_IMAGE = "fedora:latest"
@@ -88,7 +93,7 @@ def test_rpmqa_plugin(docker_tasker, remove_container_error, ignore_autogenerate
          ])
     results = runner.run()
     assert results[PostBuildRPMqaPlugin.key] == ignore_autogenerated["package_list"]
-    assert workflow.image_components == parse_rpm_output(ignore_autogenerated["package_list"])
+    assert workflow.image_components == parse_rpm_records(ignore_autogenerated["package_list"])
 
 
 def test_rpmqa_plugin_skip(docker_tasker):  # noqa
@@ -140,12 +145,15 @@ def test_dangling_volumes_removed(docker_tasker, request):  # noqa:F811
     mock_docker()
     workflow = DockerBuildWorkflow(SOURCE, TEST_IMAGE)
     workflow.builder = StubInsideBuilder().for_workflow(workflow)
+    # don't report removals queued by other tests
+    docker_tasker.cleanup_queue = CleanupQueue(docker_tasker)
 
     runner = PostBuildPluginsRunner(docker_tasker, workflow,
                                     [{"name": PostBuildRPMqaPlugin.key,
                                       "args": {'image_id': TEST_IMAGE}}])
 
     runner.run()
+    report = docker_tasker.cleanup_queue.flush()
 
     assert ("container_id = '%s'",
             u'f8ee920b2db5e802da2583a13a4edbf0523ca5fff6b6d6454c1fd6db5f38014d') \
@@ -158,6 +166,11 @@ def test_dangling_volumes_removed(docker_tasker, request):  # noqa:F811
     assert ("removing volume '%s'", u'real_exception') in fake_logger.infos
     assert ('ignoring a conflict when removing volume %s', 'conflict_exception') in \
         fake_logger.debugs
+    # containers and volumes are removed in the background
+    assert report['containers']['removed'] == [
+        u'f8ee920b2db5e802da2583a13a4edbf0523ca5fff6b6d6454c1fd6db5f38014d']
+    assert sorted(report['volumes']['removed']) == [u'conflict_exception', u'test']
+    assert list(report['volumes']['failed']) == [u'real_exception']
 
 
 def test_empty_logs_retry(docker_tasker):  # noqa
@@ -171,7 +184,7 @@ def test_empty_logs_retry(docker_tasker):  # noqa
                                       "args": {'image_id': TEST_IMAGE}}])
     results = runner.run()
     assert results[PostBuildRPMqaPlugin.key] == PACKAGE_LIST
-    assert workflow.image_components == parse_rpm_output(PACKAGE_LIST)
+    assert workflow.image_components == parse_rpm_records(PACKAGE_LIST)
 
 
 def test_empty_logs_failure(docker_tasker):  # noqa
@@ -186,3 +199,69 @@ def test_empty_logs_failure(docker_tasker):  # noqa
     with pytest.raises(PluginFailedException) as exc_info:
         runner.run()
     assert 'Unable to gather list of installed packages in container' in str(exc_info.value)
+
+
+def iter_chunks(data, chunk_size=1000):
+    """
+    Mimic docker-py 3 APIClient.get_image(), which returns a generator of chunks
+    """
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+
+@pytest.mark.parametrize('exported', [True, False])
+def test_rpmqa_offline_rpmdb(tmpdir, docker_tasker, exported):  # noqa
+    mock_docker()
+    workflow = DockerBuildWorkflow(SOURCE, TEST_IMAGE)
+    # stub source: subprocess is mocked, so the git source can't be cloned
+    workflow.builder = StubInsideBuilder().set_image(workflow.image)
+
+    archive = make_image_archive([[('var/lib/rpm/Packages', b'rpmdb')]])
+    if exported:
+        image_path = tmpdir.join('image.tar')
+        image_path.write(archive.getvalue(), mode='wb')
+        workflow.exported_image_sequence.append({'path': str(image_path),
+                                                 'type': IMAGE_TYPE_DOCKER_ARCHIVE})
+        flexmock(docker.APIClient).should_receive('get_image').never()
+    else:
+        flexmock(docker.APIClient).should_receive('get_image').and_return(
+            iter_chunks(archive.getvalue()))
+
+    def check_output(cmd):
+        assert cmd[:2] == ['rpm', '--dbpath']
+        with open(cmd[2] + '/Packages', 'rb') as f:
+            assert f.read() == b'rpmdb'
+        return b"\n".join(PACKAGE_LIST_WITH_AUTOGENERATED_B)
+
+    flexmock(subprocess, check_output=check_output)
+    flexmock(docker_tasker).should_receive('run').never()
+
+    runner = PostBuildPluginsRunner(docker_tasker, workflow,
+                                    [{"name": PostBuildRPMqaPlugin.key,
+                                      "args": {'image_id': TEST_IMAGE,
+                                               'offline_rpmdb': True}}])
+    results = runner.run()
+    assert results[PostBuildRPMqaPlugin.key] == PACKAGE_LIST
+    assert workflow.image_components == parse_rpm_records(PACKAGE_LIST)
+
+
+def test_rpmqa_offline_rpmdb_fallback(docker_tasker):  # noqa
+    mock_docker()
+    workflow = DockerBuildWorkflow(SOURCE, TEST_IMAGE)
+    # stub source: subprocess is mocked, so the git source can't be cloned
+    workflow.builder = StubInsideBuilder().set_image(workflow.image)
+
+    # rpm is not available on the host
+    archive = make_image_archive([[('var/lib/rpm/Packages', b'rpmdb')]])
+    flexmock(docker.APIClient).should_receive('get_image').and_return(
+        iter_chunks(archive.getvalue()))
+    flexmock(subprocess).should_receive('check_output').and_raise(OSError)
+    flexmock(docker.APIClient, logs=mock_logs)
+
+    runner = PostBuildPluginsRunner(docker_tasker, workflow,
+                                    [{"name": PostBuildRPMqaPlugin.key,
+                                      "args": {'image_id': TEST_IMAGE,
+                                               'offline_rpmdb': True}}])
+    results = runner.run()
+    assert results[PostBuildRPMqaPlugin.key] == PACKAGE_LIST
+    assert workflow.image_components == parse_rpm_records(PACKAGE_LIST)
@@ -24,13 +24,16 @@ from atomic_reactor.constants import (PLUGIN_KOJI_IMPORT_PLUGIN_KEY,
                                       PLUGIN_PULP_PUSH_KEY,
                                       PLUGIN_VERIFY_MEDIA_KEY,
                                       PLUGIN_ADD_FILESYSTEM_KEY,
-                                      PLUGIN_GROUP_MANIFESTS_KEY)
+                                      PLUGIN_GROUP_MANIFESTS_KEY,
+                                      PLUGIN_COMPARE_COMPONENTS_KEY)
+from atomic_reactor.annotations import decode_annotations
 from atomic_reactor.build import BuildResult
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugin import ExitPluginsRunner, PluginFailedException
 from atomic_reactor.plugins.pre_add_help import AddHelpPlugin
 from atomic_reactor.plugins.post_rpmqa import PostBuildRPMqaPlugin
 from atomic_reactor.plugins.post_pulp_pull import PulpPullPlugin
+from atomic_reactor.plugins.build_docker_api import DockerApiPlugin
 from atomic_reactor.plugins.build_orchestrate_build import OrchestrateBuildPlugin
 from atomic_reactor.plugins.exit_store_metadata_in_osv3 import StoreMetadataInOSv3Plugin
 from atomic_reactor.plugins.pre_reactor_config import (ReactorConfigPlugin,
@@ -40,6 +43,7 @@ from atomic_reactor.util import ImageName, LazyGit, ManifestDigest, df_parser
 import pytest
 from tests.constants import (LOCALHOST_REGISTRY, DOCKER0_REGISTRY, TEST_IMAGE, TEST_IMAGE_NAME,
                              INPUT_IMAGE)
+from tests.osbs_mock import FakeConfigMap
 from tests.util import is_string_type
 from tests.fixtures import reactor_config_map  # noqa
 
@@ -591,6 +595,100 @@ def test_exit_before_dockerfile_created(tmpdir, reactor_config_map):  # noqa
     assert annotations["dockerfile"] == ""
 
 
+def test_component_comparison_metadata(tmpdir, reactor_config_map):  # noqa
+    workflow = prepare(before_dockerfile=True, reactor_config_map=reactor_config_map)
+    workflow.exit_results = {}
+    workflow.builder = XBeforeDockerfile()
+    workflow.builder.df_dir = str(tmpdir)
+    report = {'platforms': ['x86_64'], 'compared': 0, 'ignored': [], 'missing': {},
+              'mismatches': [], 'unsupported': []}
+    workflow.plugin_workspace[PLUGIN_COMPARE_COMPONENTS_KEY] = {'report': report}
+
+    runner = ExitPluginsRunner(
+        None,
+        workflow,
+        [{
+            'name': StoreMetadataInOSv3Plugin.key,
+            "args": {
+                "url": "http://example.com/"
+            }
+        }]
+    )
+    output = runner.run()
+    annotations = output[StoreMetadataInOSv3Plugin.key]["annotations"]
+    plugins_metadata = json.loads(annotations["plugins-metadata"])
+    assert plugins_metadata["component_comparison"] == report
+
+
+def test_build_context_metadata(tmpdir, reactor_config_map):  # noqa
+    workflow = prepare(before_dockerfile=True, reactor_config_map=reactor_config_map)
+    workflow.exit_results = {}
+    workflow.builder = XBeforeDockerfile()
+    workflow.builder.df_dir = str(tmpdir)
+    context_info = {'size': 10240, 'tar_time': 0.5, 'cached': False}
+    workflow.plugin_workspace[DockerApiPlugin.key] = {'build_context': context_info}
+
+    runner = ExitPluginsRunner(
+        None,
+        workflow,
+        [{
+            'name': StoreMetadataInOSv3Plugin.key,
+            "args": {
+                "url": "http://example.com/"
+            }
+        }]
+    )
+    output = runner.run()
+    annotations = output[StoreMetadataInOSv3Plugin.key]["annotations"]
+    plugins_metadata = json.loads(annotations["plugins-metadata"])
+    assert plugins_metadata["build_context"] == context_info
+
+
+@pytest.mark.parametrize('config_map_threshold', (None, 100))
+def test_store_metadata_encoded_annotations(tmpdir, config_map_threshold,
+                                            reactor_config_map):  # noqa
+    workflow = prepare(before_dockerfile=True, reactor_config_map=reactor_config_map)
+    workflow.exit_results = {}
+    workflow.builder = XBeforeDockerfile()
+    workflow.builder.df_dir = str(tmpdir)
+
+    config_maps = {}
+
+    def create_config_map(name, data):
+        config_maps[name] = data
+
+    flexmock(OSBS, create_config_map=create_config_map)
+
+    runner = ExitPluginsRunner(
+        None,
+        workflow,
+        [{
+            'name': StoreMetadataInOSv3Plugin.key,
+            "args": {
+                "url": "http://example.com/",
+                "compress_threshold": 10,
+                "config_map_threshold": config_map_threshold,
+            }
+        }]
+    )
+    output = runner.run()
+    annotations = output[StoreMetadataInOSv3Plugin.key]["annotations"]
+
+    # values which are not JSON documents are left alone
+    assert annotations["base-image-name"] == ""
+    if config_map_threshold:
+        assert list(config_maps) == ['asd-annotations']
+        assert annotations["plugins-metadata"] == 'configmap:asd-annotations:plugins-metadata'
+    else:
+        assert not config_maps
+        assert annotations["plugins-metadata"].startswith('gzip+base64:')
+
+    osbs = flexmock(get_config_map=lambda name: FakeConfigMap(config_maps[name]))
+    decoded = decode_annotations(annotations, osbs)
+    assert "durations" in json.loads(decoded["plugins-metadata"])
+    assert json.loads(decoded["repositories"])["primary"]
+
+
 def test_store_metadata_fail_update_annotations(tmpdir, caplog, reactor_config_map):  # noqa
     workflow = prepare(reactor_config_map=reactor_config_map)
     workflow.exit_results = {}
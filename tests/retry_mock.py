@@ -14,5 +14,5 @@ from atomic_reactor import util
 
 def mock_get_retry_session():
     (flexmock(util)
-        .should_receive('_http_retries_disabled')
+        .should_receive('http_retries_disabled')
         .and_return(True))
@@ -0,0 +1,83 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import json
+
+import pytest
+from flexmock import flexmock
+
+from atomic_reactor.annotations import (AnnotationDecoder, compress_annotation,
+                                        decode_annotations, encode_annotations)
+from tests.osbs_mock import FakeConfigMap
+
+
+def make_annotations():
+    return {
+        'dockerfile': 'FROM fedora\n' * 100,
+        'repositories': json.dumps({'primary': ['registry/image:{}'.format(index)
+                                                for index in range(100)]}),
+        'digests': json.dumps([]),
+    }
+
+
+def test_compress_annotation():
+    value = make_annotations()['repositories']
+    compressed = compress_annotation(value)
+    assert compressed.startswith('gzip+base64:')
+    assert len(compressed) < len(value)
+    assert compress_annotation(value) == compressed
+    assert AnnotationDecoder().decode(compressed) == value
+
+
+def test_encode_annotations():
+    annotations = make_annotations()
+    encoded, config_map_data = encode_annotations(annotations, compress_threshold=10)
+
+    assert not config_map_data
+    assert encoded['repositories'].startswith('gzip+base64:')
+    # short values and values which are not JSON documents are left alone
+    assert encoded['digests'] == annotations['digests']
+    assert encoded['dockerfile'] == annotations['dockerfile']
+    assert decode_annotations(encoded) == annotations
+
+
+@pytest.mark.parametrize('compress_threshold', [None, 10])
+def test_encode_annotations_config_map(compress_threshold):
+    annotations = make_annotations()
+    encoded, config_map_data = encode_annotations(annotations,
+                                                  compress_threshold=compress_threshold,
+                                                  config_map_threshold=100,
+                                                  config_map_name='build-1-annotations')
+
+    assert encoded['repositories'] == 'configmap:build-1-annotations:repositories'
+    assert list(config_map_data) == ['repositories']
+
+    osbs = flexmock()
+    (osbs.should_receive('get_config_map')
+        .with_args('build-1-annotations')
+        .once()
+        .and_return(FakeConfigMap(config_map_data)))
+    decoder = AnnotationDecoder(osbs)
+    assert decoder.decode_annotations(encoded) == annotations
+    assert json.loads(annotations['repositories']) == decoder.load(encoded['repositories'])
+    assert list(decoder.config_maps) == ['build-1-annotations']
+
+
+def test_encode_annotations_config_map_no_name():
+    with pytest.raises(ValueError):
+        encode_annotations(make_annotations(), config_map_threshold=100)
+
+
+def test_decode_annotations_config_map_no_session():
+    encoded, _ = encode_annotations(make_annotations(), config_map_threshold=100,
+                                    config_map_name='build-1-annotations')
+    with pytest.raises(ValueError) as exc:
+        decode_annotations(encoded)
+    assert 'build-1-annotations' in str(exc.value)
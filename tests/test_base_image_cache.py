@@ -0,0 +1,55 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import time
+
+from flexmock import flexmock
+
+from atomic_reactor.base_image_cache import BaseImageCache
+
+
+IMAGES = ['registry.example.com/image{}@sha256:{}'.format(index, str(index) * 64)
+          for index in range(4)]
+
+
+def test_base_image_cache_record(tmpdir):
+    cache = BaseImageCache(str(tmpdir.join('cache')), max_entries=2)
+    # use distinct timestamps to make order of entries predictable
+    flexmock(time).should_receive('time').and_return(1).and_return(2).and_return(3)
+
+    assert cache.record(IMAGES[0]) == []
+    assert cache.record(IMAGES[1]) == []
+    assert cache.record(IMAGES[2]) == [IMAGES[0]]
+    assert cache.get_images() == [IMAGES[2], IMAGES[1]]
+
+
+def test_base_image_cache_keep(tmpdir):
+    cache = BaseImageCache(str(tmpdir.join('cache')), max_entries=1)
+    flexmock(time).should_receive('time').and_return(1).and_return(2).and_return(3)
+
+    cache.record(IMAGES[0])
+    assert cache.record(IMAGES[1], keep=[IMAGES[0]]) == []
+    assert cache.record(IMAGES[2], keep=[IMAGES[1]]) == [IMAGES[0]]
+    assert sorted(cache.get_images()) == [IMAGES[1], IMAGES[2]]
+
+
+def test_base_image_cache_shared(tmpdir):
+    path = str(tmpdir.join('cache'))
+    BaseImageCache(path).record(IMAGES[0])
+    assert BaseImageCache(path).get_images() == [IMAGES[0]]
+
+
+def test_base_image_cache_corrupted(tmpdir):
+    cache = BaseImageCache(str(tmpdir))
+    tmpdir.join(BaseImageCache.INDEX_FILE).write('{')
+
+    assert cache.get_images() == []
+    cache.record(IMAGES[0])
+    assert cache.get_images() == [IMAGES[0]]
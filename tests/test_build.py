@@ -167,6 +167,28 @@ def test_get_base_image_info(tmpdir, source_params, image, will_raise):
         assert built_inspect["RepoTags"] is not None
 
 
+@pytest.mark.parametrize('base', [True, False])
+def test_get_image_info_format(tmpdir, base):
+    """Callers get image info in the format of `docker images`"""
+    if MOCK:
+        mock_docker()
+
+    source = {'provider': 'path', 'uri': 'file://' + DOCKERFILE_OK_PATH, 'tmpdir': str(tmpdir)}
+    b = InsideBuilder(get_source_instance_for(source), 'built-img')
+    name = (b.base_image if base else b.image).to_str(explicit_tag=True)
+    (flexmock(docker.APIClient)
+        .should_receive('inspect_image')
+        .with_args(name)
+        .and_return({'Id': 'sha256:123', 'RepoTags': [name], 'Parent': '',
+                     'Created': '2015-04-29T07:25:10.123456789Z'}))
+
+    info = b.get_base_image_info() if base else b.get_built_image_info()
+    assert info['Id'] == 'sha256:123'
+    assert info['ParentId'] == ''
+    assert info['RepoTags'] == [name]
+    assert info['Created'] == 1430292310
+
+
 def test_no_base_image(tmpdir):
     if MOCK:
         mock_docker()
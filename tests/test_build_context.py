@@ -0,0 +1,121 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import os
+import tarfile
+
+from atomic_reactor.build_context import BuildContext, read_dockerignore
+
+
+def make_context(tmpdir):
+    context = tmpdir.join('context')
+    context.ensure('Dockerfile').write('FROM fedora\n')
+    context.ensure('app', 'main.py').write('print("hello")\n')
+    context.ensure('vendor', 'big.bin').write('x' * 1024)
+    context.join('.dockerignore').write('# comment\n\nvendor\n')
+    return context
+
+
+def archive_members(archive):
+    with tarfile.open(archive) as tar:
+        return sorted(tar.getnames())
+
+
+def test_read_dockerignore(tmpdir):
+    context = make_context(tmpdir)
+    assert read_dockerignore(str(context)) == ['vendor']
+    assert read_dockerignore(str(tmpdir)) is None
+
+
+def test_build_context(tmpdir):
+    context = make_context(tmpdir)
+
+    with BuildContext(str(context)) as build_context:
+        archive = build_context.archive
+        assert archive_members(archive) == ['.dockerignore', 'Dockerfile', 'app', 'app/main.py']
+        assert build_context.size == os.path.getsize(archive)
+        assert not build_context.cached
+
+    assert not os.path.exists(archive)
+
+
+def test_build_context_cache(tmpdir):
+    context = make_context(tmpdir)
+    cache_dir = str(tmpdir.join('cache'))
+
+    with BuildContext(str(context), cache_dir=cache_dir) as build_context:
+        first_archive = build_context.archive
+        assert not build_context.cached
+
+    # ignored files do not change the digest
+    context.join('vendor', 'big.bin').write('y')
+    with BuildContext(str(context), cache_dir=cache_dir) as build_context:
+        assert build_context.archive == first_archive
+        assert build_context.cached
+        assert build_context.tar_time == 0
+
+    assert os.path.exists(first_archive)
+
+    context.join('app', 'main.py').write('print("bye")\n')
+    with BuildContext(str(context), cache_dir=cache_dir) as build_context:
+        second_archive = build_context.archive
+        assert second_archive != first_archive
+        assert not build_context.cached
+
+    # mtimes are not stored in cached archives
+    os.utime(str(context.join('app', 'main.py')), (0, 0))
+    with BuildContext(str(context), cache_dir=cache_dir) as build_context:
+        assert build_context.archive == second_archive
+        assert build_context.cached
+        assert build_context.get_info() == {'size': build_context.size,
+                                            'tar_time': 0,
+                                            'cached': True}
+
+
+def test_build_context_cache_identical(tmpdir):
+    first = make_context(tmpdir.mkdir('first'))
+    second = make_context(tmpdir.mkdir('second'))
+    os.utime(str(second.join('app', 'main.py')), (12345, 12345))
+    os.link(str(second.join('Dockerfile')), str(second.join('Dockerfile.link')))
+    first.join('Dockerfile.link').write('FROM fedora\n')
+
+    digests = []
+    archives = []
+    for context in (first, second):
+        cache_dir = str(context.join('..', 'cache'))
+        with BuildContext(str(context), cache_dir=cache_dir) as build_context:
+            digests.append(build_context.digest)
+            with open(build_context.archive, 'rb') as f:
+                archives.append(f.read())
+            assert not build_context.cached
+
+    assert digests[0] == digests[1]
+    assert archives[0] == archives[1]
+    with tarfile.open(fileobj=io.BytesIO(archives[1])) as tar:
+        info = tar.getmember('Dockerfile.link')
+        assert info.isfile()
+        assert info.mtime == 0
+
+
+def test_build_context_cache_pruned(tmpdir):
+    context = make_context(tmpdir)
+    cache_dir = str(tmpdir.join('cache'))
+
+    archives = []
+    for index in range(3):
+        context.join('Dockerfile').write('FROM fedora:{}\n'.format(index))
+        with BuildContext(str(context), cache_dir=cache_dir, max_cached=2) as build_context:
+            archives.append(build_context.archive)
+        # use distinct timestamps to make order of archives predictable
+        os.utime(archives[-1], (index, index))
+
+    assert sorted(os.listdir(cache_dir)) == sorted(os.path.basename(archive)
+                                                   for archive in archives[1:])
@@ -0,0 +1,223 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import errno
+import hashlib
+import os
+import threading
+import time
+
+import pytest
+import responses
+from flexmock import flexmock
+from requests.exceptions import ConnectionError
+
+from atomic_reactor import util
+from atomic_reactor.download import (DownloadCache, FileDownload, ParallelDownloader,
+                                     DOWNLOADED_FILE_MODE)
+
+
+def make_download(tmpdir, name, content, host='https://example.com', retries=None):
+    url = '{}/{}'.format(host, name)
+    responses.add(responses.GET, url, body=content)
+    checksums = {'md5': hashlib.md5(content.encode('utf-8')).hexdigest()}
+    return FileDownload(url, str(tmpdir.join('artifacts', name)), checksums, retries)
+
+
+@responses.activate
+@pytest.mark.parametrize('workers', (1, 3, 10))
+def test_download_all(tmpdir, workers):
+    downloads = [
+        make_download(tmpdir, 'file{}.jar'.format(index), 'content{}'.format(index),
+                      host='https://host{}.com'.format(index % 2))
+        for index in range(5)
+    ]
+
+    ParallelDownloader(workers=workers, connections_per_host=2).download_all(downloads)
+
+    for index, download in enumerate(downloads):
+        with open(download.dest) as f:
+            assert f.read() == 'content{}'.format(index)
+        assert os.stat(download.dest).st_mode & 0o777 == DOWNLOADED_FILE_MODE
+
+    # No temporary files are left behind
+    assert sorted(os.listdir(str(tmpdir.join('artifacts')))) == sorted(
+        os.path.basename(download.dest) for download in downloads)
+
+
+@responses.activate
+def test_download_bad_checksum(tmpdir):
+    download = make_download(tmpdir, 'file.jar', 'content')
+    download = download._replace(checksums={'md5': 'a' * 32})
+
+    with pytest.raises(ValueError) as exc_info:
+        ParallelDownloader().download_all([download])
+
+    assert 'does not match expected checksum' in str(exc_info.value)
+    assert os.listdir(str(tmpdir.join('artifacts'))) == []
+
+
+@responses.activate
+def test_download_http_error(tmpdir):
+    url = 'https://example.com/missing.jar'
+    responses.add(responses.GET, url, status=404)
+    download = FileDownload(url, str(tmpdir.join('missing.jar')), {})
+
+    with pytest.raises(Exception) as exc_info:
+        ParallelDownloader().download_all([download])
+
+    assert '404 Client Error' in str(exc_info.value)
+    assert not os.path.exists(download.dest)
+
+
+@responses.activate
+@pytest.mark.parametrize(('retries', 'succeeds'), (
+    (None, True),
+    (1, True),
+    (0, False),
+))
+def test_download_retries(tmpdir, retries, succeeds):
+    url = 'https://example.com/file.jar'
+    responses.add(responses.GET, url, body=ConnectionError('connection reset'))
+    download = make_download(tmpdir, 'file.jar', 'content', retries=retries)
+    flexmock(time).should_receive('sleep')
+
+    downloader = ParallelDownloader(retries=2)
+    if succeeds:
+        downloader.download(download)
+        with open(download.dest) as f:
+            assert f.read() == 'content'
+    else:
+        with pytest.raises(ConnectionError):
+            downloader.download(download)
+        assert not os.path.exists(download.dest)
+
+
+@responses.activate
+def test_download_cache(tmpdir):
+    cache = DownloadCache(str(tmpdir.join('cache')))
+    downloader = ParallelDownloader(cache=cache)
+    download = make_download(tmpdir.join('build1'), 'file.jar', 'content')
+
+    downloader.download_all([download])
+    assert len(responses.calls) == 1
+    assert cache.get_stats() == {'hits': 0, 'misses': 1, 'hit_ratio': 0.0}
+
+    download = download._replace(dest=str(tmpdir.join('build2', 'artifacts', 'file.jar')))
+    downloader.download_all([download])
+    assert len(responses.calls) == 1
+    assert cache.get_stats() == {'hits': 1, 'misses': 1, 'hit_ratio': 0.5}
+    with open(download.dest) as f:
+        assert f.read() == 'content'
+
+
+def test_download_cache_eviction(tmpdir):
+    cache = DownloadCache(str(tmpdir.join('cache')), max_size=10)
+    checksums = []
+    for index in range(3):
+        content = '{}'.format(index) * 4
+        path = tmpdir.join('file{}'.format(index))
+        path.write(content)
+        checksums.append({'sha256': hashlib.sha256(content.encode('utf-8')).hexdigest()})
+        cache.store(checksums[-1], str(path))
+        # use distinct timestamps to make order of entries predictable
+        os.utime(cache._entry_path(checksums[-1]), (index, index))
+
+    # The oldest entry is used, so it's evicted last
+    assert cache.fetch(checksums[0], str(tmpdir.join('fetched')))
+    cache.evict()
+
+    assert os.path.exists(cache._entry_path(checksums[0]))
+    assert not os.path.exists(cache._entry_path(checksums[1]))
+    assert os.path.exists(cache._entry_path(checksums[2]))
+
+
+def test_download_cache_unknown_checksum(tmpdir):
+    cache = DownloadCache(str(tmpdir.join('cache')))
+    path = tmpdir.join('file')
+    path.write('content')
+
+    cache.store({'sha512': 'a' * 128}, str(path))
+
+    assert not cache.fetch({'sha512': 'a' * 128}, str(tmpdir.join('fetched')))
+    assert not tmpdir.join('cache').check()
+
+
+def test_download_cache_store_not_linked(tmpdir):
+    cache = DownloadCache(str(tmpdir.join('cache')))
+    path = tmpdir.join('file')
+    path.write('content')
+    checksums = {'sha256': hashlib.sha256(b'content').hexdigest()}
+    # no copy-on-write clones, the file must be copied
+    flexmock(util.fcntl).should_receive('ioctl').and_raise(IOError)
+
+    cache.store(checksums, str(path))
+
+    entry = cache._entry_path(checksums)
+    assert not os.path.samestat(os.stat(entry), os.stat(str(path)))
+    path.write('modified')
+    with open(entry) as f:
+        assert f.read() == 'content'
+
+
+def test_download_cache_store_concurrent(tmpdir):
+    cache = DownloadCache(str(tmpdir.join('cache')))
+    path = tmpdir.join('file')
+    path.write('content')
+    checksums = {'sha256': hashlib.sha256(b'content').hexdigest()}
+
+    threads = [threading.Thread(target=cache.store, args=(checksums, str(path)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    entry = cache._entry_path(checksums)
+    with open(entry) as f:
+        assert f.read() == 'content'
+    assert os.listdir(os.path.dirname(entry)) == [os.path.basename(entry)]
+
+
+def test_download_cache_fetch_modified(tmpdir):
+    cache = DownloadCache(str(tmpdir.join('cache')))
+    path = tmpdir.join('file')
+    path.write('content')
+    checksums = {'sha256': hashlib.sha256(b'content').hexdigest()}
+    cache.store(checksums, str(path))
+
+    fetched = tmpdir.join('fetched')
+    assert cache.fetch(checksums, str(fetched))
+    # modified in place, e.g. through a hard link
+    with open(cache._entry_path(checksums), 'w') as f:
+        f.write('modified')
+
+    assert not cache.fetch(checksums, str(tmpdir.join('fetched-again')))
+    assert not os.path.exists(cache._entry_path(checksums))
+    assert not tmpdir.join('fetched-again').check()
+    assert cache.get_stats()['misses'] == 1
+
+
+def test_download_cache_fetch_evicted(tmpdir):
+    cache = DownloadCache(str(tmpdir.join('cache')))
+    path = tmpdir.join('file')
+    path.write('content')
+    checksums = {'sha256': hashlib.sha256(b'content').hexdigest()}
+    cache.store(checksums, str(path))
+
+    # entry removed by evict() after it was looked up
+    def clone_file(src, dest, hardlink=True):
+        os.unlink(src)
+        raise OSError(errno.ENOENT, 'No such file or directory')
+
+    flexmock(util, clone_file=clone_file)
+    assert not cache.fetch(checksums, str(tmpdir.join('fetched')))
+    assert not tmpdir.join('fetched').check()
+    assert cache.get_stats()['misses'] == 1
@@ -34,7 +34,9 @@ import signal
 from atomic_reactor.inner import BuildResults, BuildResultsEncoder, BuildResultsJSONDecoder
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.inner import FSWatcher
-from atomic_reactor.constants import INSPECT_ROOTFS, INSPECT_ROOTFS_LAYERS
+from atomic_reactor.constants import (INSPECT_ROOTFS, INSPECT_ROOTFS_LAYERS,
+                                      FINAL_CLEANUP_TIMEOUT)
+from atomic_reactor.core import CleanupQueue
 
 
 BUILD_RESULTS_ATTRS = ['build_logs',
@@ -1040,6 +1042,43 @@ def test_source_not_removed_for_exit_plugins():
     assert watch_exit.was_called()
 
 
+def test_workflow_waits_for_cleanup():
+    """
+    Removals queued by plugins finish before the build ends, also
+    when remove_built_image doesn't run
+    """
+    flexmock(DockerfileParser, content='df_content')
+    this_file = inspect.getfile(PreWatched)
+    mock_docker()
+    fake_builder = MockInsideBuilder()
+    removed = []
+
+    def remove_image(image_id, force=False):
+        time.sleep(0.1)
+        removed.append(image_id)
+
+    fake_builder.tasker.remove_image = remove_image
+    fake_builder.tasker.cleanup_queue = CleanupQueue(fake_builder.tasker)
+    flexmock(InsideBuilder).new_instances(fake_builder)
+    watch_buildstep = Watcher()
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image',
+                                   buildstep_plugins=[{'name': 'buildstep_watched',
+                                                       'args': {
+                                                           'watcher': watch_buildstep,
+                                                       }}],
+                                   plugin_files=[this_file])
+
+    fake_builder.tasker.cleanup_queue.remove_image('leftover')
+    (flexmock(CleanupQueue)
+        .should_call('flush')
+        .with_args(timeout=FINAL_CLEANUP_TIMEOUT)
+        .once())
+
+    workflow.build_docker_image()
+
+    assert removed == ['leftover']
+
+
 class ValueMixIn(object):
 
     def __init__(self, tasker, workflow, *args, **kwargs):
@@ -0,0 +1,126 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import subprocess
+
+from flexmock import flexmock
+from osbs.exceptions import OsbsException
+
+import atomic_reactor.koji_metadata
+from atomic_reactor.inner import DockerBuildWorkflow
+from atomic_reactor.koji_metadata import (BUILDROOT_RPM_TAGS, KojiMetadataBuilder,
+                                          add_buildroot_id, add_log_type)
+from atomic_reactor.rpm_util import parse_rpm_records
+from atomic_reactor.util import Output
+from tests.constants import MOCK_SOURCE, TEST_IMAGE
+
+
+RPM_OUTPUT = '\n'.join([
+    'python;2.7;1;x86_64;(none);01234567;(none);(none)',
+    'bash;4.4;2;x86_64;0;76543210;(none);(none)',
+])
+
+
+def make_builder(osbs=None, tasker=None):
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, TEST_IMAGE)
+    return KojiMetadataBuilder(workflow, tasker, osbs, 'build-1')
+
+
+def test_get_buildroot_once(monkeypatch):
+    monkeypatch.delenv('OPENSHIFT_CUSTOM_BUILD_BASE_IMAGE', raising=False)
+    (flexmock(subprocess)
+        .should_receive('getstatusoutput')
+        .once()
+        .and_return((0, RPM_OUTPUT)))
+    tasker = flexmock()
+    (tasker.should_receive('get_info')
+        .once()
+        .and_return({'OperatingSystem': 'Fedora'}))
+    (tasker.should_receive('get_version')
+        .once()
+        .and_return({'Arch': 'amd64', 'Version': '1.13.1'}))
+    builder = make_builder(tasker=tasker)
+
+    buildroot = builder.get_buildroot()
+    assert buildroot['host'] == {'os': 'Fedora', 'arch': 'x86_64'}
+    assert {'name': 'docker', 'version': '1.13.1'} in buildroot['tools']
+    assert [rpm['name'] for rpm in buildroot['components']] == ['python', 'bash']
+    assert buildroot['extra']['osbs'] == {'build_id': 'build-1', 'builder_image_id': ''}
+
+    # callers get their own copy
+    buildroot['id'] = 'x86_64-1'
+    buildroot['components'].pop()
+    again = builder.get_buildroot()
+    assert again['id'] == 1
+    assert len(again['components']) == 2
+
+
+def test_get_builder_image_id(monkeypatch):
+    monkeypatch.setenv('OPENSHIFT_CUSTOM_BUILD_BASE_IMAGE', 'buildroot:latest')
+    pod = flexmock(get_container_image_ids=lambda: {'buildroot:latest': 'sha256:1234'})
+    osbs = flexmock()
+    osbs.should_receive('get_pod_for_build').with_args('build-1').and_return(pod)
+    assert make_builder(osbs).get_builder_image_id() == 'sha256:1234'
+
+    osbs.should_receive('get_pod_for_build').and_raise(OsbsException)
+    assert make_builder(osbs).get_builder_image_id() == 'buildroot:latest'
+
+
+def test_get_output_metadata(tmpdir):
+    builder = make_builder()
+    log = tmpdir.join('build.log')
+    log.write('build log\n')
+    image = tmpdir.join('image.tar')
+    image.write('image')
+    builder.workflow.exported_image_sequence.append({'path': str(image), 'size': 5,
+                                                     'md5sum': 'exported-md5'})
+
+    (flexmock(atomic_reactor.koji_metadata)
+        .should_receive('get_checksums')
+        .with_args(str(log), ['md5'])
+        .once()
+        .and_return({'md5sum': 'log-md5'}))
+
+    assert builder.get_output_metadata(str(log), 'x86_64-build.log') == {
+        'filename': 'x86_64-build.log',
+        'filesize': os.path.getsize(str(log)),
+        'checksum': 'log-md5',
+        'checksum_type': 'md5',
+    }
+    # checksums are computed once per file
+    assert builder.get_output_metadata(str(log), 'build.log')['checksum'] == 'log-md5'
+    # the exported image was hashed when it was saved
+    metadata = builder.get_output_metadata(str(image), 'docker-image.tar', metadata_only=True)
+    assert metadata['checksum'] == 'exported-md5'
+    assert metadata['metadata_only']
+
+
+def test_get_image_components():
+    builder = make_builder()
+    assert builder.get_image_components() == []
+
+    builder.workflow.image_components = parse_rpm_records([RPM_OUTPUT.splitlines()[1]],
+                                                          BUILDROOT_RPM_TAGS)
+    assert builder.get_image_components() == [{
+        'type': 'rpm',
+        'name': 'bash',
+        'version': '4.4',
+        'release': '2',
+        'arch': 'x86_64',
+        'epoch': 0,
+        'sigmd5': '76543210',
+        'signature': None,
+    }]
+
+
+def test_add_log_type():
+    output = add_log_type(add_buildroot_id(Output(file=None, metadata={}), 1), 'x86_64')
+    assert output.metadata == {'buildroot_id': 1, 'type': 'log', 'arch': 'x86_64'}
@@ -30,7 +30,8 @@ except ImportError:
 
 from atomic_reactor.koji_util import (koji_login, create_koji_session,
                                       TaskWatcher, tag_koji_build,
-                                      get_koji_module_build)
+                                      get_koji_module_build, koji_multicall,
+                                      KojiSessionWrapper)
 from atomic_reactor import koji_util
 from atomic_reactor.plugin import BuildCanceledException
 from atomic_reactor.constants import HTTP_MAX_RETRIES
@@ -197,6 +198,43 @@ class TestStreamTaskOutput(object):
         assert ''.join(list(streamer)) == contents
 
 
+class TestKojiMulticall(object):
+    CALLS = [
+        ('getBuild', ('foo-1.0-1',), {}),
+        ('listArchives', (), {'buildID': 1, 'type': 'maven'}),
+    ]
+
+    def test_multicall(self):
+        session = flexmock(multicall=False)
+        session.should_receive('getBuild').with_args('foo-1.0-1').once()
+        session.should_receive('listArchives').with_args(buildID=1, type='maven').once()
+        (session
+            .should_receive('multiCall')
+            .with_args(strict=True)
+            .once()
+            .and_return([[{'id': 1}], [[]]]))
+
+        assert koji_multicall(session, self.CALLS) == [{'id': 1}, []]
+
+    def test_multicall_retried(self):
+        session = flexmock(multicall=False)
+        session.should_receive('getBuild').twice()
+        session.should_receive('listArchives').twice()
+        (session
+            .should_receive('multiCall')
+            .and_raise(ConnectionError('Connection aborted'))
+            .and_return([[{'id': 1}], [[]]]))
+        flexmock(time).should_receive('sleep')
+
+        assert koji_multicall(KojiSessionWrapper(session), self.CALLS) == [{'id': 1}, []]
+
+    def test_no_calls(self):
+        session = flexmock()
+        session.should_receive('multiCall').never()
+
+        assert koji_multicall(session, []) == []
+
+
 class TestTaskWatcher(object):
     @pytest.mark.parametrize(('finished', 'info', 'exp_state', 'exp_failed'), [
         ([False, False, True],
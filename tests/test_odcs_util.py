@@ -6,7 +6,9 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
-from atomic_reactor.odcs_util import ODCSClient
+from atomic_reactor.odcs_util import (ODCSClient, ODCSComposeIndex, ODCS_DATETIME_FORMAT,
+                                      normalize_compose_request)
+from datetime import datetime, timedelta
 from tests.retry_mock import mock_get_retry_session
 
 import flexmock
@@ -158,6 +160,63 @@ def test_wait_for_compose(odcs_client, final_state_id, final_state_name, expect_
         odcs_client.wait_for_compose(COMPOSE_ID)
 
 
+@responses.activate
+def test_wait_for_composes(odcs_client):
+    compose_ids = [COMPOSE_ID, COMPOSE_ID + 1, COMPOSE_ID + 2]
+    # number of polls needed for each compose to finish
+    polls_needed = {COMPOSE_ID: 3, COMPOSE_ID + 1: 1, COMPOSE_ID + 2: 2}
+    polls = {compose_id: 0 for compose_id in compose_ids}
+
+    def handle_composes_get(request):
+        assert_request_token(request, odcs_client.session)
+
+        compose_id = int(request.url.rstrip('/').split('/')[-1])
+        polls[compose_id] += 1
+        if polls[compose_id] < polls_needed[compose_id]:
+            response_json = compose_json(1, 'generating', compose_id=compose_id)
+        else:
+            response_json = compose_json(2, 'done', compose_id=compose_id)
+
+        return (200, {}, response_json)
+
+    for compose_id in compose_ids:
+        responses.add_callback(responses.GET, '{}composes/{}'.format(ODCS_URL, compose_id),
+                               content_type='application/json',
+                               callback=handle_composes_get)
+
+    # Composes are polled together, so only the slowest one determines
+    # the number of retries
+    (flexmock(time)
+        .should_receive('sleep')
+        .times(max(polls_needed.values()) - 1)
+        .and_return(None))
+
+    composes = odcs_client.wait_for_composes(compose_ids)
+
+    assert [compose['id'] for compose in composes] == compose_ids
+    assert all(compose['state_name'] == 'done' for compose in composes)
+    # Finished composes are not polled again
+    assert polls == polls_needed
+
+
+@responses.activate
+def test_wait_for_composes_timeout(odcs_client):
+    def handle_composes_get(request):
+        return (200, {}, compose_json(1, 'generating'))
+
+    responses.add_callback(responses.GET, '{}composes/{}'.format(ODCS_URL, COMPOSE_ID),
+                           content_type='application/json',
+                           callback=handle_composes_get)
+
+    (flexmock(time)
+        .should_receive('sleep')
+        .and_return(None))
+
+    with pytest.raises(RuntimeError) as exc_info:
+        odcs_client.wait_for_composes([COMPOSE_ID], timeout=0)
+    assert 'timed out after 0 seconds' in str(exc_info.value)
+
+
 @responses.activate
 def test_renew_compose(odcs_client):
     new_compose_id = COMPOSE_ID + 1
@@ -173,6 +232,58 @@ def test_renew_compose(odcs_client):
     odcs_client.renew_compose(COMPOSE_ID)
 
 
+@pytest.mark.parametrize(('request1', 'request2', 'equal'), (
+    ({'source_type': 'tag', 'source': 'my-tag', 'packages': ['spam', 'bacon'],
+      'sigkeys': ['R123', 'B456']},
+     {'source_type': 'tag', 'source': 'my-tag', 'packages': ['bacon', 'spam'],
+      'sigkeys': ['B456', 'R123'], 'flags': None},
+     True),
+    ({'source_type': 'module', 'source': 'eog-f26 gedit-f26'},
+     {'source_type': 'module', 'source': 'gedit-f26  eog-f26'},
+     True),
+    ({'source_type': 'tag', 'source': 'my-tag', 'packages': ['spam'], 'sigkeys': []},
+     {'source_type': 'tag', 'source': 'my-tag', 'packages': ['spam']},
+     False),
+    ({'source_type': 'pulp', 'source': 'spam', 'arches': ['x86_64']},
+     {'source_type': 'pulp', 'source': 'spam', 'arches': ['ppc64le']},
+     False),
+))
+def test_normalize_compose_request(request1, request2, equal):
+    normalized1 = normalize_compose_request(request1)
+    normalized2 = normalize_compose_request(request2)
+    assert (normalized1 == normalized2) == equal
+
+
+def test_compose_index(tmpdir):
+    index = ODCSComposeIndex(str(tmpdir.join('index', 'composes.json')))
+    live_request = {'source_type': 'tag', 'source': 'my-tag', 'packages': ['spam', 'bacon']}
+    live_compose = {
+        'id': COMPOSE_ID,
+        'time_to_expire': (datetime.utcnow() + timedelta(hours=2)).strftime(ODCS_DATETIME_FORMAT),
+    }
+    expired_request = {'source_type': 'module', 'source': MODULE_NSV}
+    expired_compose = {
+        'id': COMPOSE_ID + 1,
+        'time_to_expire': (datetime.utcnow() - timedelta(hours=2)).strftime(ODCS_DATETIME_FORMAT),
+    }
+
+    assert index.lookup(live_request) is None
+
+    index.record(live_request, live_compose)
+    index.record(expired_request, expired_compose)
+
+    # Index is persistent, another instance sees the same entries
+    index = ODCSComposeIndex(index.path)
+    assert index.lookup({'source_type': 'tag', 'source': 'my-tag',
+                         'packages': ['bacon', 'spam']}) == COMPOSE_ID
+    assert index.lookup(expired_request) is None
+
+    # Expired entries are dropped when the index is updated
+    index.record(live_request, live_compose)
+    with open(index.path) as f:
+        assert list(json.load(f).values()) == [live_compose]
+
+
 def assert_request_token(request, session):
     expected_token = None
     if ODCSClient.OIDC_TOKEN_HEADER in session.headers:
@@ -13,12 +13,13 @@ from collections import namedtuple
 
 from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
-from atomic_reactor.pulp_util import PulpHandler, LockedPulpRepository
+from atomic_reactor.pulp_util import PulpExecutor, PulpHandler, LockedPulpRepository
 from atomic_reactor.util import ImageName
-from atomic_reactor.constants import LOCKEDPULPREPOSITORY_RETRIES
+from atomic_reactor.constants import DEFAULT_PULP_WORKERS, LOCKEDPULPREPOSITORY_RETRIES
 
 import pytest
 import copy
+import threading
 import time
 from flexmock import flexmock
 from tests.constants import SOURCE, MOCK
@@ -298,6 +299,73 @@ def test_upload(unsupported, caplog):
                upload_file in caplog.text()
 
 
+@pytest.mark.skipif(dockpulp is None,
+                    reason='dockpulp module not available')
+def test_publish():
+    log = logging.getLogger("tests.test_pulp_util")
+    _, workflow = prepare()
+
+    # tasks are started without waiting, then watched together
+    (flexmock(dockpulp.Pulp)
+     .should_receive('crane')
+     .with_args(['redhat-image-name1', 'redhat-image-name2'], wait=False)
+     .and_return([1, 2])
+     .once()
+     .ordered())
+    (flexmock(dockpulp.Pulp)
+     .should_receive('watch_tasks')
+     .with_args([1, 2])
+     .once()
+     .ordered())
+
+    handler = PulpHandler(workflow, 'registry.example.com', log)
+    handler.create_dockpulp()
+    handler.publish(['redhat-image-name1', 'redhat-image-name2'])
+
+
+@pytest.mark.parametrize(('max_workers', 'expected'), [
+    (None, DEFAULT_PULP_WORKERS),
+    (2, 2),
+])
+def test_pulp_executor_limit(max_workers, expected):
+    lock = threading.Lock()
+    running = []
+    most_running = []
+
+    def operation(item):
+        with lock:
+            running.append(item)
+            most_running.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(item)
+        return item * 2
+
+    executor = PulpExecutor(max_workers)
+    assert executor.max_workers == expected
+    items = list(range(expected * 2))
+    assert executor.map(operation, items) == [item * 2 for item in items]
+    assert 1 < max(most_running) <= expected
+
+
+def test_pulp_executor_single_item():
+    threads = []
+    PulpExecutor(4).map(lambda item: threads.append(threading.current_thread()), ['repo'])
+    assert threads == [threading.current_thread()]
+    assert PulpExecutor(4).map(lambda item: item, []) == []
+
+
+def test_pulp_executor_error():
+    def operation(item):
+        if item == 'broken':
+            raise RuntimeError(item)
+        return item
+
+    with pytest.raises(RuntimeError) as exc:
+        PulpExecutor(2).map(operation, ['repo1', 'broken', 'repo2'])
+    assert 'broken' in str(exc.value)
+
+
 class TestLockedPulpRepository(object):
     def test_lock_bad_params(self):
         """
@@ -8,9 +8,19 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import absolute_import, print_function
 
+import io
+import json
+import os
+import subprocess
+import tarfile
+import time
+
+from flexmock import flexmock
 import pytest
 
-from atomic_reactor.rpm_util import rpm_qf_args, parse_rpm_output
+from atomic_reactor.rpm_util import (rpm_qf_args, parse_rpm_output, parse_rpm_records,
+                                     RPMComponent, rpm_components_to_dicts, extract_rpmdb,
+                                     query_rpmdb)
 
 FAKE_SIGMD5 = b'0' * 32
 FAKE_SIGNATURE = "RSA/SHA256, Tue 30 Aug 2016 00:00:00, Key ID 01234567890abc"
@@ -80,3 +90,247 @@ def test_parse_rpm_output():
             'signature': None,
         }
     ]
+
+
+def test_parse_rpm_records():
+    res = parse_rpm_records([
+        "name1;1.0;1;x86_64;(none);2000;" + FAKE_SIGMD5.decode() + ";23000;" +
+        FAKE_SIGNATURE + ";(none)",
+        "gpg-pubkey;64dab85d;57d33e22;(none);(none);0;(none);1473461794;(none);(none)",
+        "truncated;1.0",
+    ])
+
+    assert res == [RPMComponent('name1', '1.0', '1', 'x86_64', None, FAKE_SIGMD5.decode(),
+                                '01234567890abc')]
+    assert not hasattr(res[0], '__dict__')
+    assert res[0].to_dict() == {
+        'type': 'rpm',
+        'name': 'name1',
+        'version': '1.0',
+        'release': '1',
+        'arch': 'x86_64',
+        'epoch': None,
+        'sigmd5': FAKE_SIGMD5.decode(),
+        'signature': '01234567890abc',
+    }
+
+
+def test_rpm_components_to_dicts():
+    output = [
+        "name1;1.0;1;x86_64;(none);2000;" + FAKE_SIGMD5.decode() + ";23000;" +
+        FAKE_SIGNATURE + ";(none)",
+    ]
+    expected = parse_rpm_output(output)
+
+    assert rpm_components_to_dicts(parse_rpm_records(output)) == expected
+    # components from elsewhere, e.g. flatpak manifests, are dicts already
+    assert rpm_components_to_dicts(expected) == expected
+
+
+def parse_rpm_output_reference(output, tags=None, separator=';'):
+    """
+    Straightforward parser, looking up each field by tag name
+    """
+    if tags is None:
+        tags = ['NAME', 'VERSION', 'RELEASE', 'ARCH', 'EPOCH', 'SIZE', 'SIGMD5', 'BUILDTIME',
+                'SIGPGP:pgpsig', 'SIGGPG:pgpsig']
+
+    def field(tag):
+        try:
+            value = fields[tags.index(tag)]
+        except ValueError:
+            return None
+        return None if value == '(none)' else value
+
+    components = []
+    for rpm in output:
+        fields = rpm.rstrip('\n').split(separator)
+        if len(fields) < len(tags):
+            continue
+
+        signature = field('SIGPGP:pgpsig') or field('SIGGPG:pgpsig')
+        if signature:
+            parts = signature.split('Key ID ', 1)
+            if len(parts) > 1:
+                signature = parts[1]
+
+        epoch = field('EPOCH')
+        component_rpm = {
+            'type': 'rpm',
+            'name': field('NAME'),
+            'version': field('VERSION'),
+            'release': field('RELEASE'),
+            'arch': field('ARCH'),
+            'sigmd5': field('SIGMD5'),
+            'signature': signature,
+            'epoch': int(epoch) if epoch is not None else None,
+        }
+        if component_rpm['name'] != 'gpg-pubkey':
+            components.append(component_rpm)
+
+    return components
+
+
+def make_rpm_output(count):
+    output = []
+    for index in range(count):
+        signature = '(none)' if index % 3 else FAKE_SIGNATURE
+        output.append(';'.join([
+            'package{}'.format(index), '1.{}'.format(index % 7), '{}.fc28'.format(index % 5),
+            ('x86_64', 'noarch')[index % 2], ('(none)', '1')[index % 2],
+            str(index * 100), '{:032x}'.format(index), '1500000000',
+            signature, '(none)' if index % 5 else FAKE_SIGNATURE,
+        ]))
+    output.append('gpg-pubkey;64dab85d;57d33e22;(none);(none);0;(none);1473461794;(none);(none)')
+    return output
+
+
+@pytest.mark.parametrize(('tags', 'separator'), [
+    (None, ';'),
+    (['RELEASE', 'NAME', 'SIGGPG:pgpsig', 'VERSION'], '|'),
+    (['NAME', 'NAME', 'VERSION'], ';'),
+])
+def test_parse_rpm_output_matches_reference(tags, separator):
+    output = [line.replace(';', separator) for line in make_rpm_output(100)]
+    assert parse_rpm_output(output, tags, separator) == \
+        parse_rpm_output_reference(output, tags, separator)
+
+
+@pytest.mark.benchmark
+def test_parse_rpm_output_benchmark():
+    output = make_rpm_output(5000)
+
+    def best_of(parse, repeat=5):
+        timings = []
+        for _ in range(repeat):
+            start = time.time()
+            result = parse(output)
+            timings.append(time.time() - start)
+        return min(timings), result
+
+    reference_time, expected = best_of(parse_rpm_output_reference)
+    records_time, records = best_of(parse_rpm_records)
+    dicts_time, result = best_of(parse_rpm_output)
+
+    print('5000 packages: reference {:.1f} ms, records {:.1f} ms, dicts {:.1f} ms'
+          .format(reference_time * 1000, records_time * 1000, dicts_time * 1000))
+    assert result == expected
+    assert [record.to_dict() for record in records] == expected
+    assert dicts_time < reference_time
+
+
+def make_tar(files, fileobj, links=None):
+    with tarfile.open(fileobj=fileobj, mode='w') as tar:
+        for name, content in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+        for name, target in (links or {}).items():
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.SYMTYPE
+            info.linkname = target
+            tar.addfile(info)
+
+
+def make_image_archive(layers, links=None):
+    """
+    Create 'docker save' archive with given layers, list of [(name, content)]
+    """
+    files = []
+    names = []
+    for index, layer in enumerate(layers):
+        name = 'layer{}/layer.tar'.format(index)
+        if links and name in links:
+            names.append(name)
+            continue
+        layer_stream = io.BytesIO()
+        make_tar(layer, layer_stream)
+        files.append((name, layer_stream.getvalue()))
+        files.append(('layer{}/json'.format(index), b'{}'))
+        names.append(name)
+
+    manifest = [{'Config': 'config.json', 'RepoTags': [], 'Layers': names}]
+    files.append(('manifest.json', json.dumps(manifest).encode('utf-8')))
+
+    archive = io.BytesIO()
+    make_tar(files, archive, links)
+    archive.seek(0)
+    return archive
+
+
+def read_tree(path):
+    tree = {}
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            full_path = os.path.join(dirpath, filename)
+            with open(full_path, 'rb') as f:
+                tree[os.path.relpath(full_path, path)] = f.read()
+    return tree
+
+
+@pytest.mark.parametrize(('layers', 'rpmdb_path', 'expected'), [
+    ([[('var/lib/rpm/Packages', b'base'), ('usr/bin/rpm', b'binary')]],
+     'var/lib/rpm', {'Packages': b'base'}),
+
+    # later layers override earlier ones
+    ([[('./var/lib/rpm/Packages', b'base'), ('var/lib/rpm/Name', b'name')],
+      [('var/lib/rpm/Packages', b'updated')]],
+     'var/lib/rpm', {'Packages': b'updated', 'Name': b'name'}),
+
+    # whiteouts
+    ([[('var/lib/rpm/Packages', b'base'), ('var/lib/rpm/__db.001', b'env')],
+      [('var/lib/rpm/.wh.__db.001', b'')]],
+     'var/lib/rpm', {'Packages': b'base'}),
+    ([[('var/lib/rpm/Packages', b'base'), ('var/lib/rpm/Name', b'name')],
+      [('var/lib/rpm/.wh..wh..opq', b''), ('var/lib/rpm/Packages', b'new')]],
+     'var/lib/rpm', {'Packages': b'new'}),
+    ([[('var/lib/rpm/Packages', b'base')],
+      [('var/lib/.wh.rpm', b''), ('usr/lib/sysimage/rpm/rpmdb.sqlite', b'sqlite')]],
+     'usr/lib/sysimage/rpm', {'rpmdb.sqlite': b'sqlite'}),
+
+    ([[('usr/bin/true', b'binary')]], None, None),
+])
+def test_extract_rpmdb(tmpdir, layers, rpmdb_path, expected):
+    dest = str(tmpdir.join('rpmdb'))
+    dbpath = extract_rpmdb(make_image_archive(layers), dest)
+
+    if rpmdb_path is None:
+        assert dbpath is None
+    else:
+        assert dbpath == os.path.join(dest, 'root', rpmdb_path)
+        assert read_tree(dbpath) == expected
+        # nothing but the rpm database is extracted
+        assert list(read_tree(os.path.join(dest, 'root'))) == \
+            [os.path.join(rpmdb_path, name) for name in read_tree(dbpath)]
+
+
+def test_extract_rpmdb_linked_layer(tmpdir):
+    layers = [[('var/lib/rpm/Packages', b'base')], None]
+    links = {'layer1/layer.tar': '../layer0/layer.tar'}
+    dbpath = extract_rpmdb(make_image_archive(layers, links), str(tmpdir))
+    assert read_tree(dbpath) == {'Packages': b'base'}
+
+
+def test_extract_rpmdb_no_manifest(tmpdir):
+    archive = io.BytesIO()
+    make_tar([('repositories', b'{}')], archive)
+    archive.seek(0)
+
+    with pytest.raises(ValueError):
+        extract_rpmdb(archive, str(tmpdir))
+
+
+def test_query_rpmdb(tmpdir):
+    output = "name1;1.0;1;x86_64;0;2000;" + FAKE_SIGMD5.decode() + ";23000;(none);(none)\n"
+    expected_cmd = ['rpm', '--dbpath', str(tmpdir), '-qa', '--qf',
+                    '%{NAME};%{VERSION};%{RELEASE};%{ARCH};%{EPOCH};%{SIZE};%{SIGMD5};'
+                    '%{BUILDTIME};%{SIGPGP:pgpsig};%{SIGGPG:pgpsig}\n']
+    (flexmock(subprocess)
+        .should_receive('check_output')
+        .with_args(expected_cmd)
+        .and_return(output.encode('utf-8'))
+        .once())
+
+    lines = query_rpmdb(str(tmpdir))
+    assert lines == [output.rstrip()]
+    assert parse_rpm_output(lines)[0]['name'] == 'name1'
@@ -13,6 +13,7 @@ from atomic_reactor.source import (
     get_source_instance_for
 )
 import atomic_reactor.source
+import atomic_reactor.util
 from jsonschema import ValidationError
 
 from tests.constants import DOCKERFILE_GIT, DOCKERFILE_OK_PATH, SOURCE_CONFIG_ERROR_PATH
@@ -25,6 +26,12 @@ class TestSource(object):
         s = Source('git', 'foo')
         assert os.path.exists(s.tmpdir)
 
+    def test_git_clone_options(self):
+        gs = GitSource('git', 'foo', provider_params={'git_depth': '1',
+                                                      'git_cache_dir': '/var/cache/git'})
+        assert gs.lg.depth == 1
+        assert gs.lg.cache_dir == '/var/cache/git'
+
 
 @requires_internet
 class TestGitSource(object):
@@ -52,6 +59,40 @@ class TestPathSource(object):
         #  since second (and any subsequent) access does a bit different thing than the first one
         assert ps.get() == path
 
+    def test_mutable_files_not_linked(self, tmpdir):
+        tmpdir.ensure('foo', 'bar', 'Dockerfile').write('FROM fedora')
+        tmpdir.ensure('foo', 'bar', 'vendor.tar').write('data')
+        ps = PathSource('path', 'file://' + os.path.join(str(tmpdir), 'foo'))
+        path = ps.path
+
+        with open(os.path.join(path, 'bar', 'Dockerfile'), 'w') as f:
+            f.write('FROM rhel')
+        assert tmpdir.join('foo', 'bar', 'Dockerfile').read() == 'FROM fedora'
+
+        with open(os.path.join(path, 'bar', 'vendor.tar')) as f:
+            assert f.read() == 'data'
+
+    @pytest.mark.parametrize(('provider_params', 'linked'), [
+        (None, False),
+        ({'hardlink': False}, False),
+        ({'hardlink': 'false'}, False),
+        ({'hardlink': True}, True),
+        ({'hardlink': 'true'}, True),
+    ])
+    def test_hardlink_opt_in(self, tmpdir, provider_params, linked):
+        tmpdir.ensure('foo', 'Dockerfile').write('FROM fedora')
+        tmpdir.ensure('foo', 'vendor.tar').write('data')
+        # no copy-on-write clones, so hard links would be used if allowed
+        flexmock.flexmock(atomic_reactor.util.fcntl).should_receive('ioctl').and_raise(IOError)
+        ps = PathSource('path', 'file://' + os.path.join(str(tmpdir), 'foo'),
+                        provider_params=provider_params)
+        path = ps.path
+
+        original = os.stat(str(tmpdir.join('foo', 'vendor.tar')))
+        assert os.path.samestat(os.stat(os.path.join(path, 'vendor.tar')), original) == linked
+        assert not os.path.samestat(os.stat(os.path.join(path, 'Dockerfile')),
+                                    os.stat(str(tmpdir.join('foo', 'Dockerfile'))))
+
 
 class TestGetSourceInstanceFor(object):
     @pytest.mark.parametrize('source, expected', [
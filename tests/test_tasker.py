@@ -18,10 +18,13 @@ from tests.util import requires_internet
 
 import docker
 import docker.errors
+import logging
 import requests
 import sys
+import threading
 import time
 import atomic_reactor
+import atomic_reactor.build_context
 from docker.errors import APIError
 
 from flexmock import flexmock
@@ -280,6 +283,76 @@ def test_get_image_info_by_name_tag_in_name_nonexisten(temp_image_name):  # noqa
     assert len(response) == 0
 
 
+def test_get_image_info_does_not_list_images():
+    if MOCK:
+        mock_docker(provided_image_repotags=[input_image_name.to_str()])
+
+    flexmock(docker.APIClient).should_receive('images').never()
+    t = DockerTasker()
+    image_id = t.get_image_info_by_image_name(input_image_name)[0]['Id']
+    assert t.get_image_info_by_image_id(image_id)['Id'] == image_id
+
+
+@pytest.mark.parametrize(('created', 'expected'), [
+    ('2015-04-29T07:25:10.123456789Z', 1430292310),
+    ('2015-04-29T07:25:10Z', 1430292310),
+    ('2015-04-29T09:25:10.5+02:00', 1430292310),
+    ('2015-04-29T02:25:10-05:00', 1430292310),
+    ('yesterday', 'yesterday'),
+])
+def test_get_image_info_images_format(created, expected):
+    """Info lookups keep returning what `docker images` returns"""
+    if MOCK:
+        mock_docker()
+
+    inspect_data = {
+        'Id': 'sha256:123',
+        'Parent': 'sha256:456',
+        'RepoTags': [INPUT_IMAGE],
+        'RepoDigests': [],
+        'Created': created,
+        'Size': 1,
+        'VirtualSize': 2,
+        'Config': {'Labels': {'name': 'image'}},
+        'ContainerConfig': {},
+    }
+    flexmock(docker.APIClient).should_receive('inspect_image').and_return(inspect_data)
+
+    t = DockerTasker()
+    expected_info = {
+        'Id': 'sha256:123',
+        'ParentId': 'sha256:456',
+        'RepoTags': [INPUT_IMAGE],
+        'RepoDigests': [],
+        'Created': expected,
+        'Size': 1,
+        'VirtualSize': 2,
+        'Labels': {'name': 'image'},
+    }
+    assert t.get_image_info_by_image_name(input_image_name) == [expected_info]
+    assert t.get_image_info_by_image_id('sha256:123') == expected_info
+
+
+def test_image_info_memoized(temp_image_name):  # noqa
+    if MOCK:
+        mock_docker()
+
+    inspect_data = {'Id': 'sha256:123', 'RepoTags': [INPUT_IMAGE]}
+    (flexmock(docker.APIClient)
+        .should_receive('inspect_image')
+        .and_return(inspect_data)
+        .times(2))
+
+    t = DockerTasker()
+    for _ in range(3):
+        assert t.inspect_image(INPUT_IMAGE) == inspect_data
+        assert t.image_exists(INPUT_IMAGE)
+    t.get_image_info_by_image_name(input_image_name)[0]['RepoTags'].append('modified')
+
+    # tagging images invalidates memoized metadata
+    t.tag_image(INPUT_IMAGE, temp_image_name)
+    assert t.inspect_image(INPUT_IMAGE) == inspect_data
+
 @requires_internet  # noqa
 def test_build_image_from_path(tmpdir, temp_image_name):
     if MOCK:
@@ -297,6 +370,42 @@ def test_build_image_from_path(tmpdir, temp_image_name):
     t.remove_image(temp_image_name)
 
 
+def test_build_image_from_path_context(tmpdir, temp_image_name):  # noqa
+    """Build context is archived once and uploaded again on retries"""
+    if MOCK:
+        mock_docker()
+
+    tmpdir.join('Dockerfile').write('FROM fedora\n')
+    uploads = []
+
+    def build(fileobj, custom_context, **kwargs):
+        assert custom_context
+        uploads.append(fileobj.read())
+        if len(uploads) == 1:
+            response = flexmock(content='error', status_code=500)
+            raise APIError('build failed', response)
+        return iter([{'stream': 'Successfully built'}])
+
+    flexmock(docker.APIClient).should_receive('build').replace_with(build)
+    flexmock(time).should_receive('sleep')
+    (flexmock(atomic_reactor.build_context)
+        .should_receive('tar')
+        .once()
+        .replace_with(lambda path, exclude, fileobj: fileobj.write(b'context')))
+
+    t = DockerTasker(retry_times=1)
+    context_info = {}
+    response = t.build_image_from_path(str(tmpdir), temp_image_name,
+                                       context_cache_dir=str(tmpdir.join('cache')),
+                                       context_info=context_info)
+
+    assert list(response) == [{'stream': 'Successfully built'}]
+    assert uploads == [b'context', b'context']
+    assert context_info['size'] == len(b'context')
+    assert context_info['tar_time'] >= 0
+    assert context_info['cached'] is False
+
+
 @requires_internet  # noqa
 def test_build_image_from_git(temp_image_name):
     if MOCK:
@@ -463,3 +572,48 @@ def test_retry_generator(exc, in_init, retry_times):
     else:
         t.retry_generator(lambda *args, **kwargs: simplegen(),
                           *my_args, **my_kwargs)
+
+
+def test_cleanup_queue(caplog):
+    if MOCK:
+        mock_docker()
+
+    removal_started = threading.Event()
+    unblock = threading.Event()
+
+    def remove_container(container_id, **kwargs):
+        removal_started.set()
+        unblock.wait(10)
+
+    def remove_image(image_id, **kwargs):
+        if image_id == 'failing':
+            raise APIError('conflict', flexmock(content='conflict', status_code=409))
+        if image_id == 'missing':
+            raise APIError('not found', flexmock(content='not found', status_code=404))
+
+    flexmock(docker.APIClient, remove_container=remove_container, remove_image=remove_image)
+    flexmock(docker.APIClient).should_receive('inspect_container').and_return(
+        {'Mounts': [{'Name': 'volume', 'Source': '/mnt/volume'}]})
+
+    t = DockerTasker(retry_times=0)
+    t.cleanup_queue.remove_container('container')
+    t.cleanup_queue.remove_image('image')
+    t.cleanup_queue.remove_image('failing')
+    t.cleanup_queue.remove_image('missing')
+
+    # removal runs in the background, the caller is not blocked
+    assert removal_started.wait(10)
+    report = t.cleanup_queue.flush(timeout=0.1)
+    assert report['containers']['pending'] == ['container']
+    assert report['volumes'] == {'removed': [], 'failed': {}, 'pending': []}
+    assert report['images']['removed'] == ['image', 'missing']
+    assert list(report['images']['failed']) == ['failing']
+    warnings = [r.getMessage() for r in caplog.records if r.levelno == logging.WARNING]
+    assert any('failed to remove images failing (409' in msg for msg in warnings)
+    assert any('1 images failed to be removed' in msg for msg in warnings)
+    assert not any('missing' in msg for msg in warnings)
+
+    unblock.set()
+    report = t.cleanup_queue.flush()
+    assert report['containers']['removed'] == ['container']
+    assert report['volumes']['removed'] == ['volume']
@@ -8,6 +8,8 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+import hashlib
+import io
 import json
 import logging
 import os
@@ -27,6 +29,7 @@ from flexmock import flexmock
 from collections import OrderedDict
 import docker
 import yaml
+from dockerfile_parse import DockerfileParser
 from atomic_reactor.build import BuildResult
 from atomic_reactor.constants import (IMAGE_TYPE_DOCKER_ARCHIVE, IMAGE_TYPE_OCI, IMAGE_TYPE_OCI_TAR,
                                       MEDIA_TYPE_DOCKER_V2_SCHEMA1, MEDIA_TYPE_DOCKER_V2_SCHEMA2)
@@ -49,7 +52,8 @@ from atomic_reactor.util import (ImageName, wait_for_command, clone_git_repo,
                                  get_primary_images,
                                  get_image_upload_filename,
                                  split_module_spec, ModuleSpec,
-                                 read_yaml, read_yaml_from_file_path, OSBSLogs,
+                                 read_yaml, read_yaml_from_file_path, OSBSLogs, HashingLogFile,
+                                 ChunkedStream, image_archive_stream,
                                  get_platforms_in_limits, get_orchestrator_platforms)
 from atomic_reactor import util
 from tests.constants import (DOCKERFILE_GIT, DOCKERFILE_SHA1,
@@ -207,6 +211,80 @@ def test_clone_git_repo_by_sha1(tmpdir):
     assert os.path.isdir(os.path.join(tmpdir_path, '.git'))
 
 
+def make_local_git_repo(path, commits=3):
+    """Create git repo with given number of commits, return commit IDs, oldest first"""
+    subprocess.check_call(['git', 'init', '-q', path])
+    git = ['git', '-c', 'user.name=Test', '-c', 'user.email=test@example.com']
+    commit_ids = []
+    for index in range(commits):
+        with open(os.path.join(path, 'Dockerfile'), 'w') as f:
+            f.write('FROM fedora:{}\n'.format(index))
+        subprocess.check_call(git + ['add', 'Dockerfile'], cwd=path)
+        subprocess.check_call(git + ['commit', '-q', '-m', str(index)], cwd=path)
+        commit_ids.append(subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=path,
+                                                  universal_newlines=True).strip())
+    # make sure the default branch has the name clone_git_repo expects
+    subprocess.check_call(['git', 'branch', '-M', 'master'], cwd=path)
+    return commit_ids
+
+
+def count_git_commits(path):
+    return int(subprocess.check_output(['git', 'rev-list', '--count', 'HEAD'], cwd=path,
+                                       universal_newlines=True))
+
+
+def test_clone_git_repo_cache(tmpdir):
+    remote = str(tmpdir.join('remote'))
+    commit_ids = make_local_git_repo(remote)
+    git_url = 'file://' + remote
+    cache_dir = str(tmpdir.join('cache'))
+
+    commit_id = clone_git_repo(git_url, str(tmpdir.join('clone1')), cache_dir=cache_dir)
+    assert commit_id == commit_ids[-1]
+    mirrors = [name for name in os.listdir(cache_dir) if name.endswith('.git')]
+    assert len(mirrors) == 1
+
+    # new commits are fetched into the existing mirror
+    new_commit_id = make_local_git_repo(remote, commits=1)[0]
+    clone2 = str(tmpdir.join('clone2'))
+    assert clone_git_repo(git_url, clone2, cache_dir=cache_dir) == new_commit_id
+    assert sorted(os.listdir(cache_dir)) == [mirrors[0], mirrors[0] + '.lock']
+    assert subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                   cwd=os.path.join(cache_dir, mirrors[0]),
+                                   universal_newlines=True).strip() == new_commit_id
+
+    # clone is independent of the mirror and fetches from the original repo
+    assert not os.path.exists(os.path.join(clone2, '.git', 'objects', 'info', 'alternates'))
+    assert subprocess.check_output(['git', 'config', 'remote.origin.url'], cwd=clone2,
+                                   universal_newlines=True).strip() == git_url
+
+
+def test_clone_git_repo_cache_failure(tmpdir):
+    remote = str(tmpdir.join('remote'))
+    commit_ids = make_local_git_repo(remote)
+    flexmock(time).should_receive('sleep')
+    (flexmock(atomic_reactor.util)
+        .should_receive('update_git_mirror')
+        .and_raise(subprocess.CalledProcessError, 1, 'git fetch', output='error'))
+
+    commit_id = clone_git_repo('file://' + remote, str(tmpdir.join('clone')),
+                               cache_dir=str(tmpdir.join('cache')))
+    assert commit_id == commit_ids[-1]
+
+
+@pytest.mark.parametrize('commit_index', [None, -1, 0])
+def test_clone_git_repo_shallow(tmpdir, commit_index):
+    remote = str(tmpdir.join('remote'))
+    commit_ids = make_local_git_repo(remote, commits=5)
+    clone = str(tmpdir.join('clone'))
+    commit = None if commit_index is None else commit_ids[commit_index]
+
+    commit_id = clone_git_repo('file://' + remote, clone, commit=commit, depth=1)
+
+    assert commit_id == commit_ids[-1 if commit_index is None else commit_index]
+    assert count_git_commits(clone) < len(commit_ids)
+
+
 BUILD_FILE_CONTENTS_DOCKER = {
     "Dockerfile": "",
     "container.yaml": "",
@@ -961,6 +1039,70 @@ def test_df_parser_parent_env_wf(tmpdir, caplog, env_arg):
         assert df.labels.get('label') == 'foobar ' + env_arg[0].split('=', 1)[1]
 
 
+def test_df_parser_shared(tmpdir):
+    tmpdir.join('Dockerfile').write('FROM fedora\nLABEL name=foo\n')
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+    workflow.builder = StubInsideBuilder()
+
+    df = df_parser(str(tmpdir), workflow=workflow)
+    assert df_parser(str(tmpdir), workflow=workflow) is df
+    assert df_parser(str(tmpdir)) is not df
+
+    # content is parsed once for each version
+    parses = []
+    parse = DockerfileParser.structure.fget
+
+    def counting_parse(self):
+        parses.append(self)
+        return parse(self)
+
+    flexmock(DockerfileParser, structure=property(counting_parse))
+    assert df.baseimage == 'fedora'
+    assert df.labels == {'name': 'foo'}
+    assert len(parses) == 1
+
+    # changes are written to disk right away
+    df.labels = {'name': 'bar'}
+    assert tmpdir.join('Dockerfile').read() == 'FROM fedora\nLABEL name=bar\n'
+    assert df_parser(str(tmpdir), workflow=workflow).labels == {'name': 'bar'}
+
+    # changes made other than through the parser are picked up
+    version = df.version
+    tmpdir.join('Dockerfile').write('FROM centos\n')
+    assert df_parser(str(tmpdir), workflow=workflow).baseimage == 'centos'
+    assert df.version > version
+
+    # even when size and mtime are unchanged
+    version = df.version
+    stat = os.stat(str(tmpdir.join('Dockerfile')))
+    tmpdir.join('Dockerfile').write('FROM fedora\n')
+    os.utime(str(tmpdir.join('Dockerfile')), (stat.st_atime, stat.st_mtime))
+    assert df_parser(str(tmpdir), workflow=workflow).baseimage == 'fedora'
+    assert df.version > version
+
+    # unchanged content is not parsed again
+    del parses[:]
+    assert df_parser(str(tmpdir), workflow=workflow).baseimage == 'fedora'
+    assert df.baseimage == 'fedora'
+    assert not parses
+
+
+def test_df_parser_parent_env_cached(tmpdir):
+    tmpdir.join('Dockerfile').write('FROM fedora\nLABEL label="$test_env"\n')
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+    workflow.builder = StubInsideBuilder()
+    workflow.builder.set_inspection_data({INSPECT_CONFIG: {'Env': ['test_env=first']}})
+
+    df = df_parser(str(tmpdir), workflow=workflow)
+    assert df.labels == {'label': 'first'}
+    parent_env = workflow.df_parent_env[1]
+    assert df_parser(str(tmpdir), workflow=workflow).parent_env is parent_env
+
+    # derived again, and parsed again, once the base image changes
+    workflow.builder.set_inspection_data({INSPECT_CONFIG: {'Env': ['test_env=second']}})
+    assert df_parser(str(tmpdir), workflow=workflow).labels == {'label': 'second'}
+
+
 @pytest.mark.parametrize(('available', 'requested', 'result'), (
     (['spam', 'bacon', 'eggs'], ['spam'], True),
     (['spam', 'bacon', 'eggs'], ['spam', 'bacon'], True),
@@ -1161,6 +1303,44 @@ def test_osbs_logs_get_log_files(tmpdir):
         assert entry[1] == metadata[entry[1]['filename']]
 
 
+def test_osbs_logs_get_log_files_not_reread():
+    class OSBS(object):
+        def get_orchestrator_build_logs(self, build_id):
+            for index in range(1000):
+                yield LogEntry('x86_64', 'line {}'.format(index))
+
+    flexmock(atomic_reactor.util).should_receive('get_checksums').never()
+    output = OSBSLogs(flexmock()).get_log_files(OSBS(), 1)
+    assert len(output) == 1
+
+    logfile, metadata = output[0]
+    logfile.seek(0)
+    content = logfile.read()
+    assert content == ''.join('line {}\n'.format(index)
+                              for index in range(1000)).encode('utf-8')
+    assert metadata['filesize'] == len(content)
+    assert metadata['checksum'] == hashlib.md5(content).hexdigest()
+
+
+@pytest.mark.parametrize('buffer_size', [1, 10, 1024])
+def test_hashing_log_file(buffer_size):
+    logfile = HashingLogFile(prefix='build-x86_64', buffer_size=buffer_size)
+    chunks = [b'a' * 7, b'', b'b' * 20, b'c']
+    for chunk in chunks:
+        logfile.write(chunk)
+
+    metadata = logfile.get_metadata('x86_64.log')
+    content = b''.join(chunks)
+    assert metadata == {
+        'filename': 'x86_64.log',
+        'filesize': len(content),
+        'checksum': hashlib.md5(content).hexdigest(),
+        'checksum_type': 'md5',
+    }
+    logfile.file.seek(0)
+    assert logfile.file.read() == content
+
+
 @pytest.mark.parametrize('insecure', [
     True,
     False,
@@ -1543,3 +1723,36 @@ def test_get_inspect_for_image(insecure, found_versions, type_in_list, will_rais
     else:
         inspected = get_inspect_for_image(image, image.registry, insecure)
         assert inspected == expect_inspect
+
+
+@pytest.mark.parametrize('chunks', [
+    [],
+    [b''],
+    [b'abc'],
+    [b'ab', b'', b'cdefg', b'h'],
+    [b'x' * 10000, b'y' * 3],
+])
+def test_chunked_stream(chunks):
+    stream = io.BufferedReader(ChunkedStream(iter(chunks)))
+    data = b''
+    while True:
+        buf = stream.read(4)
+        if not buf:
+            break
+        data += buf
+    assert data == b''.join(chunks)
+
+
+@pytest.mark.parametrize('generator', [True, False])
+def test_image_archive_stream(generator):
+    data = b'a' * 5000
+    if generator:
+        response = (data[i:i + 100] for i in range(0, len(data), 100))
+    else:
+        response = io.BytesIO(data)
+
+    client = flexmock()
+    client.should_receive('get_image').with_args('image').and_return(response).once()
+    with image_archive_stream(client, 'image') as stream:
+        assert stream.read() == data
+    assert stream.closed